@@ -1,4 +1,5 @@
-from contextlib import asynccontextmanager
+import asyncio
+from contextlib import asynccontextmanager, suppress
 import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
@@ -8,13 +9,57 @@ from src.store_status.router import router as store_status_router
 from src.timezones.router import router as timezone_router
 from src.business_hours.router import router as business_hours_router
 from src.report.router import router as report_router
-from src.db import init_db
+from src.rollup.router import router as rollup_router
+from src.metrics.router import router as metrics_router
+from src.health.router import router as health_router
+from src.health.utils import readiness
+from src.metrics.utils import MetricsMiddleware
+from src.db import dispose_async_engine, engine, init_db, warm_up_async_pool, warm_up_pool
+from src.report.worker import start_worker_process, stop_worker_process
+from src.store.cache import store_metadata_cache
+from src.store_status.live import live_status
+from sqlmodel import Session
+
+
+def warm_up_store_cache():
+    with Session(engine) as session:
+        store_metadata_cache.warm_up(session)
+
+
+def rebuild_live_status():
+    with Session(engine) as session:
+        live_status.rebuild(session)
+
+
+async def warm_up():
+    with readiness.step("store_cache"):
+        await asyncio.to_thread(warm_up_store_cache)
+    with readiness.step("live_status"):
+        if settings.LIVE_STATUS_ENABLED:
+            await asyncio.to_thread(rebuild_live_status)
+    with readiness.step("pools"):
+        await asyncio.to_thread(warm_up_pool, settings.DB_POOL_WARM_CONNECTIONS)
+        await warm_up_async_pool(settings.DB_POOL_WARM_CONNECTIONS)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    init_db()
+    readiness.start()
+    with readiness.step("schema"):
+        init_db()
+    # forked before the warm up starts threads.
+    with readiness.step("worker"):
+        worker = start_worker_process() if settings.REPORT_WORKER_MODE == "process" else None
+    warming = asyncio.create_task(warm_up())
+    if not settings.FAST_START:
+        await warming
     yield
+    warming.cancel()
+    with suppress(asyncio.CancelledError, Exception):
+        await warming
+    if worker is not None:
+        stop_worker_process(*worker)
+    await dispose_async_engine()
 
 
 app: FastAPI = FastAPI(
@@ -31,6 +76,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+if settings.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
 
 
 @app.get("/")
@@ -43,6 +90,9 @@ app.include_router(store_router, tags=["store"], prefix="/store")
 app.include_router(store_status_router, tags=["store status"], prefix="/store-status")
 app.include_router(timezone_router, tags=["timezone"], prefix="/timezone")
 app.include_router(business_hours_router, tags=["business hours"], prefix="/business-hours")
+app.include_router(rollup_router, tags=["rollup"], prefix="/rollup")
+app.include_router(metrics_router, tags=["metrics"])
+app.include_router(health_router, tags=["health"])
 
 if __name__ == "__main__":
     uvicorn.run(
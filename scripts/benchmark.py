@@ -0,0 +1,502 @@
+"""Reproducible benchmarks of report generation and ingestion.
+
+`generate` loads a synthetic fleet into the configured DATABASE_URL (SQLite or Postgres): the
+number of stores, polls per store per day, the mix of timezones and the mix of business hour
+shapes are parameters, and the same seed always generates the same data.
+
+`run` times create_report, the rollup refresh, report_generator per store, POST /store-status,
+the report download, a cold start of the server (scripts/startup.py) and a 90-day range report
+against that data.
+Every benchmark runs in a fresh process, so its peak RSS is its own, and records its wall
+time, number of queries, peak RSS and rows/sec to a JSON file. `compare` flags the metrics of
+a run that regressed against a baseline run.
+
+    python -m scripts.benchmark generate --stores 2000 --polls-per-day 24 --replace
+    python -m scripts.benchmark run --output benchmark.json --repeat 3
+    python -m scripts.benchmark compare baseline.json benchmark.json --threshold 0.1
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import delete, event, func
+from sqlmodel import Session, SQLModel, select
+
+from src.business_hours.utils import bulk_insert_business_hours
+from src.config import settings
+from src.db import engine, get_async_engine, init_db
+from src.rollup.models import DailyUptime
+from src.store.models import Store
+from src.store_status.intervals import recompact_store
+from src.store_status.models import StoreStatus
+from src.store_status.utils import bulk_insert_store_statuses
+from src.timezones.utils import bulk_insert_timezones
+
+BENCHMARKS = ["create_report", "rollup_refresh", "report_generator", "ingest", "download", "startup", "range_report"]
+# local (day_of_week, start, end) business hours of each shape, "always" has no rows and is open 24x7.
+BUSINESS_HOUR_SHAPES = {
+    "always": [],
+    "day": [(day, "09:00:00", "17:00:00") for day in range(7)],
+    "long": [(day, "08:00:00", "23:00:00") for day in range(7)],
+    "split": [(day, start, end) for day in range(7) for start, end in [("11:00:00", "14:00:00"),
+                                                                        ("17:00:00", "22:00:00")]],
+    "overnight": [(day, "18:00:00", "02:00:00") for day in range(7)],
+    "weekdays": [(day, "09:00:00", "21:00:00") for day in range(5)],
+}
+# timezone name that leaves a store without a timezone row, so it falls back to the default timezone.
+DEFAULT_TIMEZONE = "default"
+# stores generated and inserted at once.
+GENERATE_BATCH_SIZE = 500
+# metrics compared against a baseline, and whether a higher value is better.
+COMPARED_METRICS = {
+    "wall_seconds": False,
+    "rows_per_second": True,
+    "queries": False,
+    "peak_rss_mb": False,
+    "p50_ms": False,
+    "p99_ms": False,
+    "import_seconds": False,
+    "ready_seconds": False,
+}
+# timings of a benchmark whose wall time changed by less than this are noise, not regressions.
+NOISE_SECONDS = 0.05
+# ingest benchmark polls are this long before the most recent poll, outside of the report's window.
+INGEST_OFFSET = timedelta(days=30)
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    """Parse `name=weight,name=weight` into weights that sum up to 1"""
+    mix = {}
+    for item in value.split(","):
+        name, _, weight = item.strip().rpartition("=")
+        if not name:
+            raise argparse.ArgumentTypeError(f"'{item}' is not name=weight")
+        mix[name] = float(weight)
+    total = sum(mix.values())
+    if total <= 0:
+        raise argparse.ArgumentTypeError("weights must add up to more than 0")
+    return {name: weight / total for name, weight in mix.items()}
+
+
+def parse_shapes(value: str) -> Dict[str, float]:
+    mix = parse_mix(value)
+    unknown = sorted(set(mix) - set(BUSINESS_HOUR_SHAPES))
+    if unknown:
+        raise argparse.ArgumentTypeError(f"unknown shapes {unknown}, must be in {sorted(BUSINESS_HOUR_SHAPES)}")
+    return mix
+
+
+class FleetGenerator:
+    """Synthetic stores, polling every 86400 / polls_per_day seconds with some jitter for `days` days up to `end`"""
+
+    def __init__(self, stores: int, polls_per_day: int, days: int, end: datetime, timezones: Dict[str, float],
+                 shapes: Dict[str, float], uptime: float, seed: int):
+        self.stores = stores
+        self.polls_per_day = polls_per_day
+        self.days = days
+        self.end = end
+        self.timezones = timezones
+        self.shapes = shapes
+        self.uptime = uptime
+        self.seed = seed
+
+    def store_ids(self, first: int, last: int) -> List[str]:
+        return [f"bench-{i:07d}" for i in range(first, last)]
+
+    def timezone_rows(self, rng: np.random.Generator, store_ids: List[str]) -> pd.DataFrame:
+        names = rng.choice(list(self.timezones), size=len(store_ids), p=list(self.timezones.values()))
+        df = pd.DataFrame({"store_id": store_ids, "timezone_str": names})
+        return df[df["timezone_str"] != DEFAULT_TIMEZONE]
+
+    def business_hour_rows(self, rng: np.random.Generator, store_ids: List[str]) -> pd.DataFrame:
+        shapes = rng.choice(list(self.shapes), size=len(store_ids), p=list(self.shapes.values()))
+        rows = [(store_id, day, start, end) for store_id, shape in zip(store_ids, shapes)
+                for day, start, end in BUSINESS_HOUR_SHAPES[shape]]
+        return pd.DataFrame(rows, columns=["store_id", "day_of_week", "start_time_local", "end_time_local"])
+
+    def poll_rows(self, rng: np.random.Generator, store_ids: List[str]) -> pd.DataFrame:
+        polls = self.polls_per_day * self.days
+        interval = 86400 / self.polls_per_day
+        # one poll at a random point of each interval, so a store's polls never collide.
+        offsets = (np.arange(polls) + rng.random((len(store_ids), polls))) * interval
+        start = np.datetime64(self.end - timedelta(days=self.days), "us")
+        timestamps = start + (offsets * 1_000_000).astype("timedelta64[us]")
+        # stores differ in how often they are up, around the requested mean.
+        uptime = rng.beta(self.uptime * 10, (1 - self.uptime) * 10, size=(len(store_ids), 1))
+        active = rng.random((len(store_ids), polls)) < uptime
+        return pd.DataFrame({
+            "store_id": np.repeat(store_ids, polls),
+            "status": np.where(active.ravel(), "active", "inactive"),
+            "timestamp_utc": pd.to_datetime(timestamps.ravel()),
+        })
+
+    def load(self, session: Session) -> dict:
+        rng = np.random.default_rng(self.seed)
+        counts = {"stores": 0, "timezones": 0, "business_hours": 0, "polls": 0}
+        for first in range(0, self.stores, GENERATE_BATCH_SIZE):
+            store_ids = self.store_ids(first, min(first + GENERATE_BATCH_SIZE, self.stores))
+            # timezones and business hours first, so the polls' rollup days are created in the right timezone.
+            counts["timezones"] += bulk_insert_timezones(session, self.timezone_rows(rng, store_ids))
+            counts["business_hours"] += bulk_insert_business_hours(session, self.business_hour_rows(rng, store_ids))
+            counts["polls"] += bulk_insert_store_statuses(session, self.poll_rows(rng, store_ids))
+            counts["stores"] += len(store_ids)
+            print(f"generated {counts['stores']}/{self.stores} stores, {counts['polls']} polls.")
+        return counts
+
+
+class QueryCounter:
+    """Counts the statements executed by the sync and async engines of this process"""
+
+    def __init__(self):
+        self.queries = 0
+        for db_engine in [engine, get_async_engine().sync_engine]:
+            event.listen(db_engine, "before_cursor_execute", self.count)
+
+    def count(self, *_):
+        self.queries += 1
+
+
+def peak_rss_mb() -> float:
+    """Peak RSS of this process or of the largest of its children (report shard processes), ru_maxrss is in KiB"""
+    return round(max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                     resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024, 1)
+
+
+def percentile_ms(latencies: List[float], q: float) -> float:
+    latencies = sorted(latencies)
+    return round(latencies[min(len(latencies) - 1, int(round(q / 100 * (len(latencies) - 1))))] * 1000, 3)
+
+
+def sample_store_ids(session: Session, sample: int) -> List[str]:
+    """Evenly spaced store_ids, the same ones on every run"""
+    store_ids = session.exec(select(Store.store_id).order_by(Store.store_id)).all()
+    step = max(1, len(store_ids) // sample)
+    return store_ids[::step][:sample]
+
+
+def bench_create_report(session: Session, counter: QueryCounter, args) -> dict:
+    from src.report.utils import create_report
+    from src.report.version import get_data_version
+    from src.rollup.utils import refresh_report_days
+
+    # the rollup is kept up to date by ingestion, time the report on a refreshed rollup.
+    if settings.REPORT_USE_ROLLUP:
+        refresh_report_days(session, get_data_version(session).watermark_utc)
+    counter.queries = 0
+    start = time.perf_counter()
+    result = create_report("benchmark", session)
+    wall = time.perf_counter() - start
+    if "error" in result:
+        raise RuntimeError(result["error"])
+    return {"wall_seconds": wall, "queries": counter.queries, "rows": result["stores"]}
+
+
+def bench_rollup_refresh(session: Session, counter: QueryCounter, args) -> dict:
+    from src.rollup.utils import mark_all_dirty, refresh_report_days
+    from src.report.version import get_data_version
+
+    max_timestamp_utc = get_data_version(session).watermark_utc
+    refresh_report_days(session, max_timestamp_utc)
+    mark_all_dirty(session)
+    session.commit()
+    counter.queries = 0
+    start = time.perf_counter()
+    rows = refresh_report_days(session, max_timestamp_utc)
+    return {"wall_seconds": time.perf_counter() - start, "queries": counter.queries, "rows": rows}
+
+
+def bench_report_generator(session: Session, counter: QueryCounter, args) -> dict:
+    from src.report.utils import report_generator
+
+    stores = [Store(store_id=store_id) for store_id in sample_store_ids(session, args.sample)]
+    latencies = []
+    counter.queries = 0
+    start = time.perf_counter()
+    for store in stores:
+        store_start = time.perf_counter()
+        report_generator(store, session)
+        latencies.append(time.perf_counter() - store_start)
+    return {"wall_seconds": time.perf_counter() - start, "queries": counter.queries, "rows": len(stores),
+            "p50_ms": percentile_ms(latencies, 50), "p99_ms": percentile_ms(latencies, 99)}
+
+
+def bench_ingest(session: Session, counter: QueryCounter, args) -> dict:
+    from fastapi.testclient import TestClient
+    from main import app
+
+    store_ids = sample_store_ids(session, args.sample)
+    first = session.exec(select(func.max(StoreStatus.timestamp_utc))).first() - INGEST_OFFSET
+    last = first + timedelta(milliseconds=args.requests)
+    latencies, errors = [], 0
+    try:
+        with TestClient(app) as client:
+            counter.queries = 0
+            start = time.perf_counter()
+            for i in range(args.requests):
+                payload = {"store_id": store_ids[i % len(store_ids)], "status": "active",
+                           "timestamp_utc": (first + timedelta(milliseconds=i)).isoformat()}
+                request_start = time.perf_counter()
+                response = client.post("/store-status/", json=payload)
+                latencies.append(time.perf_counter() - request_start)
+                errors += response.status_code != 200
+            wall = time.perf_counter() - start
+            queries = counter.queries
+    finally:
+        # leave the data as it was, so every run ingests into the same tables.
+        session.exec(delete(StoreStatus).where(StoreStatus.timestamp_utc >= first, StoreStatus.timestamp_utc <= last))
+        for store_id in store_ids:
+            recompact_store(session, store_id, first, last)
+        session.exec(delete(DailyUptime).where(DailyUptime.local_date >= (first - timedelta(days=1)).date(),
+                                               DailyUptime.local_date <= (last + timedelta(days=2)).date()))
+        session.commit()
+    return {"wall_seconds": wall, "queries": queries, "rows": args.requests - errors, "errors": errors,
+            "p50_ms": percentile_ms(latencies, 50), "p99_ms": percentile_ms(latencies, 99)}
+
+
+def bench_download(session: Session, counter: QueryCounter, args) -> dict:
+    from fastapi.testclient import TestClient
+    from main import app
+    from src.report.utils import create_report
+
+    result = create_report("benchmark-download", session)
+    if "error" in result:
+        raise RuntimeError(result["error"])
+    with TestClient(app) as client:
+        counter.queries = 0
+        start = time.perf_counter()
+        lines, size = 0, 0
+        with client.stream("GET", "/report/download/benchmark-download") as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                lines += 1
+                size += len(line) + 1
+        wall = time.perf_counter() - start
+    # the header row isn't a store.
+    return {"wall_seconds": wall, "queries": counter.queries, "rows": lines - 1, "bytes": size}
+
+
+def bench_startup(session: Session, counter: QueryCounter, args) -> dict:
+    # this process has imported numpy and pandas already, the server starts in a process of its own.
+    output = subprocess.run([sys.executable, "-m", "scripts.startup"], capture_output=True, text=True, check=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def bench_range_report(session: Session, counter: QueryCounter, args) -> dict:
+    from src.report.models import Granularity
+    from src.report.ranges import ReportRange, earliest_start
+    from src.report.utils import create_report
+    from src.report.version import get_data_version
+
+    watermark_utc = get_data_version(session).watermark_utc
+    report_range = ReportRange(max(watermark_utc - timedelta(days=90), earliest_start(watermark_utc)), watermark_utc,
+                               Granularity.day)
+    # the prefix sums are kept up to date by every range report, time a report on refreshed ones.
+    create_report("benchmark-range", session, report_range=report_range)
+    counter.queries = 0
+    start = time.perf_counter()
+    result = create_report("benchmark-range", session, report_range=report_range)
+    wall = time.perf_counter() - start
+    if "error" in result:
+        raise RuntimeError(result["error"])
+    return {"wall_seconds": wall, "queries": counter.queries, "rows": result["stores"]}
+
+
+RUNNERS: Dict[str, Callable[[Session, QueryCounter, argparse.Namespace], dict]] = {
+    "create_report": bench_create_report,
+    "rollup_refresh": bench_rollup_refresh,
+    "report_generator": bench_report_generator,
+    "ingest": bench_ingest,
+    "download": bench_download,
+    "startup": bench_startup,
+    "range_report": bench_range_report,
+}
+
+
+def run_one(args):
+    """Runs in a fresh process of its own, started by `run`"""
+    counter = QueryCounter()
+    with Session(engine) as session:
+        result = RUNNERS[args.benchmark](session, counter, args)
+    result["rows_per_second"] = result["rows"] / max(result["wall_seconds"], 1e-9)
+    result.setdefault("peak_rss_mb", peak_rss_mb())
+    with open(args.result, "w") as file:
+        json.dump(result, file)
+
+
+def run_in_process(benchmark: str, args) -> dict:
+    env = {**os.environ, "REPORT_WORKER_MODE": "external"}
+    with tempfile.NamedTemporaryFile(suffix=".json") as result:
+        command = [sys.executable, "-m", "scripts.benchmark", "run-one", benchmark, "--result", result.name,
+                   "--sample", str(args.sample), "--requests", str(args.requests)]
+        subprocess.run(command, env=env, check=True, stdout=subprocess.DEVNULL if not args.verbose else None)
+        with open(result.name) as file:
+            return json.load(file)
+
+
+def median_result(results: List[dict]) -> dict:
+    """Median of every numeric metric of repeated runs"""
+    median = {key: statistics.median(result[key] for result in results) for key in results[0]}
+    median["runs"] = len(results)
+    return {key: round(value, 4) if isinstance(value, float) else value for key, value in median.items()}
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def run_metadata() -> dict:
+    with Session(engine) as session:
+        stores = session.exec(select(func.count()).select_from(Store)).one()
+        polls = session.exec(select(func.count()).select_from(StoreStatus)).one()
+    return {
+        "created_at": datetime.utcnow().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "database": engine.dialect.name,
+        "stores": stores,
+        "polls": polls,
+        "settings": {key: value for key, value in settings.dict().items()
+                     if key.startswith(("REPORT_", "DB_")) and key != "REPORT_WORKER_MODE"},
+    }
+
+
+def run(args):
+    init_db()
+    output = {"meta": run_metadata(), "benchmarks": {}}
+    if not output["meta"]["stores"]:
+        sys.exit("the database has no stores, load some with `python -m scripts.benchmark generate` first.")
+    for benchmark in args.benchmarks:
+        results = []
+        for i in range(args.repeat):
+            results.append(run_in_process(benchmark, args))
+            print(f"{benchmark} run {i + 1}/{args.repeat}: {results[-1]['wall_seconds']:.3f}s, "
+                  f"{results[-1]['rows_per_second']:.0f} rows/sec, {results[-1]['queries']} queries, "
+                  f"{results[-1]['peak_rss_mb']} MB peak RSS.")
+        output["benchmarks"][benchmark] = median_result(results)
+    with open(args.output, "w") as file:
+        json.dump(output, file, indent=4)
+    print(f"wrote {args.output}.")
+    if args.baseline:
+        with open(args.baseline) as file:
+            sys.exit(1 if compare_runs(json.load(file), output, args.threshold) else 0)
+
+
+def compare_runs(baseline: dict, current: dict, threshold: float) -> List[str]:
+    """Print the change of every metric, returns the regressions: metrics worse than the baseline by more than
+    threshold (any increase of the number of queries)"""
+    regressions = []
+    for benchmark, base in baseline["benchmarks"].items():
+        if benchmark not in current["benchmarks"]:
+            print(f"{benchmark}: missing from the current run.")
+            continue
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            if metric not in base or metric not in current["benchmarks"][benchmark]:
+                continue
+            before, after = base[metric], current["benchmarks"][benchmark][metric]
+            change = (after - before) / before if before else 0.0
+            worse = -change if higher_is_better else change
+            allowed = 0 if metric == "queries" else threshold
+            noise = metric not in ("queries", "peak_rss_mb") and \
+                abs(current["benchmarks"][benchmark]["wall_seconds"] - base["wall_seconds"]) < NOISE_SECONDS
+            flag = "REGRESSION" if worse > allowed and not noise else ""
+            if flag:
+                regressions.append(f"{benchmark}.{metric}")
+            print(f"{benchmark:>18} {metric:>16} {before:>14.3f} -> {after:>14.3f} {change:>+8.1%} {flag}")
+    if baseline["meta"].get("stores") != current["meta"].get("stores") or \
+            baseline["meta"].get("polls") != current["meta"].get("polls"):
+        print("warning: the runs were made on different data.")
+    print(f"{len(regressions)} regressions." if regressions else "no regressions.")
+    return regressions
+
+
+def compare(args):
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    with open(args.current) as file:
+        current = json.load(file)
+    sys.exit(1 if compare_runs(baseline, current, args.threshold) else 0)
+
+
+def generate(args):
+    if args.replace:
+        SQLModel.metadata.drop_all(engine)
+    init_db()
+    with Session(engine) as session:
+        if session.exec(select(func.count()).select_from(Store)).one() and not args.replace:
+            sys.exit("the database already has stores, pass --replace to drop every table first.")
+        generator = FleetGenerator(args.stores, args.polls_per_day, args.days, args.end, args.timezones,
+                                   args.business_hours, args.uptime, args.seed)
+        start = time.perf_counter()
+        counts = generator.load(session)
+    elapsed = time.perf_counter() - start
+    print(f"loaded {counts} in {elapsed:.2f} seconds ({counts['polls'] / max(elapsed, 1e-9):.0f} polls/sec).")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark report generation and ingestion on synthetic data.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    generate_parser = commands.add_parser("generate", help="load a synthetic fleet into the database")
+    generate_parser.add_argument("--stores", type=int, default=2000)
+    generate_parser.add_argument("--polls-per-day", type=int, default=24)
+    generate_parser.add_argument("--days", type=int, default=9, help="days of polls up to --end")
+    generate_parser.add_argument("--end", type=datetime.fromisoformat, default=datetime(2023, 1, 25, 18))
+    generate_parser.add_argument("--timezones", type=parse_mix,
+                                 default="America/Chicago=4,America/New_York=3,America/Los_Angeles=2,"
+                                         "Asia/Kolkata=1,default=1",
+                                 help=f"name=weight mix of timezones, '{DEFAULT_TIMEZONE}' leaves stores without one")
+    generate_parser.add_argument("--business-hours", type=parse_shapes,
+                                 default="always=2,day=3,long=2,split=1,overnight=1,weekdays=1",
+                                 help=f"name=weight mix of the shapes {sorted(BUSINESS_HOUR_SHAPES)}")
+    generate_parser.add_argument("--uptime", type=float, default=0.9, help="mean share of active polls")
+    generate_parser.add_argument("--seed", type=int, default=42)
+    generate_parser.add_argument("--replace", action="store_true", help="drop every table first")
+    generate_parser.set_defaults(handler=generate)
+
+    run_parser = commands.add_parser("run", help="run the benchmarks and write their results as JSON")
+    run_parser.add_argument("--output", default="benchmark.json")
+    run_parser.add_argument("--benchmarks", nargs="+", choices=BENCHMARKS, default=BENCHMARKS)
+    run_parser.add_argument("--repeat", type=int, default=1, help="runs of each benchmark, the median is recorded")
+    run_parser.add_argument("--baseline", help="compare the results with this run, exit 1 on regressions")
+    run_parser.add_argument("--threshold", type=float, default=0.1)
+    run_parser.add_argument("--verbose", action="store_true", help="show the output of the benchmarked code")
+    run_parser.set_defaults(handler=run)
+
+    for sub_parser in [run_parser, commands.add_parser("run-one", help=argparse.SUPPRESS)]:
+        sub_parser.add_argument("--sample", type=int, default=200, help="stores used by the per-store benchmarks")
+        sub_parser.add_argument("--requests", type=int, default=2000, help="POST /store-status requests")
+    run_one_parser = commands.choices["run-one"]
+    run_one_parser.add_argument("benchmark", choices=BENCHMARKS)
+    run_one_parser.add_argument("--result", required=True)
+    run_one_parser.set_defaults(handler=run_one)
+
+    compare_parser = commands.add_parser("compare", help="flag the regressions of a run against a baseline run")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.1,
+                                help="relative change above which a metric has regressed")
+    compare_parser.set_defaults(handler=compare)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Load test of the hot endpoints of a running server.
+
+Keeps `--concurrency` requests in flight for `--duration` seconds and reports the sustained
+requests/sec and latency percentiles of each scenario.
+
+    python -m scripts.load_test --host http://localhost:8000 --scenario mixed --concurrency 64 --duration 20
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import time
+from datetime import datetime, timedelta, timezone
+
+import aiohttp
+
+SCENARIOS = ["ingest", "store", "report-status", "store-report", "mixed"]
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+class LoadTest:
+    def __init__(self, host: str, store_ids: list, report_id: str):
+        self.host = host
+        self.store_ids = store_ids
+        self.report_id = report_id
+        self.counter = itertools.count()
+        # polls get unique timestamps, so every ingest request inserts a row.
+        self.start = datetime.now(timezone.utc)
+
+    def ingest(self, session: aiohttp.ClientSession):
+        i = next(self.counter)
+        payload = {"store_id": self.store_ids[i % len(self.store_ids)], "status": "active",
+                   "timestamp_utc": (self.start + timedelta(microseconds=i)).isoformat()}
+        return session.post(f"{self.host}/store-status/", json=payload)
+
+    def store(self, session: aiohttp.ClientSession):
+        i = next(self.counter)
+        return session.get(f"{self.host}/store/{self.store_ids[i % len(self.store_ids)]}")
+
+    def report_status(self, session: aiohttp.ClientSession):
+        return session.get(f"{self.host}/report/get_report/{self.report_id}")
+
+    def store_report(self, session: aiohttp.ClientSession):
+        i = next(self.counter)
+        return session.get(f"{self.host}/report/store/{self.store_ids[i % len(self.store_ids)]}")
+
+    def request(self, scenario: str, session: aiohttp.ClientSession):
+        if scenario == "mixed":
+            scenario = ["ingest", "store", "report-status"][next(self.counter) % 3]
+        return {"ingest": self.ingest, "store": self.store, "report-status": self.report_status,
+                "store-report": self.store_report}[scenario](session)
+
+
+async def worker(load_test: LoadTest, scenario: str, session: aiohttp.ClientSession, deadline: float,
+                 latencies: list, errors: list):
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            async with load_test.request(scenario, session) as response:
+                await response.read()
+                if response.status >= 400:
+                    errors.append(response.status)
+                    continue
+        except aiohttp.ClientError as e:
+            errors.append(str(e))
+            continue
+        latencies.append(time.perf_counter() - start)
+
+
+async def run(host: str, scenario: str, concurrency: int, duration: float) -> dict:
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        async with session.get(f"{host}/store/all", params={"limit": 100}) as response:
+            store_ids = [store["store_id"] for store in await response.json()]
+        if not store_ids:
+            raise SystemExit("the database has no stores, seed it first.")
+        async with session.post(f"{host}/report/trigger_report") as response:
+            report_id = (await response.json())["report_id"]
+
+        load_test = LoadTest(host, store_ids, report_id)
+        latencies, errors = [], []
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(load_test, scenario, session, started + duration, latencies, errors)
+                               for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "duration_seconds": round(elapsed, 2),
+        "requests": len(latencies),
+        "errors": len(errors),
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the hot endpoints of a running server.")
+    parser.add_argument("--host", default="http://localhost:8000")
+    parser.add_argument("--scenario", choices=SCENARIOS, default="mixed")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=20)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args.host, args.scenario, args.concurrency, args.duration)), indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Schema migrations and storestatus maintenance.
+
+    python -m scripts.migrate             # apply pending migrations
+    python -m scripts.migrate status      # applied and pending migrations
+    python -m scripts.migrate maintain    # weekly partitions for new weeks (postgres)
+    python -m scripts.migrate retention   # drop polls older than STORE_STATUS_RETENTION_WEEKS
+    python -m scripts.migrate prune       # delete polls inside status intervals older than STORE_STATUS_PRUNE_DAYS
+    python -m scripts.migrate compact     # derive every status interval from the polls again
+    python -m scripts.migrate explain     # check report queries are served by indexes
+"""
+import argparse
+import json
+from datetime import timedelta
+
+from sqlmodel import Session
+
+from src.config import settings
+from src.db import engine, utcnow
+from src.migrations.utils import MIGRATIONS, current_version, migrate
+from src.report.batch import get_max_timestamp
+from src.report.plans import check_report_plan
+from src.report.version import bump_data_version
+from src.rollup.utils import mark_all_dirty
+from src.store_status.intervals import apply_interval_retention, rebuild_intervals
+from src.store_status.partitions import apply_retention, maintain_partitions
+from src.store_status.prune import prune_polls
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Schema migrations and storestatus maintenance.")
+    parser.add_argument("command", nargs="?", default="upgrade",
+                        choices=["upgrade", "status", "maintain", "retention", "prune", "compact", "explain"])
+    parser.add_argument("--retention-weeks", type=int, default=settings.STORE_STATUS_RETENTION_WEEKS)
+    parser.add_argument("--prune-days", type=int, default=settings.STORE_STATUS_PRUNE_DAYS)
+    parser.add_argument("--archive-dir", default=settings.STORE_STATUS_ARCHIVE_DIR)
+    args = parser.parse_args()
+
+    if args.command == "upgrade":
+        applied = migrate(engine)
+        print(f"applied {len(applied)} migrations.")
+    elif args.command == "status":
+        with engine.connect() as connection:
+            version = current_version(connection)
+        for migration in MIGRATIONS:
+            state = "applied" if migration.version <= version else "pending"
+            print(f"{migration.version:>4} {state:<8} {migration.name}")
+    elif args.command == "maintain":
+        with engine.begin() as connection:
+            created = maintain_partitions(connection, utcnow().date(), settings.STORE_STATUS_PARTITIONS_AHEAD)
+        print(f"created partitions: {created}")
+    elif args.command == "retention":
+        if args.retention_weeks <= 0:
+            print("retention is disabled, set STORE_STATUS_RETENTION_WEEKS or pass --retention-weeks.")
+            return
+        # weeks are counted back from the most recent poll, so an idle db doesn't lose its data.
+        with Session(engine) as session:
+            max_timestamp_utc = get_max_timestamp(session)
+        if max_timestamp_utc is None:
+            return
+        cutoff = max_timestamp_utc - timedelta(weeks=args.retention_weeks)
+        with engine.begin() as connection:
+            result = apply_retention(connection, cutoff)
+            result["deleted_intervals"] = apply_interval_retention(connection, cutoff)
+            bump_data_version(connection)
+        print(json.dumps(result))
+    elif args.command == "prune":
+        if args.prune_days <= 0:
+            print("pruning is disabled, set STORE_STATUS_PRUNE_DAYS or pass --prune-days.")
+            return
+        # the polls pruned don't change any report, the data version stays.
+        with Session(engine) as session:
+            max_timestamp_utc = get_max_timestamp(session)
+            if max_timestamp_utc is None:
+                return
+            result = prune_polls(session, max_timestamp_utc - timedelta(days=args.prune_days), args.archive_dir)
+        print(json.dumps(result))
+    elif args.command == "compact":
+        with Session(engine) as session:
+            intervals = rebuild_intervals(session.connection())
+            mark_all_dirty(session)
+            bump_data_version(session)
+            session.commit()
+        print(f"derived {intervals} status intervals.")
+    elif args.command == "explain":
+        with Session(engine) as session:
+            max_timestamp_utc = get_max_timestamp(session)
+        if max_timestamp_utc is None:
+            print("no polls.")
+            return
+        with engine.connect() as connection:
+            result = check_report_plan(connection, max_timestamp_utc)
+        print(json.dumps(result, indent=4, default=str))
+        if not result["ok"]:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+"""Report worker, runs the reports queued by POST /report/trigger_report.
+
+Set REPORT_WORKER_MODE=external on the server and run the worker on its own:
+
+    python -m scripts.report_worker --concurrency 2
+"""
+import argparse
+import signal
+from datetime import timedelta
+from threading import Event
+
+from src.config import settings
+from src.report.worker import ReportWorker
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the queued reports.")
+    parser.add_argument("--concurrency", type=int, default=settings.REPORT_QUEUE_CONCURRENCY)
+    parser.add_argument("--poll-seconds", type=float, default=settings.REPORT_QUEUE_POLL_SECONDS)
+    args = parser.parse_args()
+
+    stop = Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stop.set())
+    ReportWorker(args.concurrency, args.poll_seconds, timedelta(seconds=settings.REPORT_JOB_STALE_SECONDS)).run(stop)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Compute a report in shards on several local report workers sharing the configured database.
+
+Starts --workers `python -m scripts.report_worker` processes with REPORT_SHARD_MODE=distributed,
+queues a full report and waits for it: the worker that claims the job coordinates it, every
+worker claims its shards. --abandon leases that many shards to a worker that never renews
+them, as if it had died, to see them claimed again once their --lease-seconds run out.
+--check compares the merged report against one computed in this process.
+
+    python -m scripts.sharded_report --workers 3 --shard-size 500 --abandon 1 --lease-seconds 10 --check
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+from collections import Counter
+from typing import Dict
+from uuid import uuid4
+
+from sqlmodel import Session
+
+from src.config import settings
+from src.db import engine, init_db
+from src.report.jobs import create_job, get_job
+from src.report.models import ReportState
+from src.report.shards import ShardMode, claim_shards, list_shards, remove_partial_files
+from src.report.storage import iter_stored_rows, store_report_to_disk
+from src.report.utils import iter_report_rows
+
+# worker id of the shards leased by --abandon.
+ABANDONED_WORKER_ID = "abandoned-worker"
+# seconds between two reads of the report's shards.
+POLL_SECONDS = 0.2
+
+
+def start_workers(args) -> list:
+    env = {**os.environ, "REPORT_WORKER_MODE": "external", "REPORT_SHARD_MODE": ShardMode.distributed,
+           "REPORT_SHARD_SIZE": str(args.shard_size), "REPORT_SHARD_LEASE_SECONDS": str(args.lease_seconds),
+           "REPORT_QUEUE_POLL_SECONDS": str(POLL_SECONDS)}
+    output = None if args.verbose else subprocess.DEVNULL
+    return [subprocess.Popen([sys.executable, "-m", "scripts.report_worker", "--concurrency", str(args.concurrency),
+                              "--poll-seconds", str(POLL_SECONDS)], env=env, stdout=output)
+            for _ in range(args.workers)]
+
+
+def wait_for_report(session: Session, report_id: str, args) -> Dict[str, int]:
+    """Wait until the report finishes, returns the number of shards completed by every worker"""
+    completed_by, abandoned = {}, args.abandon
+    deadline = time.perf_counter() + args.timeout
+    while time.perf_counter() < deadline:
+        session.commit()
+        if abandoned:
+            abandoned -= len(claim_shards(session, ABANDONED_WORKER_ID, abandoned, report_id))
+        for shard in list_shards(session, report_id):
+            if shard.state == ReportState.complete.value:
+                completed_by[shard.shard] = shard.worker_id
+        job = get_job(session, report_id)
+        if job.state in (ReportState.complete.value, ReportState.failed.value):
+            if job.state == ReportState.failed.value:
+                sys.exit(f"report {report_id} failed: {job.error}")
+            return Counter(completed_by.values())
+        time.sleep(POLL_SECONDS)
+    sys.exit(f"report {report_id} didn't finish in {args.timeout} seconds.")
+
+
+def check_report(session: Session, report_id: str) -> bool:
+    """Compare the report against the rows computed by this process as of the same poll"""
+    expected_id = f"{report_id}-check"
+    store_report_to_disk(expected_id, iter_report_rows(session, get_job(session, report_id).watermark_utc))
+    try:
+        rows, mismatches = 0, 0
+        expected = iter_stored_rows(expected_id)
+        for row in iter_stored_rows(report_id):
+            rows += 1
+            mismatches += row != next(expected, None)
+        mismatches += sum(1 for _ in expected)
+    finally:
+        remove_partial_files(expected_id)
+    print(f"{rows} rows, {mismatches} differ from the report computed in a single process.")
+    return mismatches == 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute a report in shards on several local report workers.")
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=1, help="REPORT_QUEUE_CONCURRENCY of every worker")
+    parser.add_argument("--shard-size", type=int, default=settings.REPORT_SHARD_SIZE)
+    parser.add_argument("--lease-seconds", type=float, default=settings.REPORT_SHARD_LEASE_SECONDS)
+    parser.add_argument("--abandon", type=int, default=0, help="shards leased to a worker that never renews them")
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--check", action="store_true", help="compare against a report computed in this process")
+    parser.add_argument("--verbose", action="store_true", help="show the output of the workers")
+    args = parser.parse_args()
+
+    # the leases of --abandon run out like those of the workers.
+    settings.REPORT_SHARD_LEASE_SECONDS = args.lease_seconds
+    init_db()
+    workers = start_workers(args)
+    report_id = str(uuid4())
+    try:
+        with Session(engine) as session:
+            started = time.perf_counter()
+            create_job(session, report_id)
+            completed_by = wait_for_report(session, report_id, args)
+            job = get_job(session, report_id)
+            print(f"report {report_id}: {job.stores_processed} stores in {time.perf_counter() - started:.2f}s, "
+                  f"shards completed by {dict(completed_by)}.")
+    finally:
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.wait()
+    if args.check:
+        with Session(engine) as session:
+            sys.exit(0 if check_report(session, report_id) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Cold start of a server process: how long importing the app takes, how long until it serves
+requests and until GET /ready would answer 200, how many queries its lifespan runs, and its RSS.
+
+Run it in a fresh process, it prints one JSON object; `python -m scripts.benchmark run
+--benchmarks startup` repeats it and compares it against a baseline.
+
+    python -m scripts.startup
+"""
+import argparse
+import asyncio
+import json
+import resource
+import sys
+import time
+
+# ready is polled this often once the lifespan yields.
+READY_POLL_SECONDS = 0.001
+
+
+def rss_mb() -> float:
+    """Peak RSS of this process. Linux keeps ru_maxrss across exec, so when the process that started this one
+    was bigger it reports that one, VmHWM is this process' own"""
+    try:
+        with open("/proc/self/status") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    # KiB
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def cold_start(timeout: float) -> dict:
+    # nothing but the standard library is imported before this point.
+    started = time.perf_counter()
+    import main
+    imported = time.perf_counter()
+    import_rss_mb = rss_mb()
+
+    from sqlalchemy import event
+
+    from src.db import engine, get_async_engine
+    from src.health.utils import LAZY_MODULES, readiness
+    from src.store.cache import store_metadata_cache
+
+    queries = [0]
+
+    def count(*_):
+        queries[0] += 1
+
+    for db_engine in [engine, get_async_engine().sync_engine]:
+        event.listen(db_engine, "before_cursor_execute", count)
+
+    async def start() -> dict:
+        async with main.app.router.lifespan_context(main.app):
+            serving = time.perf_counter()
+            while not readiness.ready:
+                if readiness.error is not None:
+                    raise RuntimeError(readiness.error)
+                if time.perf_counter() - serving > timeout:
+                    raise TimeoutError(f"not ready after {timeout} seconds: {readiness.steps}")
+                await asyncio.sleep(READY_POLL_SECONDS)
+            ready = time.perf_counter()
+            return {
+                "import_seconds": round(imported - started, 4),
+                "serving_seconds": round(serving - started, 4),
+                "ready_seconds": round(ready - started, 4),
+                "wall_seconds": round(ready - started, 4),
+                "queries": queries[0],
+                "import_rss_mb": import_rss_mb,
+                "peak_rss_mb": rss_mb(),
+                "rows": len(store_metadata_cache.entries),
+                "lazy_modules_imported": sum(name in sys.modules for name in LAZY_MODULES),
+            }
+
+    return asyncio.run(start())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time a cold start of the server.")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds to wait for the server to be ready")
+    args = parser.parse_args()
+    print(json.dumps(cold_start(args.timeout)))
+
+
+if __name__ == "__main__":
+    main()
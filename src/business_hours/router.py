@@ -1,6 +1,9 @@
 from fastapi import APIRouter, Depends, status, HTTPException
 from src.business_hours.models import BusinessHours
 from src.db import get_session
+from src.report.version import bump_metadata_version
+from src.rollup.utils import mark_store_dirty
+from src.store.cache import store_metadata_cache
 from sqlmodel import Session
 
 from sqlalchemy.exc import IntegrityError
@@ -15,7 +18,10 @@ def create_timezone(*, session: Session = Depends(get_session), business_hour: B
     db_business_hour = BusinessHours.from_orm(business_hour)
     try:
         session.add(db_business_hour)
+        mark_store_dirty(session, db_business_hour.store_id)
+        bump_metadata_version(session)
         session.commit()
+        store_metadata_cache.invalidate(db_business_hour.store_id)
         session.refresh(db_business_hour)
         return db_business_hour
     except IntegrityError as e:
@@ -0,0 +1,83 @@
+"""Weekly business hours compiled into sorted second-of-week intervals.
+
+A store's business hours rows are compiled once into disjoint, sorted [start, end)
+offsets from Monday 00:00 local time, with a running total of open seconds, so
+"is the store open at t" and "how long is it open in [a, b)" are binary searches.
+An interval whose end time is not after its start time crosses midnight, and the part
+of Sunday's interval that crosses into Monday wraps around to the start of the week.
+"""
+from bisect import bisect_right
+from datetime import time
+from typing import Iterable, List, Tuple
+
+DAYS_IN_WEEK = 7
+SECONDS_IN_DAY = 24 * 60 * 60
+SECONDS_IN_WEEK = DAYS_IN_WEEK * SECONDS_IN_DAY
+
+
+def seconds_of_day(value: time) -> int:
+    return value.hour * 3600 + value.minute * 60 + value.second
+
+
+def merge_intervals(intervals: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class WeeklySchedule:
+    def __init__(self, intervals: List[Tuple[int, int]]):
+        self.intervals = merge_intervals(intervals)
+        self.starts = [start for start, _ in self.intervals]
+        self.ends = [end for _, end in self.intervals]
+        # open seconds before each interval.
+        self.cumulative = [0]
+        for start, end in self.intervals:
+            self.cumulative.append(self.cumulative[-1] + end - start)
+
+    @classmethod
+    def from_business_hours(cls, business_hours: Iterable) -> "WeeklySchedule":
+        """Compile BusinessHours rows, a store without any rows is open all week"""
+        intervals = []
+        for bh in business_hours:
+            start = bh.day_of_week * SECONDS_IN_DAY + seconds_of_day(bh.start_time_local)
+            end = bh.day_of_week * SECONDS_IN_DAY + seconds_of_day(bh.end_time_local)
+            if end <= start:
+                end += SECONDS_IN_DAY
+            if end > SECONDS_IN_WEEK:
+                intervals.append((0, end - SECONDS_IN_WEEK))
+                end = SECONDS_IN_WEEK
+            intervals.append((start, end))
+        if not intervals:
+            intervals.append((0, SECONDS_IN_WEEK))
+        return cls(intervals)
+
+    @property
+    def open_seconds_per_week(self) -> int:
+        return self.cumulative[-1]
+
+    def is_open(self, second_of_week: int) -> bool:
+        i = bisect_right(self.starts, second_of_week % SECONDS_IN_WEEK) - 1
+        return i >= 0 and second_of_week % SECONDS_IN_WEEK < self.ends[i]
+
+    def open_seconds_before(self, offset: int) -> int:
+        """Open seconds in [0, offset), offset counted in seconds from a Monday 00:00 and may span several weeks"""
+        weeks, second_of_week = divmod(offset, SECONDS_IN_WEEK)
+        i = bisect_right(self.starts, second_of_week) - 1
+        if i < 0:
+            return weeks * self.open_seconds_per_week
+        return (weeks * self.open_seconds_per_week + self.cumulative[i] +
+                min(second_of_week, self.ends[i]) - self.starts[i])
+
+    def open_seconds(self, start: int, end: int) -> int:
+        """Open seconds in [start, end), both counted in seconds from the same Monday 00:00"""
+        if end <= start:
+            return 0
+        return self.open_seconds_before(end) - self.open_seconds_before(start)
+
+    def open_minutes(self, start: int, end: int) -> float:
+        return self.open_seconds(start, end) / 60
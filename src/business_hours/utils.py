@@ -0,0 +1,55 @@
+from __future__ import annotations
+
+from sqlmodel import Session, select
+
+from src.business_hours.models import BusinessHours
+from src.lazy import lazy_import
+from src.report.version import bump_metadata_version
+from src.rollup.utils import mark_stores_dirty
+from src.store.cache import store_metadata_cache
+from src.store.utils import INSERT_BATCH_SIZE, insert_missing_stores
+
+pd = lazy_import("pandas")
+
+
+def parse_local_times(times: pd.Series) -> pd.Series:
+    return pd.to_datetime(times.astype(str).str.strip(), format="%H:%M:%S").dt.time
+
+
+def load_business_hours_for(session: Session, store_ids: list) -> pd.DataFrame:
+    rows = []
+    for i in range(0, len(store_ids), INSERT_BATCH_SIZE):
+        statement = select(BusinessHours.store_id, BusinessHours.day_of_week, BusinessHours.start_time_local,
+                           BusinessHours.end_time_local).where(
+            BusinessHours.store_id.in_(store_ids[i:i + INSERT_BATCH_SIZE]))
+        rows.extend(session.exec(statement).all())
+    return pd.DataFrame(rows, columns=["store_id", "day_of_week", "start_time_local", "end_time_local"])
+
+
+def bulk_insert_business_hours(session: Session, df: pd.DataFrame) -> int:
+    """Insert (store_id, day_of_week, start_time_local, end_time_local) rows, returns the number of rows inserted.
+
+    Business hours have no unique key, rows identical to existing ones are skipped so loading a file twice is safe.
+    """
+    if df.empty:
+        return 0
+    df = pd.DataFrame({
+        "store_id": df["store_id"].astype(str).str.strip(),
+        "day_of_week": df["day_of_week"].astype(int),
+        "start_time_local": parse_local_times(df["start_time_local"]),
+        "end_time_local": parse_local_times(df["end_time_local"]),
+    })
+    store_ids = sorted(df["store_id"].unique().tolist())
+    insert_missing_stores(session, store_ids)
+    existing = load_business_hours_for(session, store_ids)
+    df = df.drop_duplicates().merge(existing, how="left", indicator=True)
+    df = df[df["_merge"] == "left_only"].drop(columns="_merge")
+
+    rows = df.to_dict(orient="records")
+    for i in range(0, len(rows), INSERT_BATCH_SIZE):
+        session.execute(BusinessHours.__table__.insert(), rows[i:i + INSERT_BATCH_SIZE])
+    mark_stores_dirty(session, store_ids)
+    bump_metadata_version(session)
+    session.commit()
+    store_metadata_cache.invalidate_many(store_ids)
+    return len(rows)
@@ -16,16 +16,109 @@ class CommonSettings(BaseSettings):
 class ServerSettings(BaseSettings):
     HOST: str = "127.0.0.1"
     PORT: int = int(config.get("PORT")) or 8000
+    # serve requests while the store cache and the connection pools warm up in the background,
+    # GET /ready answers 503 until they're warm. Otherwise the server starts serving once they are.
+    FAST_START: bool = config.get("FAST_START", "true") == "true"
 
 
 class DatabaseSettings(BaseSettings):
     DATABASE_URL: str = config.get("DATABASE_URL")
+    # connection pool of each engine (sync and async), the sync sqlite engine opens a connection per checkout instead.
+    DB_POOL_SIZE: int = int(config.get("DB_POOL_SIZE") or 5)
+    DB_MAX_OVERFLOW: int = int(config.get("DB_MAX_OVERFLOW") or 10)
+    # seconds to wait for a connection from a full pool before failing.
+    DB_POOL_TIMEOUT: float = float(config.get("DB_POOL_TIMEOUT") or 30)
+    # seconds after which a pooled connection is replaced, -1 keeps connections forever.
+    DB_POOL_RECYCLE: int = int(config.get("DB_POOL_RECYCLE") or 1800)
+    # connections of each pool opened at startup, up to DB_POOL_SIZE.
+    DB_POOL_WARM_CONNECTIONS: int = int(config.get("DB_POOL_WARM_CONNECTIONS") or 2)
+
+
+class StoreSettings(BaseSettings):
+    # number of stores whose timezone and business hours are kept in memory.
+    STORE_CACHE_SIZE: int = int(config.get("STORE_CACHE_SIZE") or 100_000)
+    # seconds the live status routes trust the cache without checking for metadata written by other processes.
+    STORE_CACHE_TTL_SECONDS: float = float(config.get("STORE_CACHE_TTL_SECONDS") or 30)
+
+
+class StoreStatusSettings(BaseSettings):
+    # weeks of polls kept by the retention job, 0 keeps everything.
+    STORE_STATUS_RETENTION_WEEKS: int = int(config.get("STORE_STATUS_RETENTION_WEEKS") or 0)
+    # number of upcoming weekly partitions created ahead of time (postgres).
+    STORE_STATUS_PARTITIONS_AHEAD: int = int(config.get("STORE_STATUS_PARTITIONS_AHEAD") or 4)
+    # days of polls before the most recent one left whole by the prune job, which deletes the older polls inside
+    # status intervals. 0 keeps every poll.
+    STORE_STATUS_PRUNE_DAYS: int = int(config.get("STORE_STATUS_PRUNE_DAYS") or 0)
+    # directory the prune job archives the polls it deletes to as gzipped NDJSON, empty doesn't archive them.
+    STORE_STATUS_ARCHIVE_DIR: str = config.get("STORE_STATUS_ARCHIVE_DIR") or ""
+    # seconds the max poll timestamp is cached for before it's read from the db again.
+    WATERMARK_TTL_SECONDS: float = float(config.get("WATERMARK_TTL_SECONDS") or 30)
+    # keep the most recent polls of every store in memory for GET /store-status/live.
+    LIVE_STATUS_ENABLED: bool = config.get("LIVE_STATUS_ENABLED", "true") == "true"
+    # polls kept per store, enough to reach back over an hour of its polls.
+    LIVE_STATUS_BUFFER_SIZE: int = int(config.get("LIVE_STATUS_BUFFER_SIZE") or 64)
+    # hours of polls before the most recent one loaded into the live status when the server starts.
+    LIVE_STATUS_REBUILD_HOURS: float = float(config.get("LIVE_STATUS_REBUILD_HOURS") or 24)
+
+
+class ReportSettings(BaseSettings):
+    # number of processes computing a report, 1 computes it in the calling process.
+    REPORT_WORKERS: int = int(config.get("REPORT_WORKERS") or 1)
+    # number of stores in each shard handed to a report worker.
+    REPORT_SHARD_SIZE: int = int(config.get("REPORT_SHARD_SIZE") or 2000)
+    # "local" computes the shards of a report on REPORT_WORKERS processes of the machine running it, "distributed"
+    # records them in the reportshard table for every report worker sharing the database to claim.
+    REPORT_SHARD_MODE: str = config.get("REPORT_SHARD_MODE") or "local"
+    # seconds a claimed shard stays leased to its worker without a renewal, then another worker claims it.
+    REPORT_SHARD_LEASE_SECONDS: float = float(config.get("REPORT_SHARD_LEASE_SECONDS") or 60)
+    # read the last day/week from the daily rollup instead of recomputing them from polls.
+    REPORT_USE_ROLLUP: bool = config.get("REPORT_USE_ROLLUP", "true") == "true"
+    # "columnar" (memory mapped numpy columns) or "csv".
+    REPORT_FORMAT: str = config.get("REPORT_FORMAT") or "columnar"
+    # bytes of columns of recently served reports kept memory mapped in-process.
+    REPORT_CACHE_MAX_BYTES: int = int(config.get("REPORT_CACHE_MAX_BYTES") or 64 * 1024 * 1024)
+    # "process" runs the report worker in a child process of the server (one for all the server processes sharing
+    # REPORT_DIR), "external" expects `python -m scripts.report_worker` to be running.
+    REPORT_WORKER_MODE: str = config.get("REPORT_WORKER_MODE") or "process"
+    # number of reports a report worker runs at once.
+    REPORT_QUEUE_CONCURRENCY: int = int(config.get("REPORT_QUEUE_CONCURRENCY") or 1)
+    # seconds between two polls of the queue by a report worker.
+    REPORT_QUEUE_POLL_SECONDS: float = float(config.get("REPORT_QUEUE_POLL_SECONDS") or 1)
+    # seconds without a heartbeat after which a running job is handed to another worker.
+    REPORT_JOB_STALE_SECONDS: float = float(config.get("REPORT_JOB_STALE_SECONDS") or 120)
+    # seconds a finished report is handed out again to triggers made while the data hasn't changed, 0 disables it.
+    REPORT_RESULT_TTL_SECONDS: float = float(config.get("REPORT_RESULT_TTL_SECONDS") or 3600)
+    # number of the most recent finished reports that can be handed out again.
+    REPORT_RESULT_CACHE_SIZE: int = int(config.get("REPORT_RESULT_CACHE_SIZE") or 16)
+    # number of single-store reports kept in memory by GET /report/store/{store_id}.
+    REPORT_STORE_CACHE_SIZE: int = int(config.get("REPORT_STORE_CACHE_SIZE") or 10_000)
+    # number of the slowest stores listed in the summary of a traced report.
+    REPORT_TRACE_TOP_N: int = int(config.get("REPORT_TRACE_TOP_N") or 20)
+    # a report traced with profiling runs one in every this many batches of stores under cProfile.
+    REPORT_TRACE_PROFILE_EVERY: int = int(config.get("REPORT_TRACE_PROFILE_EVERY") or 10)
+    # directory the reports, their traces and profiles are written to.
+    REPORT_DIR: str = config.get("REPORT_DIR") or "data"
+    # directory of the per-store cumulative uptime arrays answering range reports.
+    PREFIX_SUM_DIR: str = config.get("PREFIX_SUM_DIR") or os.path.join(REPORT_DIR, "prefix-sums")
+    # days before the most recent poll covered by the cumulative arrays, range reports can't start earlier.
+    PREFIX_SUM_DAYS: int = int(config.get("PREFIX_SUM_DAYS") or 92)
+    # most periods (hours, days or weeks) per store of a range report.
+    RANGE_REPORT_MAX_PERIODS: int = int(config.get("RANGE_REPORT_MAX_PERIODS") or 744)
+
+
+class MetricsSettings(BaseSettings):
+    # record request, statement and pool metrics served by GET /metrics.
+    METRICS_ENABLED: bool = config.get("METRICS_ENABLED", "true") == "true"
 
 
 class Settings(
     CommonSettings,
     ServerSettings,
     DatabaseSettings,
+    StoreSettings,
+    StoreStatusSettings,
+    ReportSettings,
+    MetricsSettings,
 ):
     pass
 
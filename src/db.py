@@ -1,17 +1,160 @@
-from sqlmodel import SQLModel, create_engine, Session
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import URL, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
+from sqlmodel import create_engine, Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 from src.config import settings
 import src.store.models
 import src.store_status.models
 import src.business_hours.models
 import src.timezones.models
+import src.rollup.models
+import src.report.models
+import src.migrations.models
+from src.metrics.utils import instrument_engine, timed_pool
+from src.migrations.utils import is_up_to_date, migrate
+from src.store_status.partitions import maintain_partitions
+
+# imported for their tables, which the migrations create from SQLModel.metadata.
+MODELS = (src.store.models, src.store_status.models, src.business_hours.models, src.timezones.models,
+          src.rollup.models, src.report.models, src.migrations.models)
+
+# async driver of each database the sync engine may point at.
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+
+def pool_options(url) -> dict:
+    url = make_url(url)
+    if url.get_backend_name() == "sqlite" and url.get_driver_name() != "aiosqlite":
+        # a connection per checkout, sqlalchemy's default for sqlite files.
+        return {"poolclass": NullPool}
+    options = {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+        "poolclass": QueuePool,
+    }
+    if url.get_dialect().is_async:
+        # aiosqlite starts a thread per connection, pool them instead of opening one per request (asyncpg's default).
+        options["poolclass"] = AsyncAdaptedQueuePool
+    return options
+
+
+def engine_options(url, engine_name: str) -> dict:
+    options = pool_options(url)
+    if settings.METRICS_ENABLED:
+        options["poolclass"] = timed_pool(options["poolclass"], engine_name)
+    return options
+
+
+def enable_wal(dbapi_connection, _):
+    # let report progress be written while a report is streaming rows out of the db.
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.close()
+
+
+def create_db_engine():
+    db_engine = create_engine(settings.DATABASE_URL, **engine_options(settings.DATABASE_URL, "sync"))
+    if db_engine.dialect.name == "sqlite":
+        event.listen(db_engine, "connect", enable_wal)
+    if settings.METRICS_ENABLED:
+        instrument_engine(db_engine, "sync")
+    return db_engine
+
+
+def async_database_url(url: str) -> URL:
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS[url.get_backend_name()])
+
+
+_async_engine: Optional[AsyncEngine] = None
+
+
+def get_async_engine() -> AsyncEngine:
+    """The async engine is created on first use, so processes that never serve requests don't need its driver"""
+    global _async_engine
+    if _async_engine is None:
+        url = async_database_url(settings.DATABASE_URL)
+        _async_engine = create_async_engine(url, **engine_options(url, "async"))
+        if _async_engine.dialect.name == "sqlite":
+            event.listen(_async_engine.sync_engine, "connect", enable_wal)
+        if settings.METRICS_ENABLED:
+            instrument_engine(_async_engine.sync_engine, "async")
+    return _async_engine
+
 
-engine = create_engine(settings.DATABASE_URL)
+async def dispose_async_engine():
+    """Close the pooled async connections, aiosqlite's connection threads would keep the process alive"""
+    global _async_engine
+    if _async_engine is not None:
+        await _async_engine.dispose()
+        _async_engine = None
+
+
+engine = create_db_engine()
+
+
+def utcnow() -> datetime:
+    """Current time as stored in the db: naive utc"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def dialect_insert(table):
+    """INSERT statement supporting ON CONFLICT clauses on the engine's dialect"""
+    if engine.dialect.name == "postgresql":
+        return postgresql.insert(table)
+    return sqlite.insert(table)
+
+
+def byte_order(column):
+    """A column compared and ordered by code point, like python compares str. Postgres otherwise follows the
+    database's collation (en_US puts 'a-2' after 'a1'), sqlite's default collation already does"""
+    if engine.dialect.name == "postgresql":
+        return column.collate("C")
+    return column
 
 
 def init_db():
-    SQLModel.metadata.create_all(engine)
+    """Bring the schema up to date, and give new weeks of polls their partitions"""
+    if not is_up_to_date(engine):
+        migrate(engine)
+    with engine.begin() as connection:
+        maintain_partitions(connection, utcnow().date(), settings.STORE_STATUS_PARTITIONS_AHEAD)
+
+
+def warm_up_size(db_engine, connections: int) -> int:
+    """Connections worth opening ahead of time: up to the pool's size, a pool-less engine only checks it can connect"""
+    pool = db_engine.pool
+    return min(connections, pool.size() if hasattr(pool, "size") else 1)
+
+
+def warm_up_pool(connections: int):
+    """Open connections up front so the first requests don't pay for connecting, closing returns them to the pool"""
+    opened = [engine.connect() for _ in range(warm_up_size(engine, connections))]
+    for connection in opened:
+        connection.close()
+
+
+async def warm_up_async_pool(connections: int):
+    async_engine = get_async_engine()
+    opened = [await async_engine.connect() for _ in range(warm_up_size(async_engine.sync_engine, connections))]
+    for connection in opened:
+        await connection.close()
 
 
 def get_session():
     with Session(engine) as session:
         yield session
+
+
+async def get_async_session():
+    async with AsyncSession(get_async_engine(), expire_on_commit=False) as session:
+        yield session
@@ -0,0 +1,12 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+from src.health.utils import readiness
+
+router = APIRouter()
+
+
+@router.get("/ready")
+def get_readiness():
+    """200 once the schema is up to date and the caches and pools are warm, 503 until then"""
+    return JSONResponse(readiness.status(), status_code=200 if readiness.ready else 503)
@@ -0,0 +1,64 @@
+"""Startup progress of this process, reported by GET /ready.
+
+With FAST_START, the server answers requests as soon as the schema is up to date, and warms
+the store metadata cache and the connection pools in the background. A load balancer or an
+autoscaler should send traffic once the process is ready, liveness is GET /.
+"""
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Dict, Optional
+
+from src.db import engine, get_async_engine
+from src.lazy import is_imported
+
+# steps of the lifespan, in the order they run.
+STARTUP_STEPS = ["schema", "worker", "store_cache", "live_status", "pools"]
+# modules a process only imports once it ingests a file or computes a report.
+LAZY_MODULES = ["numpy", "pandas"]
+
+
+def pool_status(db_engine) -> dict:
+    pool = db_engine.pool
+    if not hasattr(pool, "checkedin"):
+        # a connection per checkout, nothing to warm.
+        return {"pooled": False}
+    return {"pooled": True, "size": pool.size(), "idle": pool.checkedin(), "checked_out": pool.checkedout()}
+
+
+class Readiness:
+    def __init__(self):
+        self.start()
+
+    def start(self):
+        """Called when the lifespan starts, an app may be started more than once in a process (tests)"""
+        self.started = perf_counter()
+        # seconds from the start to the end of every finished step.
+        self.steps: Dict[str, Optional[float]] = {name: None for name in STARTUP_STEPS}
+        self.error: Optional[str] = None
+
+    @contextmanager
+    def step(self, name: str):
+        try:
+            yield
+        except Exception as e:
+            self.error = f"{name}: {str(e)}"
+            print(f"startup step {self.error}")
+            raise
+        self.steps[name] = round(perf_counter() - self.started, 6)
+
+    @property
+    def ready(self) -> bool:
+        return self.error is None and all(seconds is not None for seconds in self.steps.values())
+
+    def status(self) -> dict:
+        return {
+            "ready": self.ready,
+            "uptime_seconds": round(perf_counter() - self.started, 3),
+            "steps": self.steps,
+            "error": self.error,
+            "pools": {"sync": pool_status(engine), "async": pool_status(get_async_engine().sync_engine)},
+            "imported": {name: is_imported(name) for name in LAZY_MODULES},
+        }
+
+
+readiness = Readiness()
@@ -0,0 +1,30 @@
+"""Modules imported on first use.
+
+numpy and pandas take a few hundred milliseconds and tens of MB to import, and a server
+process only needs them once it ingests a file or computes a report. Modules using them
+bind `np = lazy_import("numpy")` instead of `import numpy as np`: the import happens on the
+first attribute read, so they must not use the module at import time (annotations are
+deferred with `from __future__ import annotations`).
+"""
+import importlib
+import sys
+from types import ModuleType
+
+
+class LazyModule(ModuleType):
+    """Stands in for a module until one of its attributes is read"""
+
+    def __getattr__(self, name: str):
+        # the import system's module locks make concurrent first reads safe.
+        module = importlib.import_module(self.__name__)
+        # later reads find the attributes without going through __getattr__.
+        self.__dict__.update(module.__dict__)
+        return getattr(module, name)
+
+
+def lazy_import(name: str) -> ModuleType:
+    return sys.modules.get(name) or LazyModule(name)
+
+
+def is_imported(name: str) -> bool:
+    return name in sys.modules
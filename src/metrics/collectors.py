@@ -0,0 +1,41 @@
+"""Metrics read at scrape time.
+
+Reports run in the report worker's processes, whose metrics this process can't see, so the
+report metrics are read from the jobs that finished in the reportjob table since the last
+scrape. Every process serving /metrics counts every job finished after it started.
+"""
+from threading import Lock
+
+from sqlmodel import Session, select
+
+import src.db
+from src.metrics.utils import collect_pool, report_duration, report_jobs, report_stores, report_stores_per_second
+from src.report.models import ReportJob, ReportState
+
+
+class ReportJobCollector:
+    def __init__(self):
+        self.finished_after = src.db.utcnow()
+        # concurrent scrapes would count the same jobs twice.
+        self.lock = Lock()
+
+    def __call__(self):
+        with self.lock, Session(src.db.engine) as session:
+            statement = select(ReportJob).where(ReportJob.finished_at > self.finished_after).order_by(
+                ReportJob.finished_at)
+            for job in session.exec(statement):
+                self.finished_after = job.finished_at
+                report_jobs.labels(job.state).inc()
+                if job.started_at is None:
+                    continue
+                seconds = (job.finished_at - job.started_at).total_seconds()
+                report_duration.labels(job.state).observe(seconds)
+                if job.state == ReportState.complete.value:
+                    report_stores.inc(job.stores_processed)
+                    report_stores_per_second.set(job.stores_processed / seconds if seconds > 0 else 0)
+
+
+def collect_pools():
+    collect_pool(src.db.engine, "sync")
+    collect_pool(src.db.get_async_engine().sync_engine, "async")
+
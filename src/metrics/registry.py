@@ -0,0 +1,222 @@
+"""Counters, gauges and histograms rendered in the Prometheus text exposition format.
+
+Recording a value is a dict lookup and an addition on pre-allocated slots, without locks:
+under the GIL a concurrent update may rarely be lost, which a metric can afford and a lock on
+every request and statement can't. Label sets known up front are created with `labels()` at
+import time, so the hot path never allocates.
+"""
+import math
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# upper bounds (seconds) of the latency histograms' buckets.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# upper bounds (seconds) of the buckets of long running jobs.
+DURATION_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+# starlette appends the charset.
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+
+def escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{escape_label_value(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.children: Dict[Tuple[str, ...], object] = {}
+
+    def new_child(self):
+        raise NotImplementedError()
+
+    def labels(self, *values: str):
+        child = self.children.get(values)
+        if child is None:
+            if len(values) != len(self.label_names):
+                raise ValueError(f"{self.name} has labels {self.label_names}, got {values}")
+            # setdefault is atomic, two threads creating the same child end up sharing one.
+            child = self.children.setdefault(values, self.new_child())
+        return child
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError()
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def new_child(self):
+        return CounterChild()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def samples(self) -> Iterator[str]:
+        for values, child in list(self.children.items()):
+            yield f"{self.name}{format_labels(self.label_names, values)} {format_value(child.value)}"
+
+
+class GaugeChild(CounterChild):
+    __slots__ = ()
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def new_child(self):
+        return GaugeChild()
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+
+class HistogramChild:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        # one slot per bucket and one for the values above the last bound.
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.bounds = tuple(sorted(buckets))
+
+    def new_child(self):
+        return HistogramChild(self.bounds)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def samples(self) -> Iterator[str]:
+        for values, child in list(self.children.items()):
+            counts, total = list(child.counts), child.sum
+            cumulative = 0
+            for bound, count in zip(self.bounds + (math.inf,), counts):
+                cumulative += count
+                labels = format_labels(self.label_names, values, f'le="{format_value(bound)}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            yield f"{self.name}_sum{format_labels(self.label_names, values)} {format_value(total)}"
+            yield f"{self.name}_count{format_labels(self.label_names, values)} {cumulative}"
+
+
+class RateChild:
+    """Events per second over the last `window` seconds, counted in one slot per second"""
+    __slots__ = ("window", "seconds", "counts")
+
+    def __init__(self, window: int):
+        self.window = window
+        self.seconds = [0] * window
+        self.counts = [0.0] * window
+
+    def inc(self, amount: float = 1, now: Optional[float] = None):
+        second = int(now if now is not None else time.time())
+        slot = second % self.window
+        if self.seconds[slot] != second:
+            # the slot still counts a second that left the window.
+            self.seconds[slot] = second
+            self.counts[slot] = 0.0
+        self.counts[slot] += amount
+
+    def rate(self, now: Optional[float] = None) -> float:
+        second = int(now if now is not None else time.time())
+        total = sum(count for slot_second, count in zip(self.seconds, self.counts)
+                    if second - self.window < slot_second <= second)
+        return total / self.window
+
+
+class Rate(Gauge):
+    """Gauge of the rate of events over a sliding window, readable without a Prometheus to compute rate()"""
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (), window: int = 60):
+        super().__init__(name, documentation, label_names)
+        self.window = window
+
+    def new_child(self):
+        return RateChild(self.window)
+
+    def samples(self) -> Iterator[str]:
+        for values, child in list(self.children.items()):
+            yield f"{self.name}{format_labels(self.label_names, values)} {format_value(child.rate())}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[Metric] = []
+        # called before every scrape, to update gauges read from elsewhere.
+        self.collectors: List[Callable[[], None]] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, label_names))
+
+    def gauge(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, label_names))
+
+    def histogram(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, label_names, buckets))
+
+    def rate(self, name: str, documentation: str, label_names: Sequence[str] = (), window: int = 60) -> Rate:
+        return self.register(Rate(name, documentation, label_names, window))
+
+    def add_collector(self, collector: Callable[[], None]):
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self.collectors:
+            try:
+                collector()
+            except Exception as e:
+                print(f"metrics collector failed: {str(e)}")
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
@@ -0,0 +1,17 @@
+from fastapi import APIRouter
+from fastapi.responses import Response
+
+from src.metrics.collectors import ReportJobCollector, collect_pools
+from src.metrics.registry import CONTENT_TYPE
+from src.metrics.utils import registry
+
+router = APIRouter()
+
+registry.add_collector(ReportJobCollector())
+registry.add_collector(collect_pools)
+
+
+@router.get("/metrics")
+def get_metrics():
+    """Metrics of this process in the Prometheus text exposition format"""
+    return Response(content=registry.render(), media_type=CONTENT_TYPE)
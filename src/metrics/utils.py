@@ -0,0 +1,146 @@
+"""Metrics of this process and the hooks recording them.
+
+Engines are instrumented with SQLAlchemy cursor events (statement counts and times) and a
+pool class timing every checkout, requests by an ASGI middleware labelling them with their
+route template, so unmatched paths can't explode the number of label sets.
+"""
+import time
+from functools import lru_cache
+from typing import Type
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import Pool
+
+from src.metrics.registry import DURATION_BUCKETS, Registry
+
+# first word of the statements counted separately, the others are counted as OTHER.
+OPERATIONS = ("SELECT", "INSERT", "UPDATE", "DELETE", "OTHER")
+ENGINES = ("sync", "async")
+# route label of requests that didn't match a route.
+UNMATCHED_ROUTE = "unmatched"
+
+registry = Registry()
+
+http_request_duration = registry.histogram(
+    "store_monitor_http_request_duration_seconds", "Time to serve a request, until its last body chunk was sent.",
+    ["method", "route", "status"])
+db_statements = registry.counter(
+    "store_monitor_db_statements_total", "SQL statements executed.", ["engine", "operation"])
+db_statement_duration = registry.histogram(
+    "store_monitor_db_statement_duration_seconds", "Time to execute a SQL statement.", ["engine", "operation"])
+db_statement_errors = registry.counter(
+    "store_monitor_db_statement_errors_total", "SQL statements that raised an error.", ["engine"])
+db_pool_checkout_wait = registry.histogram(
+    "store_monitor_db_pool_checkout_wait_seconds", "Time to get a connection from the pool, connecting included.",
+    ["engine"])
+db_pool_connections = registry.gauge(
+    "store_monitor_db_pool_connections", "Connections of the pool by state.", ["engine", "state"])
+ingest_rows = registry.counter(
+    "store_monitor_ingest_rows_total", "Polls inserted by the ingest routes.", ["route"])
+ingest_rows_rate = registry.rate(
+    "store_monitor_ingest_rows_per_second", "Polls inserted per second over the last minute.", ["route"])
+report_jobs = registry.counter(
+    "store_monitor_report_jobs_total", "Report jobs finished since this process started.", ["state"])
+report_duration = registry.histogram(
+    "store_monitor_report_duration_seconds", "Time from a report job starting to finishing.", ["state"],
+    DURATION_BUCKETS)
+report_stores = registry.counter(
+    "store_monitor_report_stores_total", "Stores processed by the completed report jobs.")
+report_stores_per_second = registry.gauge(
+    "store_monitor_report_stores_per_second", "Stores processed per second by the last completed report job.")
+
+# pre-create the label sets of the hot path.
+for engine_name in ENGINES:
+    for operation in OPERATIONS:
+        db_statements.labels(engine_name, operation)
+        db_statement_duration.labels(engine_name, operation)
+    db_statement_errors.labels(engine_name)
+    db_pool_checkout_wait.labels(engine_name)
+for route in ("single", "bulk"):
+    ingest_rows.labels(route)
+    ingest_rows_rate.labels(route)
+
+
+def statement_operation(statement: str) -> str:
+    operation = statement[:6].upper()
+    return operation if operation in OPERATIONS else "OTHER"
+
+
+def instrument_engine(db_engine: Engine, engine_name: str):
+    """Count and time the statements of an engine (the sync_engine of an async one)"""
+    counters = {operation: (db_statements.labels(engine_name, operation),
+                            db_statement_duration.labels(engine_name, operation)) for operation in OPERATIONS}
+    errors = db_statement_errors.labels(engine_name)
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info["metrics_started_at"] = time.perf_counter()
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started_at = conn.info.pop("metrics_started_at", None)
+        count, duration = counters[statement_operation(statement)]
+        count.inc()
+        if started_at is not None:
+            duration.observe(time.perf_counter() - started_at)
+
+    def handle_error(context):
+        errors.inc()
+
+    event.listen(db_engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(db_engine, "after_cursor_execute", after_cursor_execute)
+    event.listen(db_engine, "handle_error", handle_error)
+
+
+@lru_cache(maxsize=None)
+def timed_pool(poolclass: Type[Pool], engine_name: str) -> Type[Pool]:
+    """Subclass of poolclass recording how long each checkout waited for a connection"""
+    wait = db_pool_checkout_wait.labels(engine_name)
+
+    def _do_get(self):
+        started_at = time.perf_counter()
+        try:
+            return poolclass._do_get(self)
+        finally:
+            wait.observe(time.perf_counter() - started_at)
+
+    return type(f"Timed{poolclass.__name__}", (poolclass,), {"_do_get": _do_get})
+
+
+def collect_pool(db_engine: Engine, engine_name: str):
+    pool = db_engine.pool
+    if hasattr(pool, "checkedout"):
+        db_pool_connections.labels(engine_name, "checked_out").set(pool.checkedout())
+        db_pool_connections.labels(engine_name, "idle").set(pool.checkedin())
+        db_pool_connections.labels(engine_name, "overflow").set(max(pool.overflow(), 0))
+
+
+def record_ingest(route: str, rows: int):
+    ingest_rows.labels(route).inc(rows)
+    ingest_rows_rate.labels(route).inc(rows)
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing every HTTP request by method, route template and status"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started_at = time.perf_counter()
+        status = ["500"]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = str(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            route = getattr(route, "path_format", None) or getattr(route, "path", None) or UNMATCHED_ROUTE
+            http_request_duration.labels(scope["method"], route, status[0]).observe(
+                time.perf_counter() - started_at)
@@ -0,0 +1,10 @@
+from datetime import datetime
+
+from sqlmodel import Field, SQLModel
+
+
+class SchemaMigration(SQLModel, table=True):
+    """A migration applied to the database"""
+    version: int = Field(primary_key=True)
+    name: str
+    applied_at: datetime
@@ -0,0 +1,161 @@
+"""Versioned schema migrations.
+
+Every migration runs once, in order, inside its own transaction, and is recorded in the
+schemamigration table. The first one creates the tables of the models, so later ones have
+to tolerate running against a fresh database where the models already match.
+"""
+import fcntl
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Callable, List, NamedTuple, Tuple
+
+from sqlalchemy import func, inspect, text, update
+from sqlalchemy.engine import Connection, Engine
+from sqlmodel import SQLModel, select
+
+from src.config import settings
+from src.migrations.models import SchemaMigration
+from src.report.models import DataVersion, ReportJob, ReportShard
+from src.report.version import bump_data_version
+from src.rollup.models import DailyUptime
+from src.store_status.intervals import rebuild_intervals
+from src.store_status.models import StoreStatusInterval
+from src.store_status.partitions import convert_to_partitioned, is_postgres, maintain_partitions
+
+# key of the postgres advisory lock serializing concurrent migrations.
+MIGRATION_LOCK_KEY = 7_110_312
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    upgrade: Callable[[Connection], None]
+
+
+def create_tables(connection: Connection):
+    SQLModel.metadata.create_all(connection)
+
+
+def index_store_status_by_store(connection: Connection):
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_storestatus_store_id_timestamp_utc "
+                            "ON storestatus (store_id, timestamp_utc, status)"))
+
+
+def partition_store_status(connection: Connection):
+    if not is_postgres(connection):
+        return
+    convert_to_partitioned(connection)
+    maintain_partitions(connection, datetime.now(timezone.utc).date(), settings.STORE_STATUS_PARTITIONS_AHEAD)
+
+
+def add_missing_columns(connection: Connection, table: str, columns: List[Tuple[str, str]]):
+    existing = {column["name"] for column in inspect(connection).get_columns(table)}
+    for name, column_type in columns:
+        if name not in existing:
+            connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}"))
+
+
+def queue_report_jobs(connection: Connection):
+    add_missing_columns(connection, ReportJob.__tablename__,
+                        [("request_key", "VARCHAR"), ("heartbeat_at", "TIMESTAMP")])
+    for index in ReportJob.__table__.indexes:
+        index.create(connection, checkfirst=True)
+
+
+def version_report_data(connection: Connection):
+    add_missing_columns(connection, ReportJob.__tablename__,
+                        [("watermark_utc", "TIMESTAMP"), ("data_changes", "INTEGER")])
+    DataVersion.__table__.create(connection, checkfirst=True)
+    if connection.execute(select([func.count()]).select_from(DataVersion.__table__)).scalar() == 0:
+        connection.execute(DataVersion.__table__.insert().values(id=1, changes=0))
+
+
+def trace_report_jobs(connection: Connection):
+    add_missing_columns(connection, ReportJob.__tablename__, [("trace_mode", "VARCHAR")])
+
+
+def range_report_jobs(connection: Connection):
+    add_missing_columns(connection, ReportJob.__tablename__,
+                        [("range_start_utc", "TIMESTAMP"), ("range_end_utc", "TIMESTAMP"), ("granularity", "VARCHAR")])
+    # the prefix sums refresh the stores whose days were dirtied since their last refresh.
+    for index in DailyUptime.__table__.indexes:
+        index.create(connection, checkfirst=True)
+
+
+def shard_report_jobs(connection: Connection):
+    ReportShard.__table__.create(connection, checkfirst=True)
+
+
+def compact_store_status(connection: Connection):
+    table = StoreStatusInterval.__table__
+    table.create(connection, checkfirst=True)
+    if connection.execute(select([func.count()]).select_from(table)).scalar() == 0:
+        rebuild_intervals(connection)
+    # the status of the last poll before a day now carries into it however long ago the poll was.
+    connection.execute(update(DailyUptime).values(dirty=True, dirtied_at=datetime.now(timezone.utc).replace(
+        tzinfo=None)))
+    bump_data_version(connection)
+
+
+def version_store_metadata(connection: Connection):
+    add_missing_columns(connection, DataVersion.__tablename__, [("metadata_changes", "INTEGER NOT NULL DEFAULT 0")])
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "create tables", create_tables),
+    Migration(2, "index storestatus by (store_id, timestamp_utc)", index_store_status_by_store),
+    Migration(3, "partition storestatus by week", partition_store_status),
+    Migration(4, "queue report jobs with single-flight request keys", queue_report_jobs),
+    Migration(5, "version the data reports are computed from", version_report_data),
+    Migration(6, "record the trace mode of report jobs", trace_report_jobs),
+    Migration(7, "report jobs over arbitrary ranges", range_report_jobs),
+    Migration(8, "shards of reports claimed by report workers", shard_report_jobs),
+    Migration(9, "compact storestatus into status intervals", compact_store_status),
+    Migration(10, "count the writes of store metadata", version_store_metadata),
+]
+
+
+def current_version(connection: Connection) -> int:
+    SchemaMigration.__table__.create(connection, checkfirst=True)
+    return connection.execute(select([func.max(SchemaMigration.version)])).scalar() or 0
+
+
+def latest_version() -> int:
+    return MIGRATIONS[-1].version
+
+
+def is_up_to_date(engine: Engine) -> bool:
+    """Whether every migration was applied, a single query letting a server start without taking the migration lock"""
+    with engine.begin() as connection:
+        return current_version(connection) >= latest_version()
+
+
+@contextmanager
+def sqlite_migration_lock(engine: Engine):
+    """sqlite has no advisory locks, processes migrating a database file at once take a lock file next to it"""
+    database = engine.url.database
+    if engine.dialect.name != "sqlite" or not database or database == ":memory:":
+        yield
+        return
+    with open(database + ".migration-lock", "a") as file:
+        fcntl.flock(file, fcntl.LOCK_EX)
+        yield
+
+
+def migrate(engine: Engine) -> List[Migration]:
+    """Apply the pending migrations, returns the ones applied"""
+    applied = []
+    with sqlite_migration_lock(engine):
+        for migration in MIGRATIONS:
+            with engine.begin() as connection:
+                if is_postgres(connection):
+                    connection.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+                if current_version(connection) >= migration.version:
+                    continue
+                print(f"applying migration {migration.version}: {migration.name}")
+                migration.upgrade(connection)
+                connection.execute(SchemaMigration.__table__.insert().values(
+                    version=migration.version, name=migration.name,
+                    applied_at=datetime.now(timezone.utc).replace(tzinfo=None)))
+                applied.append(migration)
+    return applied
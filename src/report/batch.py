@@ -0,0 +1,165 @@
+from datetime import date, datetime, timedelta
+from itertools import groupby, islice
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+from sqlalchemy import func, union_all
+from sqlalchemy.orm import aliased
+from sqlmodel import Session, select
+
+from src.db import byte_order
+from src.rollup.models import DailyUptime
+from src.store.cache import LOAD_BATCH_SIZE, StoreMetadata, store_metadata_cache
+from src.store.models import Store
+from src.store_status.models import StoreStatusInterval
+from src.store_status.watermark import store_status_watermark
+
+# number of rows pulled from the server-side cursor per round trip.
+STREAM_BATCH_SIZE = 10_000
+# every store's week (7 local days before the max timestamp's local day) falls inside the last 8 days, plus an
+# hour for a local day of 25 hours. The status at its start is carried in by the interval in progress.
+EVENTS_WINDOW = timedelta(days=8, hours=1)
+# only the last hour is computed from intervals when the days come from the daily rollup.
+LAST_HOUR_EVENTS_WINDOW = timedelta(hours=1)
+
+
+# (first store_id, last store_id), both inclusive, or a list of store_ids. None selects every store.
+StoreRange = Optional[Union[Tuple[str, str], List[str]]]
+
+
+class StoreReportData(NamedTuple):
+    store_id: str
+    # timezone and weekly schedule, from the store metadata cache
+    metadata: StoreMetadata
+    # (store_id, timestamp_utc, status) rows ordered by timestamp_utc
+    events: List
+    # local_date -> (uptime_minutes, downtime_minutes) from the daily rollup, if requested
+    daily_uptime: Optional[Dict[date, Tuple[float, float]]] = None
+
+
+class GroupCursor:
+    """Walks a stream of (store_id, group) pairs alongside the store list, both ordered by store_id with
+    `byte_order`, the order of python's `<`. Groups of stores missing from the list are skipped"""
+
+    def __init__(self, groups: Iterator[Tuple[str, object]]):
+        self.groups = groups
+        self.next_group = next(groups, None)
+
+    def take(self, store_id: str, default):
+        while self.next_group is not None and self.next_group[0] < store_id:
+            self.next_group = next(self.groups, None)
+        if self.next_group is None or self.next_group[0] != store_id:
+            return default
+        group = self.next_group[1]
+        self.next_group = next(self.groups, None)
+        return group
+
+
+def get_max_timestamp(session: Session) -> Optional[datetime]:
+    """The global watermark: most recent poll across all stores"""
+    return store_status_watermark.get(session)
+
+
+def in_store_range(statement, column, store_range: StoreRange):
+    if store_range is None:
+        return statement
+    if isinstance(store_range, list):
+        return statement.where(column.in_(store_range))
+    first, last = store_range
+    return statement.where(byte_order(column) >= first, byte_order(column) <= last)
+
+
+def count_stores(session: Session, store_range: StoreRange = None) -> int:
+    statement = in_store_range(select([func.count(Store.id)]), Store.store_id, store_range)
+    return session.exec(statement).one()
+
+
+def load_store_ids(session: Session, store_range: StoreRange = None) -> List[str]:
+    statement = in_store_range(select(Store.store_id), Store.store_id, store_range)
+    return session.exec(statement.order_by(byte_order(Store.store_id))).all()
+
+
+def stream_rows(session: Session, statement):
+    """Iterate over a statement's rows through a server-side cursor"""
+    return session.exec(statement.execution_options(stream_results=True)).yield_per(STREAM_BATCH_SIZE)
+
+
+def stream_store_ids(session: Session, store_range: StoreRange = None) -> Iterator[str]:
+    statement = in_store_range(select(Store.store_id), Store.store_id, store_range)
+    return stream_rows(session, statement.order_by(byte_order(Store.store_id)))
+
+
+def carried_runs_statement(start_utc: datetime, store_range: StoreRange = None):
+    """The interval in progress at start_utc of every store, however long ago it started: the latest one starting
+    before it, found with an index seek per store"""
+    previous = aliased(StoreStatusInterval)
+    latest = select(previous.id).where(previous.store_id == Store.store_id, previous.start_utc < start_utc).order_by(
+        previous.start_utc.desc()).limit(1).correlate(Store).scalar_subquery()
+    latest = select(latest.label("interval_id")).select_from(Store)
+    latest = in_store_range(latest, Store.store_id, store_range).subquery()
+    return select(StoreStatusInterval.store_id, StoreStatusInterval.start_utc, StoreStatusInterval.end_utc,
+                  StoreStatusInterval.status).join(latest, StoreStatusInterval.id == latest.c.interval_id)
+
+
+def store_events_statement(start_utc: datetime, end_utc: datetime, store_range: StoreRange = None):
+    """(store_id, timestamp_utc, status) events of the intervals starting in [start_utc, end_utc), after the one in
+    progress at start_utc. A status holds until the next interval starts, so they're all the polls that matter.
+    Like the carried intervals, only the ones of existing stores are read"""
+    window = select(StoreStatusInterval.store_id, StoreStatusInterval.start_utc.label("timestamp_utc"),
+                    StoreStatusInterval.status).join(Store, Store.store_id == StoreStatusInterval.store_id).where(
+        StoreStatusInterval.start_utc >= start_utc, StoreStatusInterval.start_utc < end_utc)
+    carried = carried_runs_statement(start_utc, store_range).subquery()
+    events = union_all(
+        select(carried.c.store_id, carried.c.start_utc.label("timestamp_utc"), carried.c.status),
+        in_store_range(window, StoreStatusInterval.store_id, store_range)).subquery()
+    return select(events.c.store_id, events.c.timestamp_utc, events.c.status).order_by(
+        byte_order(events.c.store_id), events.c.timestamp_utc)
+
+
+def stream_store_events(session: Session, start_utc: datetime, end_utc: datetime,
+                        store_range: StoreRange = None) -> Iterator[Tuple[str, List]]:
+    """Yield (store_id, events) for every store with an interval before end_utc, ordered by store_id"""
+    statement = store_events_statement(start_utc, end_utc, store_range)
+    for store_id, events in groupby(stream_rows(session, statement), key=lambda row: row.store_id):
+        yield store_id, list(events)
+
+
+def stream_daily_uptime(session: Session, first_date: date, last_date: date,
+                        store_range: StoreRange = None) -> Iterator[Tuple[str, Dict[date, Tuple[float, float]]]]:
+    """Yield (store_id, {local_date: (uptime_minutes, downtime_minutes)}) from the daily rollup, ordered by store_id"""
+    statement = select(DailyUptime.store_id, DailyUptime.local_date, DailyUptime.uptime_minutes,
+                       DailyUptime.downtime_minutes).join(Store, Store.store_id == DailyUptime.store_id).where(
+        DailyUptime.local_date >= first_date, DailyUptime.local_date <= last_date)
+    statement = in_store_range(statement, DailyUptime.store_id, store_range).order_by(
+        byte_order(DailyUptime.store_id))
+    for store_id, days in groupby(stream_rows(session, statement), key=lambda row: row.store_id):
+        yield store_id, {row.local_date: (row.uptime_minutes, row.downtime_minutes) for row in days}
+
+
+def iter_store_report_data(session: Session, max_timestamp_utc: datetime, store_range: StoreRange = None,
+                           with_daily_uptime: bool = False) -> Iterator[StoreReportData]:
+    """Yield the inputs of every store's report.
+
+    Stores, events and rollup days are all streamed ordered by store_id, so they can be
+    merged without lookups while holding only one store's data at a time. Timezones and
+    business hours come from the store metadata cache, only the stores missing from it
+    are loaded. With `with_daily_uptime`, only the intervals needed for the last hour are loaded.
+    """
+    events_window = LAST_HOUR_EVENTS_WINDOW if with_daily_uptime else EVENTS_WINDOW
+    events = GroupCursor(stream_store_events(session, max_timestamp_utc - events_window, max_timestamp_utc,
+                                             store_range))
+    daily_uptime = None
+    if with_daily_uptime:
+        # local dates are at most a day away from utc dates.
+        daily_uptime = GroupCursor(stream_daily_uptime(session, (max_timestamp_utc - EVENTS_WINDOW).date(),
+                                                       max_timestamp_utc.date() + timedelta(days=1), store_range))
+
+    store_ids = stream_store_ids(session, store_range)
+    while batch := list(islice(store_ids, LOAD_BATCH_SIZE)):
+        metadata = store_metadata_cache.get_many(session, batch)
+        for store_id in batch:
+            yield StoreReportData(
+                store_id=store_id,
+                metadata=metadata[store_id],
+                events=events.take(store_id, []),
+                daily_uptime=daily_uptime.take(store_id, {}) if daily_uptime else None,
+            )
@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+from datetime import date, datetime, timedelta, timezone, time
+from enum import Enum
+from time import perf_counter
+from typing import List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from src.business_hours.schedule import DAYS_IN_WEEK, WeeklySchedule
+from src.lazy import lazy_import
+from src.report.batch import StoreReportData
+from src.report.kernel import uptime_downtime
+from src.report.trace import BatchTrace
+
+np = lazy_import("numpy")
+
+# [start, end) in seconds since the epoch
+Window = Tuple[int, int]
+
+
+class StoreStatusEnum(str, Enum):
+    active = "active"
+    inactive = "inactive"
+
+
+def as_utc(timestamp: datetime) -> datetime:
+    """Timestamps are stored in UTC, but may come back from the db without tzinfo"""
+    if timestamp.tzinfo is None:
+        return timestamp.replace(tzinfo=timezone.utc)
+    return timestamp
+
+
+def as_naive_utc(timestamp: datetime) -> datetime:
+    if timestamp.tzinfo is None:
+        return timestamp
+    return timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def epoch_seconds(timestamp: datetime) -> int:
+    return int(timestamp.timestamp())
+
+
+def local_day_window(day: date, zone: ZoneInfo) -> Window:
+    start = datetime.combine(day, time(), tzinfo=zone)
+    end = datetime.combine(day + timedelta(days=1), time(), tzinfo=zone)
+    return epoch_seconds(start), epoch_seconds(end)
+
+
+def report_windows(max_timestamp_utc: datetime, zone: ZoneInfo) -> List[Window]:
+    """The last hour, followed by the DAYS_IN_WEEK local days before max_timestamp's local day"""
+    max_timestamp = epoch_seconds(max_timestamp_utc)
+    windows = [(max_timestamp - 3600, max_timestamp)]
+    today = max_timestamp_utc.astimezone(zone).date()
+    for i in range(1, DAYS_IN_WEEK + 1):
+        windows.append(local_day_window(today - timedelta(days=i), zone))
+    return windows
+
+
+def business_intervals_utc(schedule: WeeklySchedule, zone: ZoneInfo, first_day: date,
+                           last_day: date) -> List[Window]:
+    """Business hours falling on the local days [first_day, last_day] as utc intervals"""
+    range_start = datetime.combine(first_day, time(), tzinfo=zone)
+    range_end = datetime.combine(last_day + timedelta(days=1), time(), tzinfo=zone)
+    intervals = []
+    # start a day early, an overnight interval may spill into first_day.
+    day_before = first_day - timedelta(days=1)
+    monday = day_before - timedelta(days=day_before.weekday())
+    while monday <= last_day:
+        week = datetime.combine(monday, time(), tzinfo=zone)
+        for start_offset, end_offset in schedule.intervals:
+            # wall clock arithmetic, the zone resolves each end to its own utc offset.
+            start = max(week + timedelta(seconds=start_offset), range_start)
+            end = min(week + timedelta(seconds=end_offset), range_end)
+            if end > start:
+                intervals.append((epoch_seconds(start), epoch_seconds(end)))
+        monday += timedelta(days=DAYS_IN_WEEK)
+    return intervals
+
+
+def compute_uptime(batch: List[StoreReportData], windows: List[List[Window]],
+                   trace: Optional[BatchTrace] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Uptime and downtime minutes of every store of the batch in each of its windows.
+
+    Every store must have the same number of windows.
+    """
+    poll_times, poll_active, poll_offsets = [], [], [0]
+    interval_starts, interval_ends, interval_offsets = [], [], [0]
+    for i, (data, store_windows) in enumerate(zip(batch, windows)):
+        if trace is not None:
+            started = perf_counter()
+        zone = data.metadata.zone
+        first_day = datetime.fromtimestamp(min(start for start, _ in store_windows), zone).date()
+        last_day = datetime.fromtimestamp(max(end for _, end in store_windows), zone).date()
+        for start, end in business_intervals_utc(data.metadata.schedule, zone, first_day, last_day):
+            interval_starts.append(start)
+            interval_ends.append(end)
+        interval_offsets.append(len(interval_starts))
+        if trace is not None:
+            converted = perf_counter()
+            trace.timezone[i] += converted - started
+
+        poll_times.extend(as_naive_utc(e.timestamp_utc) for e in data.events)
+        poll_active.extend(e.status == StoreStatusEnum.active.value for e in data.events)
+        poll_offsets.append(len(poll_times))
+        if trace is not None:
+            trace.polls[i] = perf_counter() - converted
+            trace.events[i] = len(data.events)
+            trace.intervals[i] = interval_offsets[-1] - interval_offsets[-2]
+
+    n_windows = len(windows[0]) if windows else 0
+    if trace is not None:
+        trace.kernel_windows = n_windows
+        started = perf_counter()
+    result = uptime_downtime(
+        poll_times=np.array(poll_times, dtype="datetime64[s]").astype(np.int64),
+        poll_active=np.array(poll_active, dtype=bool),
+        poll_offsets=np.array(poll_offsets, dtype=np.int64),
+        interval_starts=np.array(interval_starts, dtype=np.int64),
+        interval_ends=np.array(interval_ends, dtype=np.int64),
+        interval_offsets=np.array(interval_offsets, dtype=np.int64),
+        windows=np.array(windows, dtype=np.int64).reshape(len(batch), n_windows, 2),
+    )
+    if trace is not None:
+        trace.kernel_seconds = perf_counter() - started
+    return result
@@ -0,0 +1,64 @@
+from typing import Iterable, Iterator, Optional
+
+from sqlmodel import Session
+
+from src.db import engine, utcnow
+from src.report.models import ReportJob, ReportState
+from src.report.ranges import ReportRange
+from src.report.version import ReportDataVersion
+
+# stores processed between two progress updates of a running report.
+PROGRESS_EVERY = 1000
+
+
+def create_job(session: Session, report_id: str, request_key: Optional[str] = None,
+               trace_mode: Optional[str] = None, report_range: Optional[ReportRange] = None) -> ReportJob:
+    job = ReportJob(report_id=report_id, state=ReportState.queued.value, request_key=request_key,
+                    created_at=utcnow(), trace_mode=trace_mode)
+    if report_range is not None:
+        job.range_start_utc, job.range_end_utc = report_range.start_utc, report_range.end_utc
+        job.granularity = report_range.granularity.value
+    session.add(job)
+    session.commit()
+    session.refresh(job)
+    return job
+
+
+def get_job(session: Session, report_id: str) -> Optional[ReportJob]:
+    return session.get(ReportJob, report_id)
+
+
+def update_job(report_id: str, **values):
+    """Update a job in its own transaction, so the report's session (and its open cursors) are left alone"""
+    with Session(engine) as session:
+        job = session.get(ReportJob, report_id)
+        if job is None:
+            job = ReportJob(report_id=report_id, created_at=utcnow())
+        for key, value in values.items():
+            setattr(job, key, value)
+        session.add(job)
+        session.commit()
+
+
+def start_job(report_id: str, stores_total: int, version: ReportDataVersion):
+    update_job(report_id, state=ReportState.running.value, stores_total=stores_total, stores_processed=0,
+               started_at=utcnow(), watermark_utc=version.watermark_utc, data_changes=version.changes)
+
+
+def complete_job(report_id: str, stores_processed: int):
+    update_job(report_id, state=ReportState.complete.value, stores_processed=stores_processed,
+               finished_at=utcnow())
+
+
+def fail_job(report_id: str, error: Exception):
+    update_job(report_id, state=ReportState.failed.value, error=str(error), finished_at=utcnow())
+
+
+def track_progress(report_id: str, reports: Iterable[dict]) -> Iterator[dict]:
+    """Pass reports through, recording the number of stores processed every PROGRESS_EVERY stores"""
+    processed = 0
+    for report in reports:
+        yield report
+        processed += 1
+        if processed % PROGRESS_EVERY == 0:
+            update_job(report_id, stores_processed=processed)
@@ -0,0 +1,137 @@
+"""Vectorized uptime/downtime kernel.
+
+Every array describes many stores at once in CSR form: the polls of store ``s`` are
+``poll_times[poll_offsets[s]:poll_offsets[s + 1]]`` and its business-hour intervals are
+``interval_starts/ends[interval_offsets[s]:interval_offsets[s + 1]]``. All times are
+integer seconds since the epoch (UTC).
+
+A store's status is a step function of its polls: each poll's status holds until the
+next poll, and the store is considered inactive before its first known poll. Uptime
+in a window is the time the store is active while inside business hours; downtime is
+the rest of the business hours in that window.
+"""
+from __future__ import annotations
+
+from typing import Tuple
+
+from src.lazy import lazy_import
+
+np = lazy_import("numpy")
+
+# polls of consecutive stores are laid out STRIDE seconds apart so a single
+# searchsorted over the flat arrays never crosses a store boundary.
+STRIDE = 2 ** 33
+
+
+def _offsets_to_index(offsets: np.ndarray) -> np.ndarray:
+    """Store index of every element of a CSR array"""
+    return np.repeat(np.arange(len(offsets) - 1, dtype=np.int64), np.diff(offsets))
+
+
+def active_seconds_function(poll_times: np.ndarray, poll_active: np.ndarray, poll_offsets: np.ndarray,
+                            origin: int):
+    """active_until(store, t): active seconds between the store's first poll and t, for times t >= origin"""
+    # cumulative active seconds from each store's first poll up to every poll.
+    poll_store = _offsets_to_index(poll_offsets)
+    segments = np.zeros(len(poll_times), dtype=np.int64)
+    segments[:-1] = np.diff(poll_times)
+    last_polls = poll_offsets[1:][np.diff(poll_offsets) > 0] - 1
+    segments[last_polls] = 0
+    active_seconds = np.concatenate(([0], np.cumsum(segments * poll_active)))
+    cumulative = active_seconds[:-1] - active_seconds[poll_offsets[poll_store]]
+    keys = poll_store * STRIDE + (poll_times - origin)
+
+    def active_until(store: np.ndarray, t: np.ndarray) -> np.ndarray:
+        """Active seconds between the store's first poll and t"""
+        if len(keys) == 0:
+            return np.zeros(t.shape, dtype=np.int64)
+        k = np.searchsorted(keys, store * STRIDE + (t - origin), side="right") - 1
+        has_poll = k >= poll_offsets[store]
+        k = np.where(has_poll, k, 0)
+        value = cumulative[k] + poll_active[k] * (t - poll_times[k])
+        return np.where(has_poll, value, 0)
+
+    return active_until
+
+
+def uptime_downtime(poll_times: np.ndarray, poll_active: np.ndarray, poll_offsets: np.ndarray,
+                    interval_starts: np.ndarray, interval_ends: np.ndarray, interval_offsets: np.ndarray,
+                    windows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Uptime and downtime minutes of every store in every window.
+
+    Polls must be sorted and business-hour intervals sorted and disjoint within each store.
+    `windows` holds [start, end) pairs with shape (n_stores, n_windows, 2); both returned
+    arrays have shape (n_stores, n_windows).
+    """
+    poll_times = np.asarray(poll_times, dtype=np.int64)
+    poll_active = np.asarray(poll_active, dtype=bool)
+    poll_offsets = np.asarray(poll_offsets, dtype=np.int64)
+    interval_starts = np.asarray(interval_starts, dtype=np.int64)
+    interval_ends = np.asarray(interval_ends, dtype=np.int64)
+    interval_offsets = np.asarray(interval_offsets, dtype=np.int64)
+    windows = np.asarray(windows, dtype=np.int64)
+    n_stores, n_windows = windows.shape[0], windows.shape[1]
+
+    origin = min((a.min() for a in (windows, poll_times, interval_starts) if a.size), default=0)
+    active_until = active_seconds_function(poll_times, poll_active, poll_offsets, origin)
+
+    # clip every business-hour interval to every window of its store.
+    interval_store = _offsets_to_index(interval_offsets)
+    store_windows = windows[interval_store]
+    lo = np.maximum(interval_starts[:, None], store_windows[:, :, 0])
+    hi = np.maximum(np.minimum(interval_ends[:, None], store_windows[:, :, 1]), lo)
+
+    store = np.broadcast_to(interval_store[:, None], lo.shape)
+    up_seconds = active_until(store, hi) - active_until(store, lo)
+    open_seconds = hi - lo
+
+    cells = (store * n_windows + np.arange(n_windows)).ravel()
+    size = n_stores * n_windows
+    uptime = np.bincount(cells, weights=up_seconds.ravel(), minlength=size).reshape(n_stores, n_windows)
+    open_time = np.bincount(cells, weights=open_seconds.ravel(), minlength=size).reshape(n_stores, n_windows)
+    return uptime / 60, (open_time - uptime) / 60
+
+
+def cumulative_uptime(poll_times: np.ndarray, poll_active: np.ndarray, poll_offsets: np.ndarray,
+                      interval_starts: np.ndarray, interval_ends: np.ndarray, interval_offsets: np.ndarray,
+                      points: np.ndarray, point_offsets: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Uptime and business hours seconds of every store from its first point to each of its points.
+
+    `points` are sorted times in CSR form like the polls; both returned arrays are aligned with them.
+    """
+    poll_times = np.asarray(poll_times, dtype=np.int64)
+    poll_active = np.asarray(poll_active, dtype=bool)
+    poll_offsets = np.asarray(poll_offsets, dtype=np.int64)
+    interval_starts = np.asarray(interval_starts, dtype=np.int64)
+    interval_ends = np.asarray(interval_ends, dtype=np.int64)
+    interval_offsets = np.asarray(interval_offsets, dtype=np.int64)
+    points = np.asarray(points, dtype=np.int64)
+    point_offsets = np.asarray(point_offsets, dtype=np.int64)
+    if len(interval_starts) == 0 or len(points) == 0:
+        return np.zeros(len(points), dtype=np.int64), np.zeros(len(points), dtype=np.int64)
+
+    origin = min(a.min() for a in (points, poll_times, interval_starts) if a.size)
+    active_until = active_seconds_function(poll_times, poll_active, poll_offsets, origin)
+
+    # business hours and uptime of each store's intervals before every interval.
+    interval_store = _offsets_to_index(interval_offsets)
+    open_total = np.concatenate(([0], np.cumsum(interval_ends - interval_starts)))
+    up_total = np.concatenate(([0], np.cumsum(active_until(interval_store, interval_ends) -
+                                              active_until(interval_store, interval_starts))))
+    first_interval = interval_offsets[interval_store]
+    open_before = open_total[:-1] - open_total[first_interval]
+    up_before = up_total[:-1] - up_total[first_interval]
+    interval_keys = interval_store * STRIDE + (interval_starts - origin)
+
+    # the last interval starting at or before every point, the point is clipped to it.
+    point_store = _offsets_to_index(point_offsets)
+    k = np.searchsorted(interval_keys, point_store * STRIDE + (points - origin), side="right") - 1
+    has_interval = k >= interval_offsets[point_store]
+    k = np.where(has_interval, k, 0)
+    clipped = np.minimum(np.maximum(points, interval_starts[k]), interval_ends[k])
+    open_until = np.where(has_interval, open_before[k] + clipped - interval_starts[k], 0)
+    up_until = np.where(has_interval, up_before[k] + active_until(point_store, clipped) -
+                        active_until(point_store, interval_starts[k]), 0)
+
+    first_point = point_offsets[point_store]
+    return up_until - up_until[first_point], open_until - open_until[first_point]
@@ -0,0 +1,92 @@
+from typing import Optional
+from datetime import datetime
+from enum import Enum
+
+from sqlalchemy import Index, text
+from sqlmodel import Field, SQLModel
+
+
+class ReportState(str, Enum):
+    queued = "QUEUED"
+    running = "RUNNING"
+    complete = "COMPLETE"
+    failed = "FAILED"
+
+
+class TraceMode(str, Enum):
+    # per-phase and per-store spans.
+    spans = "spans"
+    # spans, plus a cProfile of a sample of the report's batches.
+    profile = "profile"
+
+
+# states of a job that is waiting for or being run by a report worker.
+IN_FLIGHT_STATES = (ReportState.queued.value, ReportState.running.value)
+IN_FLIGHT = text("state IN ('QUEUED', 'RUNNING')")
+
+
+class Granularity(str, Enum):
+    hour = "hour"
+    day = "day"
+    week = "week"
+    # a single period spanning the whole range.
+    total = "total"
+
+
+class ReportJob(SQLModel, table=True):
+    __table_args__ = (
+        # single-flight: at most one job in flight per request.
+        Index("ux_reportjob_in_flight_request_key", "request_key", unique=True,
+              postgresql_where=IN_FLIGHT, sqlite_where=IN_FLIGHT),
+    )
+
+    report_id: str = Field(primary_key=True)
+    state: str = Field(default=ReportState.queued.value, index=True)
+    # identifies what was requested, triggers of an identical report attach to the job in flight.
+    request_key: Optional[str] = None
+    stores_processed: int = 0
+    stores_total: Optional[int] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    error: Optional[str] = None
+    # refreshed by the worker running the job, a stale heartbeat means the worker died.
+    heartbeat_at: Optional[datetime] = None
+    # version of the data the report was computed from, see src/report/version.py.
+    watermark_utc: Optional[datetime] = None
+    data_changes: Optional[int] = None
+    # opt-in trace of the report, see src/report/trace.py.
+    trace_mode: Optional[str] = None
+    # [start, end) and granularity of a range report, see src/report/ranges.py. None for the weekly report.
+    range_start_utc: Optional[datetime] = None
+    range_end_utc: Optional[datetime] = None
+    granularity: Optional[str] = None
+
+
+class ReportShard(SQLModel, table=True):
+    """A range of stores of a report computed by whichever report worker claims it, see src/report/shards.py"""
+    report_id: str = Field(primary_key=True)
+    shard: int = Field(primary_key=True)
+    first_store_id: str
+    last_store_id: str
+    state: str = Field(default=ReportState.queued.value, index=True)
+    created_at: datetime
+    # every shard is computed as of the report's most recent poll.
+    watermark_utc: datetime
+    trace_mode: Optional[str] = None
+    # worker holding the lease, the shard can be claimed again once the lease expires without being renewed.
+    worker_id: Optional[str] = None
+    lease_expires_at: Optional[datetime] = None
+    # claims of the shard so far, each attempt writes its own partial report.
+    attempts: int = 0
+    stores: Optional[int] = None
+    error: Optional[str] = None
+    finished_at: Optional[datetime] = None
+
+
+class DataVersion(SQLModel, table=True):
+    """Single row counting the writes that can change a report"""
+    id: int = Field(default=1, primary_key=True)
+    changes: int = 0
+    # writes of timezones and business hours, the processes caching store metadata drop it when this moves.
+    metadata_changes: int = 0
@@ -0,0 +1,34 @@
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterator, List, Optional
+
+from sqlalchemy.engine import Engine
+from sqlmodel import Session
+
+import src.db
+from src.config import settings
+from src.report.batch import StoreRange
+
+_worker_engine: Optional[Engine] = None
+
+
+def init_worker():
+    """Give every worker process its own engine instead of sharing the parent's connection pool"""
+    global _worker_engine
+    src.db.engine.dispose(close=False)
+    _worker_engine = src.db.create_db_engine()
+
+
+def worker_session() -> Session:
+    return Session(_worker_engine)
+
+
+def shard_store_ranges(store_ids: List[str], shard_size: int) -> List[StoreRange]:
+    """Split store_ids (in byte_order, see load_store_ids) into ranges of at most shard_size stores"""
+    return [(store_ids[i], store_ids[min(i + shard_size, len(store_ids)) - 1])
+            for i in range(0, len(store_ids), shard_size)]
+
+
+def map_shards(fn: Callable, shards: List[StoreRange]) -> Iterator:
+    """Run fn(shard) for every shard on a pool of settings.REPORT_WORKERS processes, yielding results in shard order"""
+    with ProcessPoolExecutor(max_workers=settings.REPORT_WORKERS, initializer=init_worker) as executor:
+        yield from executor.map(fn, shards)
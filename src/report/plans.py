@@ -0,0 +1,51 @@
+"""EXPLAIN checks of the queries reports run against storestatusinterval.
+
+The events query of a report reads the intervals starting in the report's window, plus the
+one in progress at its start for every store. Both must be served by indexes (a range of
+start_utc, and a seek per store) instead of a full scan of the table, which holds every
+interval since the oldest poll kept.
+"""
+from datetime import datetime
+from typing import List
+
+from sqlalchemy.engine import Connection
+
+from src.config import settings
+from src.report.batch import EVENTS_WINDOW, LAST_HOUR_EVENTS_WINDOW, store_events_statement
+from src.store_status.models import StoreStatusInterval
+from src.store_status.partitions import is_postgres
+
+TABLE = StoreStatusInterval.__tablename__
+
+
+def explain(connection: Connection, statement, prefix: str) -> list:
+    compiled = statement.compile(dialect=connection.dialect)
+    params = compiled.params
+    if compiled.positional:
+        params = tuple(params[name] for name in compiled.positiontup)
+    return connection.exec_driver_sql(f"{prefix} {compiled.string}", params).fetchall()
+
+
+def sequential_scans(plan: dict) -> List[str]:
+    relations = [plan["Relation Name"]] if plan.get("Node Type") == "Seq Scan" else []
+    for child in plan.get("Plans", []):
+        relations.extend(sequential_scans(child))
+    return relations
+
+
+def check_report_plan(connection: Connection, max_timestamp_utc: datetime) -> dict:
+    """EXPLAIN the events query of a report as of max_timestamp_utc"""
+    events_window = LAST_HOUR_EVENTS_WINDOW if settings.REPORT_USE_ROLLUP else EVENTS_WINDOW
+    start, end = max_timestamp_utc - events_window, max_timestamp_utc
+    statement = store_events_statement(start, end)
+
+    if is_postgres(connection):
+        (plan,), = explain(connection, statement, "EXPLAIN (FORMAT JSON)")
+        scanned = sorted(set(sequential_scans(plan[0]["Plan"])))
+        # the store table drives the seeks of the intervals in progress.
+        return {"window": [start, end], "sequential_scans": scanned, "ok": TABLE not in scanned}
+
+    plan = [str(row[-1]) for row in explain(connection, statement, "EXPLAIN QUERY PLAN" if
+                                            connection.dialect.name == "sqlite" else "EXPLAIN")]
+    full_scans = [detail for detail in plan if detail.split(" ")[:2] == ["SCAN", TABLE] and "INDEX" not in detail]
+    return {"window": [start, end], "plan": plan, "ok": not full_scans}
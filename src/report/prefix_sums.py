@@ -0,0 +1,306 @@
+"""Per-store cumulative uptime and business hours, persisted as memory mapped .npy files.
+
+Row i of column j of `uptime.npy` and `open.npy` holds store j's uptime and business hours
+seconds from the origin up to point i of its hourly grid, origin + phase + i hours. The
+phase aligns the grid on the store's local hours, which are a half or a quarter hour off utc
+in some timezones. A store's uptime between two points of its grid is then
+uptime[b] - uptime[a], two lookups whether the range is an hour or a quarter.
+
+Rows are hours, so hours are appended as polls arrive, and rows and columns are both
+allocated ahead of their use. A refresh only recomputes what changed since the previous one:
+the hours after its end, the days of the stores dirtied in the daily rollup since (new or
+late polls), and every hour of the stores whose timezone or business hours changed. Like
+the daily rollup, a recomputed range starts with the status interval in progress at its
+first hour.
+"""
+from __future__ import annotations
+
+import fcntl
+import json
+import os
+import zlib
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import date, datetime, time, timedelta, timezone
+from itertools import groupby
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import func
+from sqlmodel import Session, select
+
+from src.db import utcnow
+from src.lazy import lazy_import
+from src.report.batch import load_store_ids, store_events_statement, stream_rows
+from src.report.engine import StoreStatusEnum, as_naive_utc, as_utc, business_intervals_utc, epoch_seconds
+from src.report.kernel import cumulative_uptime
+from src.report.version import ReportDataVersion
+from src.rollup.models import DailyUptime
+from src.store.cache import StoreMetadata, store_metadata_cache
+
+np = lazy_import("numpy")
+
+# bumped when the layout of the files or how they're computed changes, files of another format are rebuilt.
+FORMAT_VERSION = 2
+HOUR = 3600
+# cumulative seconds, a store's stay below 2 ** 31 for 68 years.
+DTYPE = "<i4"
+# hours allocated after the most recent poll, and share of the stores allocated on top of the current ones.
+HOURS_AHEAD = 30 * 24
+STORES_AHEAD = 0.25
+# days dirtied this long before a refresh started are recomputed by the next refresh as well, their polls may
+# have been committed after the refresh read them.
+DIRTY_MARGIN = timedelta(minutes=5)
+# stores recomputed per kernel call.
+REFRESH_BATCH_SIZE = 500
+
+
+def schedule_key(metadata: StoreMetadata) -> int:
+    """Fingerprint of a store's business hours, the same in every process"""
+    return zlib.crc32(repr(metadata.schedule.intervals).encode())
+
+
+def grid_phase(metadata: StoreMetadata, origin: int) -> int:
+    """Seconds from the hours of utc to the local hours of the store"""
+    return int(datetime.fromtimestamp(origin, metadata.zone).utcoffset().total_seconds()) % HOUR
+
+
+def local_midnight(day: date, metadata: StoreMetadata) -> int:
+    return epoch_seconds(datetime.combine(day, time(), tzinfo=metadata.zone))
+
+
+class RecomputedStore(NamedTuple):
+    column: int
+    metadata: StoreMetadata
+    # first row recomputed, the row itself keeps its value.
+    first_row: int
+    # whether its polls are read, otherwise the status of its last poll carries on from the first row.
+    read_polls: bool
+
+
+class PrefixSums:
+    def __init__(self, path: str):
+        self.path = path
+        self.meta: Optional[dict] = None
+        self.uptime = None
+        self.open = None
+        self.columns: Dict[str, int] = {}
+
+    def file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    @contextmanager
+    def locked(self):
+        """Hold the files, across processes, while refreshing and reading them"""
+        os.makedirs(self.path, exist_ok=True)
+        with open(self.file("lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self.load()
+                yield self
+            finally:
+                self.uptime = self.open = None
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def load(self):
+        try:
+            with open(self.file("meta.json")) as file:
+                meta = json.load(file)
+        except FileNotFoundError:
+            meta = None
+        if meta is None or meta["format"] != FORMAT_VERSION:
+            self.meta = None
+            return
+        self.meta = meta
+        self.uptime = np.load(self.file("uptime.npy"), mmap_mode="r+")
+        self.open = np.load(self.file("open.npy"), mmap_mode="r+")
+        self.columns = {store_id: j for j, store_id in enumerate(meta["store_ids"])}
+
+    def write_meta(self):
+        with open(self.file("meta.json.tmp"), "w") as file:
+            json.dump(self.meta, file)
+        os.replace(self.file("meta.json.tmp"), self.file("meta.json"))
+
+    def allocate(self, rows: int, columns: int):
+        """Make room for rows and columns, copying the current arrays into larger files if needed"""
+        shape = self.uptime.shape if self.uptime is not None else (0, 0)
+        if rows <= shape[0] and columns <= shape[1]:
+            return
+        new_shape = (max(rows + HOURS_AHEAD, shape[0]), max(int(columns * (1 + STORES_AHEAD)) + 1, shape[1]))
+        for name in ["uptime", "open"]:
+            # the new file is sparse, only the copied part is written.
+            array = np.lib.format.open_memmap(self.file(name + ".npy.tmp"), mode="w+", dtype=DTYPE, shape=new_shape)
+            old = getattr(self, name)
+            if old is not None:
+                array[:shape[0], :shape[1]] = old
+            array.flush()
+            del array
+            os.replace(self.file(name + ".npy.tmp"), self.file(name + ".npy"))
+            setattr(self, name, np.load(self.file(name + ".npy"), mmap_mode="r+"))
+
+    def create(self, origin: int):
+        self.uptime = self.open = None
+        self.meta = {"format": FORMAT_VERSION, "origin": origin, "rows": 0, "watermark_utc": None,
+                     "data_changes": None, "refreshed_at": None, "store_ids": [], "timezones": [], "schedules": [],
+                     "phases": [], "last_active": []}
+        self.columns = {}
+        self.allocate(0, 0)
+
+    def add_column(self, store_id: str):
+        self.columns[store_id] = len(self.meta["store_ids"])
+        for name, value in [("store_ids", store_id), ("timezones", None), ("schedules", None), ("phases", 0),
+                            ("last_active", 0)]:
+            self.meta[name].append(value)
+
+    def dirty_dates(self, session: Session) -> Dict[str, date]:
+        """First day of every store dirtied in the daily rollup since the last refresh"""
+        if self.meta["refreshed_at"] is None:
+            return {}
+        since = datetime.fromisoformat(self.meta["refreshed_at"]) - DIRTY_MARGIN
+        statement = select(DailyUptime.store_id, func.min(DailyUptime.local_date)).where(
+            DailyUptime.dirtied_at >= since).group_by(DailyUptime.store_id)
+        return dict(session.exec(statement).all())
+
+    def plan(self, store_id: str, metadata: StoreMetadata, dirty_date: Optional[date],
+             rows: int) -> Optional[RecomputedStore]:
+        meta, j = self.meta, self.columns[store_id]
+        key = schedule_key(metadata)
+        if (meta["timezones"][j], meta["schedules"][j]) != (metadata.timezone_str, key):
+            # new store, or its timezone or business hours changed: every hour.
+            meta["timezones"][j], meta["schedules"][j] = metadata.timezone_str, key
+            meta["phases"][j] = grid_phase(metadata, meta["origin"])
+            return RecomputedStore(j, metadata, 0, True) if rows > 1 else None
+        # the hours after the last refresh.
+        first_row = max(min(meta["rows"], rows) - 1, 0)
+        read_polls = False
+        if dirty_date is not None:
+            dirty_row = (local_midnight(dirty_date, metadata) - meta["origin"] - meta["phases"][j]) // HOUR
+            first_row, read_polls = max(min(dirty_row, first_row), 0), True
+        if first_row >= rows - 1:
+            return None
+        return RecomputedStore(j, metadata, first_row, read_polls)
+
+    def load_polls(self, session: Session, stores: List[RecomputedStore],
+                   watermark_utc: datetime) -> Dict[str, Tuple[List[int], List[bool]]]:
+        """Times and statuses of the status intervals of the stores that read them, from the one in progress at the
+        earliest first row"""
+        stores = [store for store in stores if store.read_polls]
+        if not stores:
+            return {}
+        start = min(self.row_time(store, store.first_row) for store in stores)
+        statement = store_events_statement(as_naive_utc(datetime.fromtimestamp(start, timezone.utc)),
+                                           watermark_utc + timedelta(microseconds=1),
+                                           [store.metadata.store_id for store in stores])
+        polls = {}
+        for store_id, rows in groupby(stream_rows(session, statement), key=lambda row: row.store_id):
+            rows = list(rows)
+            polls[store_id] = ([epoch_seconds(as_utc(row.timestamp_utc)) for row in rows],
+                               [row.status == StoreStatusEnum.active.value for row in rows])
+        return polls
+
+    def row_time(self, store: RecomputedStore, row: int) -> int:
+        return self.meta["origin"] + self.meta["phases"][store.column] + row * HOUR
+
+    def recompute(self, session: Session, stores: List[RecomputedStore], rows: int, watermark_utc: datetime):
+        polls = self.load_polls(session, stores, watermark_utc)
+        poll_times, poll_active, poll_offsets = [], [], [0]
+        interval_starts, interval_ends, interval_offsets = [], [], [0]
+        points, point_offsets = [], [0]
+        last_active = []
+        for store in stores:
+            first = self.row_time(store, store.first_row)
+            if store.read_polls:
+                times, active = polls.get(store.metadata.store_id, ([], []))
+                # from the interval in progress at the first row.
+                i = max(bisect_left(times, first) - 1, 0)
+                poll_times.extend(times[i:])
+                poll_active.extend(active[i:])
+                # the kernel considers a store without polls inactive.
+                last_active.append(int(active[-1]) if times else 0)
+            else:
+                # no poll since the last refresh, the status of the last one carries on.
+                poll_times.append(first)
+                poll_active.append(bool(self.meta["last_active"][store.column]))
+                last_active.append(self.meta["last_active"][store.column])
+            poll_offsets.append(len(poll_times))
+
+            store_points = range(first, self.row_time(store, rows), HOUR)
+            points.append(np.arange(store_points.start, store_points.stop, HOUR, dtype=np.int64))
+            point_offsets.append(point_offsets[-1] + len(store_points))
+            zone = store.metadata.zone
+            for start, end in business_intervals_utc(store.metadata.schedule, zone,
+                                                     datetime.fromtimestamp(store_points[0], zone).date(),
+                                                     datetime.fromtimestamp(store_points[-1], zone).date()):
+                interval_starts.append(start)
+                interval_ends.append(end)
+            interval_offsets.append(len(interval_starts))
+
+        uptime, open_time = cumulative_uptime(
+            poll_times=np.array(poll_times, dtype=np.int64),
+            poll_active=np.array(poll_active, dtype=bool),
+            poll_offsets=np.array(poll_offsets, dtype=np.int64),
+            interval_starts=np.array(interval_starts, dtype=np.int64),
+            interval_ends=np.array(interval_ends, dtype=np.int64),
+            interval_offsets=np.array(interval_offsets, dtype=np.int64),
+            points=np.concatenate(points),
+            point_offsets=np.array(point_offsets, dtype=np.int64),
+        )
+        for i, store in enumerate(stores):
+            j, first_row = store.column, store.first_row
+            cells = slice(point_offsets[i], point_offsets[i + 1])
+            self.uptime[first_row:rows, j] = self.uptime[first_row, j] + uptime[cells]
+            self.open[first_row:rows, j] = self.open[first_row, j] + open_time[cells]
+            self.meta["last_active"][j] = last_active[i]
+
+    def refresh(self, session: Session, version: ReportDataVersion, days: int) -> dict:
+        """Bring the arrays up to the data version, covering at least `days` before its watermark"""
+        stats = {"rebuilt": False, "recomputed_stores": 0, "read_polls_stores": 0}
+        if version.watermark_utc is None:
+            return stats
+        watermark = epoch_seconds(as_utc(version.watermark_utc))
+        # the origin is a utc midnight, so phases are the same whatever the origin.
+        origin = (watermark - days * 24 * HOUR) // (24 * HOUR) * (24 * HOUR)
+        if self.meta is None or self.meta["origin"] > origin:
+            self.create(origin)
+            stats["rebuilt"] = True
+        meta = self.meta
+        watermark_utc = as_naive_utc(version.watermark_utc)
+        if (meta["watermark_utc"], meta["data_changes"]) == (watermark_utc.isoformat(), version.changes):
+            return stats
+
+        # read before the data, see DIRTY_MARGIN.
+        refreshed_at = utcnow()
+        rows = (watermark - meta["origin"]) // HOUR + 1
+        dirty_dates = self.dirty_dates(session)
+        store_ids = load_store_ids(session)
+        for store_id in store_ids:
+            if store_id not in self.columns:
+                self.add_column(store_id)
+        self.allocate(rows, len(self.columns))
+        for i in range(0, len(store_ids), REFRESH_BATCH_SIZE):
+            batch = store_ids[i:i + REFRESH_BATCH_SIZE]
+            metadata = store_metadata_cache.get_many(session, batch)
+            stores = [self.plan(store_id, metadata[store_id], dirty_dates.get(store_id), rows) for store_id in batch]
+            stores = [store for store in stores if store is not None]
+            if stores:
+                self.recompute(session, stores, rows, watermark_utc)
+            stats["recomputed_stores"] += len(stores)
+            stats["read_polls_stores"] += sum(store.read_polls for store in stores)
+
+        self.uptime.flush()
+        self.open.flush()
+        meta.update(rows=rows, watermark_utc=watermark_utc.isoformat(), data_changes=version.changes,
+                    refreshed_at=refreshed_at.isoformat())
+        self.write_meta()
+        return {**stats, "stores": len(self.columns), "hours": rows}
+
+    def store_column(self, store_id: str) -> Optional[Tuple[int, str, int]]:
+        """Column, timezone and phase of a store, None for a store added since the refresh"""
+        j = self.columns.get(store_id)
+        if j is None or self.meta["timezones"][j] is None:
+            return None
+        return j, self.meta["timezones"][j], self.meta["phases"][j]
+
+    def values(self, rows, columns) -> Tuple[np.ndarray, np.ndarray]:
+        """Cumulative uptime and business hours seconds at the given rows of the given columns"""
+        cells = np.ix_(rows, columns)
+        return np.asarray(self.uptime[cells], dtype=np.int64), np.asarray(self.open[cells], dtype=np.int64)
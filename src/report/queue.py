@@ -0,0 +1,119 @@
+"""Queue of report jobs, backed by the reportjob table.
+
+Triggers enqueue QUEUED jobs and report workers claim them. A trigger identical to a job
+that is still queued or running attaches to that job instead of queueing another one,
+which a partial unique index on request_key enforces across processes. A trigger made
+while the data is still at the version a finished report was computed from gets that
+report back.
+"""
+from datetime import datetime, timedelta
+from typing import List, Optional
+from uuid import uuid4
+
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+
+from src.config import settings
+from src.db import utcnow
+from src.report.jobs import create_job
+from src.report.models import IN_FLIGHT_STATES, ReportJob, ReportState, TraceMode
+from src.report.ranges import ReportRange
+from src.report.version import ReportDataVersion, get_data_version
+
+# request key of a report of every store as of the most recent poll.
+FULL_REPORT_REQUEST_KEY = "all-stores"
+
+
+def find_in_flight(session: Session, request_key: str) -> Optional[ReportJob]:
+    statement = select(ReportJob).where(ReportJob.request_key == request_key,
+                                        ReportJob.state.in_(IN_FLIGHT_STATES))
+    return session.exec(statement).first()
+
+
+def find_cached_report(session: Session, request_key: str, version: ReportDataVersion) -> Optional[ReportJob]:
+    """The finished report of the same request computed at version, among the REPORT_RESULT_CACHE_SIZE most recent
+    reports finished in the last REPORT_RESULT_TTL_SECONDS"""
+    if settings.REPORT_RESULT_TTL_SECONDS <= 0 or settings.REPORT_RESULT_CACHE_SIZE <= 0:
+        return None
+    statement = select(ReportJob).where(
+        ReportJob.state == ReportState.complete.value,
+        ReportJob.finished_at >= utcnow() - timedelta(seconds=settings.REPORT_RESULT_TTL_SECONDS)).order_by(
+        ReportJob.finished_at.desc()).limit(settings.REPORT_RESULT_CACHE_SIZE)
+    for job in session.exec(statement):
+        if (job.request_key, job.watermark_utc, job.data_changes) == (request_key, *version):
+            return job
+    return None
+
+
+def traced_request_key(request_key: str, trace_mode: Optional[TraceMode]) -> str:
+    """Traced reports only attach to reports traced the same way"""
+    return request_key if trace_mode is None else f"{request_key};trace={TraceMode(trace_mode).value}"
+
+
+def enqueue_report(session: Session, request_key: str = FULL_REPORT_REQUEST_KEY,
+                   trace_mode: Optional[TraceMode] = None, report_range: Optional[ReportRange] = None) -> ReportJob:
+    """Queue a report, or return the job already in flight for the same request, or the finished report of the
+    same request if the data hasn't changed since. A traced report is always computed again."""
+    if report_range is not None:
+        request_key = report_range.request_key
+    request_key = traced_request_key(request_key, trace_mode)
+    if trace_mode is None:
+        job = find_cached_report(session, request_key, get_data_version(session))
+        if job is not None:
+            return job
+    while True:
+        job = find_in_flight(session, request_key)
+        if job is not None:
+            return job
+        try:
+            return create_job(session, str(uuid4()), request_key,
+                              TraceMode(trace_mode).value if trace_mode is not None else None, report_range)
+        except IntegrityError:
+            # an identical trigger queued its job first, attach to it.
+            session.rollback()
+
+
+def claim_jobs(session: Session, limit: int) -> List[str]:
+    """Move up to limit of the oldest queued jobs to RUNNING, returns the ids this worker claimed"""
+    if limit <= 0:
+        return []
+    statement = select(ReportJob.report_id).where(ReportJob.state == ReportState.queued.value).order_by(
+        ReportJob.created_at).limit(limit)
+    claimed = []
+    for report_id in session.exec(statement).all():
+        # another worker may have claimed the job since it was read.
+        result = session.execute(update(ReportJob).where(
+            ReportJob.report_id == report_id, ReportJob.state == ReportState.queued.value).values(
+            state=ReportState.running.value, heartbeat_at=utcnow()))
+        if result.rowcount == 1:
+            claimed.append(report_id)
+    session.commit()
+    return claimed
+
+
+def heartbeat(session: Session, report_ids: List[str]):
+    if not report_ids:
+        return
+    session.execute(update(ReportJob).where(ReportJob.report_id.in_(report_ids),
+                                            ReportJob.state == ReportState.running.value).values(
+        heartbeat_at=utcnow()))
+    session.commit()
+
+
+def requeue_jobs(session: Session, report_ids: List[str]):
+    if not report_ids:
+        return
+    session.execute(update(ReportJob).where(ReportJob.report_id.in_(report_ids),
+                                            ReportJob.state == ReportState.running.value).values(
+        state=ReportState.queued.value, stores_processed=0))
+    session.commit()
+
+
+def requeue_stale_jobs(session: Session, cutoff: datetime) -> int:
+    """Queue again the running jobs whose worker stopped sending heartbeats before cutoff"""
+    result = session.execute(update(ReportJob).where(ReportJob.state == ReportState.running.value,
+                                                     ReportJob.heartbeat_at < cutoff).values(
+        state=ReportState.queued.value, stores_processed=0))
+    session.commit()
+    return result.rowcount
@@ -0,0 +1,147 @@
+"""Reports over an arbitrary [start, end) range, split into hours, days or weeks.
+
+Every store's uptime and downtime in a period are the difference of its cumulative arrays
+(src/report/prefix_sums.py) at the period's ends, so a report over a quarter costs the same
+lookups per period as one over a day. Periods follow each store's local calendar (local
+days, weeks starting on a Monday), the range is rounded down to the store's local hours and
+ends at the most recent poll. Uptime and downtime are in minutes for hourly periods, in hours
+otherwise.
+"""
+from __future__ import annotations
+
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from sqlmodel import Session
+
+from src.business_hours.schedule import DAYS_IN_WEEK
+from src.config import settings
+from src.lazy import lazy_import
+from src.report.batch import load_store_ids
+from src.report.engine import as_naive_utc, as_utc, epoch_seconds
+from src.report.models import Granularity, ReportJob
+from src.report.prefix_sums import HOUR, PrefixSums
+from src.report.trace import ReportTrace
+from src.report.version import ReportDataVersion
+from src.store.cache import get_zone
+from src.store.models import STORE_ID_MAX_LENGTH
+
+np = lazy_import("numpy")
+
+# (name, numpy dtype) of every column of a range report.
+RANGE_REPORT_COLUMNS = [
+    ("store_id", f"<U{STORE_ID_MAX_LENGTH}"),
+    ("period_start", "<U32"),
+    ("period_end", "<U32"),
+    ("uptime", "<f8"),
+    ("downtime", "<f8"),
+]
+# stores read from the cumulative arrays at once.
+RANGE_BATCH_SIZE = 1000
+PERIOD_SECONDS = {Granularity.hour: HOUR, Granularity.day: 24 * HOUR, Granularity.week: DAYS_IN_WEEK * 24 * HOUR}
+
+
+class ReportRange(NamedTuple):
+    start_utc: datetime
+    end_utc: datetime
+    granularity: Granularity
+
+    @property
+    def request_key(self) -> str:
+        return (f"range;start={as_naive_utc(self.start_utc).isoformat()};end={as_naive_utc(self.end_utc).isoformat()}"
+                f";granularity={self.granularity.value}")
+
+    def periods(self) -> int:
+        """Upper bound of the number of periods of a store"""
+        if self.granularity == Granularity.total:
+            return 1
+        # the first and the last periods may be partial.
+        return int((self.end_utc - self.start_utc).total_seconds()) // PERIOD_SECONDS[self.granularity] + 2
+
+    @classmethod
+    def from_job(cls, job: ReportJob) -> Optional[ReportRange]:
+        if job.granularity is None:
+            return None
+        return cls(job.range_start_utc, job.range_end_utc, Granularity(job.granularity))
+
+
+def earliest_start(watermark_utc: datetime) -> datetime:
+    """Range reports can start PREFIX_SUM_DAYS before the most recent poll"""
+    return as_naive_utc(watermark_utc) - timedelta(days=settings.PREFIX_SUM_DAYS)
+
+
+def period_edges(report_range: ReportRange, watermark_utc: datetime, origin: int, timezone_str: str,
+                 phase: int) -> Tuple[List[int], List[str]]:
+    """Rows of the grid bounding the store's periods, and their local times"""
+    zone = get_zone(timezone_str)
+    first = max((epoch_seconds(as_utc(report_range.start_utc)) - origin - phase) // HOUR, 0)
+    end = min(epoch_seconds(as_utc(report_range.end_utc)), epoch_seconds(as_utc(watermark_utc)))
+    last = (end - origin - phase) // HOUR
+    if last <= first:
+        return [], []
+    rows = [first]
+    if report_range.granularity == Granularity.hour:
+        rows = list(range(first, last + 1))
+    elif report_range.granularity != Granularity.total:
+        day = datetime.fromtimestamp(origin + phase + first * HOUR, zone).date()
+        step = 1
+        if report_range.granularity == Granularity.week:
+            step = DAYS_IN_WEEK
+            day -= timedelta(days=day.weekday())
+        while True:
+            day += timedelta(days=step)
+            # local midnights fall on the grid, except in the rare zones whose daylight saving shifts by 30 minutes.
+            row = (epoch_seconds(datetime.combine(day, datetime.min.time(), tzinfo=zone)) - origin - phase) // HOUR
+            if row >= last:
+                break
+            if row > rows[-1]:
+                rows.append(row)
+    if rows[-1] != last:
+        rows.append(last)
+    return rows, [datetime.fromtimestamp(origin + phase + row * HOUR, zone).isoformat() for row in rows]
+
+
+def iter_range_store_rows(session: Session, prefix_sums: PrefixSums, report_range: ReportRange,
+                          watermark_utc: datetime) -> Iterator[List[dict]]:
+    """Yield the rows of every store, ordered by store_id"""
+    origin = prefix_sums.meta["origin"]
+    unit = 60 if report_range.granularity == Granularity.hour else HOUR
+    edges: Dict[Tuple[str, int], Tuple[List[int], List[str]]] = {}
+    store_ids = load_store_ids(session)
+    for i in range(0, len(store_ids), RANGE_BATCH_SIZE):
+        batch = []
+        for store_id in store_ids[i:i + RANGE_BATCH_SIZE]:
+            column = prefix_sums.store_column(store_id)
+            if column is None:
+                # added after the refresh, it has no polls in the range.
+                yield []
+                continue
+            j, timezone_str, phase = column
+            if (timezone_str, phase) not in edges:
+                edges[(timezone_str, phase)] = period_edges(report_range, watermark_utc, origin, timezone_str, phase)
+            batch.append((store_id, j, *edges[(timezone_str, phase)]))
+        if not batch:
+            continue
+
+        rows = np.unique(np.array([row for _, _, store_rows, _ in batch for row in store_rows], dtype=np.int64))
+        uptime, open_time = prefix_sums.values(rows, [j for _, j, _, _ in batch])
+        for k, (store_id, _, store_rows, labels) in enumerate(batch):
+            cells = np.searchsorted(rows, store_rows)
+            up = np.diff(uptime[cells, k]) / unit
+            down = np.diff(open_time[cells, k]) / unit - up
+            yield [{"store_id": store_id, "period_start": labels[p], "period_end": labels[p + 1],
+                    "uptime": round(float(up[p]), 2), "downtime": round(float(down[p]), 2)} for p in range(len(up))]
+
+
+def iter_range_report(session: Session, report_range: ReportRange, version: ReportDataVersion,
+                      trace: Optional[ReportTrace] = None) -> Iterator[List[dict]]:
+    """Refresh the cumulative arrays up to the data version, then yield every store's rows"""
+    prefix_sums = PrefixSums(settings.PREFIX_SUM_DIR)
+    with prefix_sums.locked():
+        with trace.phase("prefix_sums") if trace is not None else nullcontext():
+            refreshed = prefix_sums.refresh(session, version, settings.PREFIX_SUM_DAYS)
+        print(f"refreshed prefix sums: {refreshed}")
+        if version.watermark_utc is None:
+            return
+        yield from iter_range_store_rows(session, prefix_sums, report_range, version.watermark_utc)
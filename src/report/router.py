@@ -1,10 +1,25 @@
-from uuid import uuid4
+from datetime import datetime
+from typing import Dict, List, Optional
 
-from fastapi import APIRouter, Depends, status, BackgroundTasks
+from fastapi import APIRouter, Body, Depends, status, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from starlette.concurrency import run_in_threadpool
 
-from src.db import get_session
-from src.report.utils import get_report_status, create_report
+from src.config import settings
+from src.db import get_async_session, get_session
+from src.report.batch import get_max_timestamp
+from src.report.engine import as_naive_utc
+from src.report.jobs import get_job
+from src.report.models import Granularity, ReportJob, ReportState, TraceMode
+from src.report.queue import enqueue_report
+from src.report.ranges import ReportRange, earliest_start
+from src.report.storage import iter_report_csv, load_report_from_disk
+from src.report.store_reports import MAX_STORES_PER_REQUEST, load_store_reports, store_report_cache
+from src.report.trace import load_trace
+from src.report.version import get_data_version
+from src.report.utils import get_job_status
 
 router = APIRouter(
     responses={status.HTTP_404_NOT_FOUND: {"description": "Not found"}}
@@ -12,12 +27,110 @@ router = APIRouter(
 
 
 @router.get("/get_report/{report_id}")
-def get_report(*, report_id: str):
-    return get_report_status(report_id)
+async def get_report(*, report_id: str, include_report: bool = False, offset: int = Query(default=0, ge=0),
+                     limit: int = Query(default=1000, ge=1, le=10000),
+                     session: AsyncSession = Depends(get_async_session)):
+    job = await session.get(ReportJob, report_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"report {report_id} not found")
+    report_status = get_job_status(job)
+    if include_report and job.state == ReportState.complete.value:
+        report_status["report"] = await run_in_threadpool(load_report_from_disk, report_id, offset, limit)
+    return report_status
+
+
+@router.get("/download/{report_id}")
+def download_report(*, report_id: str, session: Session = Depends(get_session)):
+    """Export a finished report as CSV"""
+    job = get_job(session, report_id)
+    if job is None or job.state != ReportState.complete.value:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"report {report_id} is not complete")
+    return StreamingResponse(iter_report_csv(report_id), media_type="text/csv",
+                             headers={"Content-Disposition": f"attachment; filename=report-{report_id}.csv"})
+
+
+def check_report_range(session: Session, start: Optional[datetime], end: Optional[datetime],
+                       granularity: Optional[Granularity]) -> Optional[ReportRange]:
+    if start is None and end is None:
+        if granularity is not None:
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                                detail="granularity needs a start and an end")
+        return None
+    if start is None or end is None or as_naive_utc(start) >= as_naive_utc(end):
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail="a range needs a start before its end")
+    report_range = ReportRange(as_naive_utc(start), as_naive_utc(end), granularity or Granularity.total)
+    if report_range.periods() > settings.RANGE_REPORT_MAX_PERIODS:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail=f"at most {settings.RANGE_REPORT_MAX_PERIODS} periods per store")
+    watermark_utc = get_max_timestamp(session)
+    if watermark_utc is not None and report_range.start_utc < earliest_start(watermark_utc):
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail=f"ranges start at {earliest_start(watermark_utc).isoformat()} at the earliest")
+    return report_range
 
 
 @router.post("/trigger_report")
-def trigger_report_generation(*, session: Session = Depends(get_session), background_tasks: BackgroundTasks):
-    report_id: str = str(uuid4())
-    background_tasks.add_task(create_report, report_id, session)
-    return {"report_id": report_id}
+def trigger_report_generation(*, trace: Optional[TraceMode] = None, start: Optional[datetime] = None,
+                              end: Optional[datetime] = None, granularity: Optional[Granularity] = None,
+                              session: Session = Depends(get_session)):
+    """Queue a report for the report worker, or attach to the identical report already in flight.
+
+    `trace=spans` records where the report's time goes per phase and per store, `trace=profile` also profiles it.
+    With `start` and `end`, the report covers [start, end) split into periods of `granularity`, see
+    src/report/ranges.py, instead of the last hour, day and week.
+    """
+    report_range = check_report_range(session, start, end, granularity)
+    job = enqueue_report(session, trace_mode=trace, report_range=report_range)
+    return {"report_id": job.report_id}
+
+
+@router.get("/trace/{report_id}")
+def get_report_trace(*, report_id: str, include_stores: bool = False):
+    """Phases and slowest stores of a traced report, with `include_stores` the spans of every store"""
+    trace = load_trace(report_id, include_stores)
+    if trace is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"report {report_id} has no trace")
+    return trace
+
+
+@router.get("/store-cache")
+def get_store_cache_stats():
+    """Size and hit/miss counters of the single-store report cache"""
+    return store_report_cache.stats()
+
+
+async def find_store_reports(store_ids: List[str], session: AsyncSession) -> Dict[str, dict]:
+    """Cached reports are served from the event loop, the others are loaded or computed in the threadpool"""
+    version = await session.run_sync(get_data_version)
+    if version.watermark_utc is None:
+        return {}
+    reports = store_report_cache.get_many(store_ids, version)
+    missing = [store_id for store_id in store_ids if store_id not in reports]
+    if missing:
+        reports.update(await run_in_threadpool(load_store_reports, missing, version))
+    return reports
+
+
+@router.get("/store/{store_id}")
+async def get_store_report(*, store_id: str, session: AsyncSession = Depends(get_async_session)):
+    """A single store's report as of the most recent poll"""
+    reports = await find_store_reports([store_id], session)
+    if store_id not in reports:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"no report for store {store_id}")
+    return reports[store_id]
+
+
+@router.post("/stores")
+async def get_store_reports_batch(*, store_ids: List[str] = Body(...),
+                                  session: AsyncSession = Depends(get_async_session)):
+    """Reports of a list of stores, the store_ids without a report are listed under `missing`"""
+    store_ids = list(dict.fromkeys(store_ids))
+    if len(store_ids) > MAX_STORES_PER_REQUEST:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail=f"at most {MAX_STORES_PER_REQUEST} store_ids per request")
+    reports = await find_store_reports(store_ids, session)
+    return {
+        "reports": [reports[store_id] for store_id in store_ids if store_id in reports],
+        "missing": [store_id for store_id in store_ids if store_id not in reports],
+    }
@@ -0,0 +1,230 @@
+"""Shards of a report shared by every report worker, backed by the reportshard table.
+
+With REPORT_SHARD_MODE=distributed, the process running a report (the coordinator) splits
+the stores into shards of REPORT_SHARD_SIZE stores. Report workers with a free slot claim
+queued shards with SELECT ... FOR UPDATE SKIP LOCKED, so concurrent claims never block on or
+return the same shard; sqlite has no row locks, claims there are serialized by a lock file
+next to the database instead, which is enough for workers sharing a machine. Each claimed
+shard is leased to its worker for REPORT_SHARD_LEASE_SECONDS, renewed while it's computed:
+the shards of a worker that died are claimed again once their lease expires. A shard writes
+its rows to a partial report of its own, the coordinator merges them in shard order once
+every shard is complete.
+"""
+import fcntl
+import os
+import socket
+import tempfile
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timedelta
+from threading import Event, Thread
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import and_, delete, func, or_, update
+from sqlalchemy.engine import make_url
+from sqlmodel import Session, select
+
+from src.config import settings
+from src.db import engine, utcnow
+from src.report.batch import StoreRange
+from src.report.models import ReportShard, ReportState
+from src.report.storage import get_columnar_dirname, get_filename, get_partial_filename, remove_path
+from src.report.trace import get_partial_trace_filename
+
+
+class ShardMode:
+    local = "local"
+    distributed = "distributed"
+
+
+class ShardLease(NamedTuple):
+    report_id: str
+    shard: int
+    first_store_id: str
+    last_store_id: str
+    watermark_utc: datetime
+    trace_mode: Optional[str]
+    attempt: int
+
+    @property
+    def store_range(self) -> Tuple[str, str]:
+        return self.first_store_id, self.last_store_id
+
+    @property
+    def partial_report_id(self) -> str:
+        """Every attempt writes its own files, a worker whose lease was taken over never overwrites another's"""
+        return shard_report_id(self.report_id, self.shard, self.attempt)
+
+
+def shard_report_id(report_id: str, shard: int, attempt: int) -> str:
+    return f"{report_id}.shard-{shard}.{attempt}"
+
+
+def local_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def claim_lock_path() -> str:
+    database = make_url(settings.DATABASE_URL).database
+    if not database or database == ":memory:":
+        return os.path.join(tempfile.gettempdir(), "store-monitor.shard-lock")
+    return database + ".shard-lock"
+
+
+@contextmanager
+def file_lock(path: str):
+    with open(path, "a") as file:
+        fcntl.flock(file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(file, fcntl.LOCK_UN)
+
+
+def claim_lock(session: Session):
+    """Row locks skip the shards claimed by concurrent transactions, sqlite ignores them"""
+    if session.get_bind().dialect.name == "sqlite":
+        return file_lock(claim_lock_path())
+    return nullcontext()
+
+
+def lease_expiry() -> datetime:
+    return utcnow() + timedelta(seconds=settings.REPORT_SHARD_LEASE_SECONDS)
+
+
+def create_shards(session: Session, report_id: str, store_ranges: List[StoreRange], watermark_utc: datetime,
+                  trace_mode: Optional[str]) -> int:
+    """Record the shards of a report. A report queued again after its coordinator stopped keeps the shards of its
+    previous run when they were computed as of the same poll. Returns the number of shards"""
+    statement = select(ReportShard.watermark_utc, func.count()).where(
+        ReportShard.report_id == report_id).group_by(ReportShard.watermark_utc)
+    previous = session.exec(statement).all()
+    if len(previous) == 1 and previous[0][0] == watermark_utc:
+        return previous[0][1]
+    drop_shards(session, report_id)
+    now = utcnow()
+    session.add_all(ReportShard(report_id=report_id, shard=shard, first_store_id=first, last_store_id=last,
+                                state=ReportState.queued.value, created_at=now, watermark_utc=watermark_utc,
+                                trace_mode=trace_mode)
+                    for shard, (first, last) in enumerate(store_ranges))
+    session.commit()
+    return len(store_ranges)
+
+
+def claim_shards(session: Session, worker_id: str, limit: int, report_id: Optional[str] = None) -> List[ShardLease]:
+    """Lease up to limit queued shards (of report_id, or of the oldest reports), along with the shards whose lease
+    expired"""
+    if limit <= 0:
+        return []
+    now = utcnow()
+    statement = select(ReportShard).where(or_(
+        ReportShard.state == ReportState.queued.value,
+        and_(ReportShard.state == ReportState.running.value, ReportShard.lease_expires_at < now)))
+    if report_id is not None:
+        statement = statement.where(ReportShard.report_id == report_id)
+    statement = statement.order_by(ReportShard.created_at, ReportShard.shard).limit(limit).with_for_update(
+        skip_locked=True)
+    leases = []
+    with claim_lock(session):
+        for shard in session.exec(statement).all():
+            if shard.state == ReportState.running.value:
+                print(f"shard {shard.shard} of report {shard.report_id} leased to {shard.worker_id} expired")
+            shard.state = ReportState.running.value
+            shard.worker_id = worker_id
+            shard.lease_expires_at = lease_expiry()
+            shard.attempts += 1
+            leases.append(ShardLease(shard.report_id, shard.shard, shard.first_store_id, shard.last_store_id,
+                                     shard.watermark_utc, shard.trace_mode, shard.attempts))
+            session.add(shard)
+        session.commit()
+    return leases
+
+
+def held(lease: ShardLease, worker_id: str):
+    return and_(ReportShard.report_id == lease.report_id, ReportShard.shard == lease.shard,
+                ReportShard.state == ReportState.running.value, ReportShard.worker_id == worker_id,
+                ReportShard.attempts == lease.attempt)
+
+
+def update_shard(lease: ShardLease, worker_id: str, **values) -> bool:
+    """Update a shard still leased to worker_id in its own transaction, returns whether it was"""
+    with Session(engine) as session:
+        result = session.execute(update(ReportShard).where(held(lease, worker_id)).values(**values))
+        session.commit()
+        return result.rowcount == 1
+
+
+def renew_lease(lease: ShardLease, worker_id: str) -> bool:
+    return update_shard(lease, worker_id, lease_expires_at=lease_expiry())
+
+
+def complete_shard(lease: ShardLease, worker_id: str, stores: int) -> bool:
+    return update_shard(lease, worker_id, state=ReportState.complete.value, stores=stores, finished_at=utcnow())
+
+
+def fail_shard(lease: ShardLease, worker_id: str, error: Exception) -> bool:
+    return update_shard(lease, worker_id, state=ReportState.failed.value, error=str(error), finished_at=utcnow())
+
+
+def release_shards(session: Session, worker_id: str):
+    """Queue the shards leased to a stopping worker again, instead of waiting for their leases to expire"""
+    session.execute(update(ReportShard).where(ReportShard.state == ReportState.running.value,
+                                              ReportShard.worker_id == worker_id).values(
+        state=ReportState.queued.value, lease_expires_at=None))
+    session.commit()
+
+
+class LeaseRenewal:
+    """Renews a lease from a thread while its shard is computed, lost tells whether another worker took it over"""
+
+    def __init__(self, lease: ShardLease, worker_id: str):
+        self.lease = lease
+        self.worker_id = worker_id
+        self.lost = False
+        self.stopped = Event()
+        self.thread = Thread(target=self.run, name=f"lease-{lease.report_id}-{lease.shard}", daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(settings.REPORT_SHARD_LEASE_SECONDS / 3):
+            try:
+                if not renew_lease(self.lease, self.worker_id):
+                    self.lost = True
+                    return
+            except Exception as e:
+                # the lease is still good until it expires, the next renewal tries again.
+                print(f"renewing the lease of shard {self.lease.shard} of report {self.lease.report_id} failed: "
+                      f"{str(e)}")
+
+    def __enter__(self) -> "LeaseRenewal":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *_):
+        self.stopped.set()
+        self.thread.join()
+
+
+def list_shards(session: Session, report_id: str) -> List[ReportShard]:
+    statement = select(ReportShard).where(ReportShard.report_id == report_id).order_by(ReportShard.shard)
+    return session.exec(statement).all()
+
+
+def count_shard_states(shards: List[ReportShard]) -> Dict[str, int]:
+    counts = {state.value: 0 for state in ReportState}
+    for shard in shards:
+        counts[shard.state] += 1
+    return counts
+
+
+def drop_shards(session: Session, report_id: str):
+    """Delete the shards of a report and their partial reports"""
+    for shard in list_shards(session, report_id):
+        for attempt in range(1, shard.attempts + 1):
+            remove_partial_files(shard_report_id(report_id, shard.shard, attempt))
+    session.execute(delete(ReportShard).where(ReportShard.report_id == report_id))
+    session.commit()
+
+
+def remove_partial_files(partial_report_id: str):
+    for path in [get_columnar_dirname(partial_report_id), get_filename(partial_report_id),
+                 get_partial_filename(partial_report_id), get_partial_trace_filename(partial_report_id)]:
+        remove_path(path)
@@ -0,0 +1,287 @@
+"""Report files.
+
+Reports are stored either as a CSV file, or as a directory with one raw NumPy file per
+column (plus a meta.json describing the columns) that is read with memory mapping.
+Both are written to a `.part` path under REPORT_DIR and renamed once every row has been
+written.
+"""
+import csv
+import json
+import os
+import shutil
+from collections import OrderedDict
+from itertools import islice
+from threading import Lock
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from src.config import settings
+from src.lazy import lazy_import
+from src.store.models import STORE_ID_MAX_LENGTH
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+# rows written to a report file between flushes.
+FLUSH_EVERY = 1000
+# reports kept mapped by the report cache.
+MAX_CACHED_REPORTS = 64
+# (name, numpy dtype) of every column of the weekly report.
+REPORT_COLUMNS = [
+    ("store_id", f"<U{STORE_ID_MAX_LENGTH}"),
+    ("uptime_last_hour", "<f8"),
+    ("uptime_last_day", "<f8"),
+    ("uptime_last_week", "<f8"),
+    ("downtime_last_hour", "<f8"),
+    ("downtime_last_day", "<f8"),
+    ("downtime_last_week", "<f8"),
+]
+
+Columns = List[Tuple[str, str]]
+
+
+class ReportFormat:
+    csv = "csv"
+    columnar = "columnar"
+
+
+def report_path(name: str) -> str:
+    """Path of a report file (or of its trace) in REPORT_DIR"""
+    return os.path.join(settings.REPORT_DIR, name)
+
+
+def make_report_dir():
+    os.makedirs(settings.REPORT_DIR, exist_ok=True)
+
+
+def get_filename(report_id: str) -> str:
+    return report_path('report-' + report_id + '.csv')
+
+
+def get_columnar_dirname(report_id: str) -> str:
+    return report_path('report-' + report_id)
+
+
+def get_partial_filename(report_id: str) -> str:
+    """A report is written to this path while it's being generated"""
+    if settings.REPORT_FORMAT == ReportFormat.columnar:
+        return get_columnar_dirname(report_id) + '.part'
+    return get_filename(report_id) + '.part'
+
+
+class CsvReportWriter:
+    def __init__(self, path: str, columns: Columns):
+        self.file = open(path, 'w', newline='')
+        self.writer = csv.DictWriter(self.file, fieldnames=[name for name, _ in columns])
+        self.writer.writeheader()
+
+    def write_rows(self, rows: List[dict]):
+        self.writer.writerows(rows)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class ColumnarReportWriter:
+    def __init__(self, path: str, columns: Columns):
+        os.makedirs(path)
+        self.path = path
+        self.columns = columns
+        self.rows = 0
+        self.files = {name: open(os.path.join(path, name + '.bin'), 'wb') for name, _ in columns}
+
+    def write_rows(self, rows: List[dict]):
+        for name, dtype in self.columns:
+            np.array([row[name] for row in rows], dtype=dtype).tofile(self.files[name])
+            self.files[name].flush()
+        self.rows += len(rows)
+
+    def close(self):
+        for file in self.files.values():
+            file.close()
+        with open(os.path.join(self.path, 'meta.json'), 'w') as file:
+            json.dump({"rows": self.rows, "columns": self.columns}, file)
+
+
+def remove_path(path: str):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def store_report_to_disk(report_id: str, reports: Iterable[dict], columns: Columns = REPORT_COLUMNS) -> int:
+    """Stream report rows to disk, the report only appears once every row has been written"""
+    if settings.REPORT_FORMAT == ReportFormat.columnar:
+        file_name, writer_class = get_columnar_dirname(report_id), ColumnarReportWriter
+    else:
+        file_name, writer_class = get_filename(report_id), CsvReportWriter
+    partial_file_name = get_partial_filename(report_id)
+    make_report_dir()
+
+    # a job queued again after its worker stopped may have left files of its previous run.
+    remove_path(partial_file_name)
+    rows = 0
+    writer = writer_class(partial_file_name, columns)
+    try:
+        reports = iter(reports)
+        while batch := list(islice(reports, FLUSH_EVERY)):
+            writer.write_rows(batch)
+            rows += len(batch)
+        writer.close()
+    except Exception:
+        writer.close()
+        remove_path(partial_file_name)
+        raise
+
+    remove_path(file_name)
+    os.replace(partial_file_name, file_name)
+    print(f"stored {file_name} to disk.")
+    return rows
+
+
+class ColumnarReport:
+    """A finished columnar report, each column memory mapped"""
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, 'meta.json')) as file:
+            meta = json.load(file)
+        self.rows: int = meta["rows"]
+        self.fields = [name for name, _ in meta["columns"]]
+        self.columns = {
+            name: np.memmap(os.path.join(path, name + '.bin'), dtype=dtype, mode='r', shape=(self.rows,))
+            if self.rows else np.empty(0, dtype=dtype)
+            for name, dtype in meta["columns"]
+        }
+
+    @property
+    def nbytes(self) -> int:
+        return sum(column.nbytes for column in self.columns.values())
+
+    def records(self, offset: int = 0, limit: Optional[int] = None) -> List[dict]:
+        end = self.rows if limit is None else min(offset + limit, self.rows)
+        values = [self.columns[name][offset:end].tolist() for name in self.fields]
+        return [dict(zip(self.fields, row)) for row in zip(*values)]
+
+    def find(self, store_id: str) -> Optional[dict]:
+        """Binary search the row of a store, rows are written ordered by store_id"""
+        store_ids = self.columns["store_id"]
+        i = int(np.searchsorted(store_ids, store_id))
+        # rows are in byte_order, the order numpy compares unicode strings in.
+        if i < self.rows and store_ids[i] == store_id:
+            return self.records(i, 1)[0]
+        return None
+
+
+class ReportCache:
+    """LRU of the mapped columns of recently served reports, bounded by the size of the columns in bytes (what
+    their pages take in memory once read) and by number of reports (each one keeps its column files open). Rows
+    are only decoded for the requested page"""
+
+    def __init__(self, max_bytes: int, max_reports: int = MAX_CACHED_REPORTS):
+        self.max_bytes = max_bytes
+        self.max_reports = max_reports
+        self.size = 0
+        self.entries: OrderedDict = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, report_id: str) -> Optional[ColumnarReport]:
+        with self.lock:
+            report = self.entries.get(report_id)
+            if report is not None:
+                self.entries.move_to_end(report_id)
+            return report
+
+    def put(self, report_id: str, report: ColumnarReport):
+        if report.nbytes > self.max_bytes:
+            return
+        with self.lock:
+            if report_id in self.entries:
+                self.size -= self.entries.pop(report_id).nbytes
+            self.entries[report_id] = report
+            self.size += report.nbytes
+            while self.size > self.max_bytes or len(self.entries) > self.max_reports:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted.nbytes
+
+
+report_cache = ReportCache(settings.REPORT_CACHE_MAX_BYTES)
+
+
+def load_columnar_report(report_id: str, offset: int = 0, limit: Optional[int] = None) -> List[dict]:
+    report = report_cache.get(report_id)
+    if report is None:
+        report = ColumnarReport(get_columnar_dirname(report_id))
+        report_cache.put(report_id, report)
+    return report.records(offset, limit)
+
+
+def load_csv_report(report_id: str, offset: int = 0, limit: Optional[int] = None):
+    file_name = get_filename(report_id)
+    try:
+        df = pd.read_csv(file_name, skiprows=range(1, offset + 1), nrows=limit)
+        # Convert the DataFrame to a list of dictionaries (each row)
+        data = df.to_dict(orient="records")
+        return data
+    except pd.errors.EmptyDataError:
+        print(f"file '{file_name}' has no data.")
+        return {}
+
+
+def load_report_from_disk(report_id: str, offset: int = 0, limit: Optional[int] = None):
+    if os.path.isdir(get_columnar_dirname(report_id)):
+        return load_columnar_report(report_id, offset, limit)
+    return load_csv_report(report_id, offset, limit)
+
+
+def iter_stored_rows(report_id: str) -> Iterator[dict]:
+    """Every row of a report as it was written, csv values are read back as the strings written"""
+    if os.path.isdir(get_columnar_dirname(report_id)):
+        report = ColumnarReport(get_columnar_dirname(report_id))
+        for offset in range(0, report.rows, FLUSH_EVERY):
+            yield from report.records(offset, FLUSH_EVERY)
+        return
+    with open(get_filename(report_id), newline='') as file:
+        yield from csv.DictReader(file)
+
+
+def find_report_rows(report_id: str, store_ids: List[str]) -> Dict[str, dict]:
+    """Rows of the given stores in a finished columnar report, stores that can't be found are left out"""
+    if not os.path.isdir(get_columnar_dirname(report_id)):
+        return {}
+    report = ColumnarReport(get_columnar_dirname(report_id))
+    rows = {store_id: report.find(store_id) for store_id in store_ids}
+    return {store_id: row for store_id, row in rows.items() if row is not None}
+
+
+class CsvBuffer:
+    """File-like sink for csv.writer, emptied after every chunk"""
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, value: str):
+        self.parts.append(value)
+
+    def pop(self) -> str:
+        value = ''.join(self.parts)
+        self.parts = []
+        return value
+
+
+def iter_report_csv(report_id: str) -> Iterator[str]:
+    """Export a report as CSV, in chunks of FLUSH_EVERY rows"""
+    if not os.path.isdir(get_columnar_dirname(report_id)):
+        with open(get_filename(report_id)) as file:
+            while chunk := file.read(1 << 16):
+                yield chunk
+        return
+
+    report = ColumnarReport(get_columnar_dirname(report_id))
+    buffer = CsvBuffer()
+    writer = csv.DictWriter(buffer, fieldnames=report.fields)
+    writer.writeheader()
+    yield buffer.pop()
+    for offset in range(0, report.rows, FLUSH_EVERY):
+        writer.writerows(report.records(offset, FLUSH_EVERY))
+        yield buffer.pop()
@@ -0,0 +1,80 @@
+"""Reports of individual stores, served without computing the whole fleet.
+
+A store's report is taken from, in order: the in-memory cache of single-store reports,
+the finished full report computed at the current data version, and otherwise computed
+from the store's polls. Every entry is only valid for the data version it was computed at.
+"""
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, List
+
+from sqlmodel import Session
+
+from src.config import settings
+from src.db import engine
+from src.report.queue import FULL_REPORT_REQUEST_KEY, find_cached_report
+from src.report.storage import find_report_rows
+from src.report.utils import generate_reports_for_stores
+from src.report.version import ReportDataVersion
+
+# most store_ids accepted by a single batch request.
+MAX_STORES_PER_REQUEST = 1000
+
+
+class StoreReportCache:
+    """LRU of single-store reports keyed by store_id, bounded by number of stores"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.entries: OrderedDict = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, store_ids: List[str], version: ReportDataVersion) -> Dict[str, dict]:
+        found = {}
+        with self.lock:
+            for store_id in store_ids:
+                entry = self.entries.get(store_id)
+                if entry is None or entry[0] != version:
+                    continue
+                self.entries.move_to_end(store_id)
+                found[store_id] = entry[1]
+            self.hits += len(found)
+            self.misses += len(store_ids) - len(found)
+        return found
+
+    def put_many(self, reports: Dict[str, dict], version: ReportDataVersion):
+        with self.lock:
+            for store_id, report in reports.items():
+                self.entries[store_id] = (version, report)
+                self.entries.move_to_end(store_id)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            }
+
+
+store_report_cache = StoreReportCache(settings.REPORT_STORE_CACHE_SIZE)
+
+
+def load_store_reports(store_ids: List[str], version: ReportDataVersion) -> Dict[str, dict]:
+    """Reports of stores missing from the cache, from the full report at version or computed from their polls"""
+    with Session(engine) as session:
+        job = find_cached_report(session, FULL_REPORT_REQUEST_KEY, version)
+        reports = find_report_rows(job.report_id, store_ids) if job is not None else {}
+        missing = [store_id for store_id in store_ids if store_id not in reports]
+        if missing:
+            reports.update((report["store_id"], report)
+                           for report in generate_reports_for_stores(session, sorted(missing), version.watermark_utc))
+    store_report_cache.put_many(reports, version)
+    return reports
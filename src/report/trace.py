@@ -0,0 +1,252 @@
+"""Opt-in trace of a report: where its time goes, per phase and per store.
+
+A traced report records, for every store, the time spent loading its rows from the db, in
+timezone conversion (its report windows and business hours as utc intervals), turning its
+polls into the kernel's arrays, in the uptime/downtime kernel, and in the seven-day loop
+assembling its report. The kernel runs on a batch of stores at once, a store's share of it
+is apportioned by its number of polls and business hour intervals. A store's load includes
+the queries its rows were waiting on, so the first store of a chunk of rows also pays for the
+chunk. With the rollup, the kernel only computes the last hour and the days come from the
+rollup refresh phase.
+
+With the `profile` mode, one in every REPORT_TRACE_PROFILE_EVERY batches also runs under
+cProfile. Untraced reports only pay for `trace is not None` checks.
+
+The trace is written to `trace-<report_id>.json` (and the profile to `trace-<report_id>.prof`) in
+REPORT_DIR.
+"""
+from __future__ import annotations
+
+import cProfile
+import glob
+import io
+import json
+import os
+import pstats
+from contextlib import contextmanager
+from datetime import datetime
+from itertools import count
+from time import perf_counter
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from src.config import settings
+from src.lazy import lazy_import
+from src.report.models import TraceMode
+from src.report.storage import make_report_dir, report_path
+
+np = lazy_import("numpy")
+
+# per-store spans, in seconds.
+STORE_SPANS = ["load", "timezone", "polls", "kernel", "days"]
+# functions listed in the trace's profile summary.
+PROFILE_TOP_FUNCTIONS = 30
+
+
+def get_trace_filename(report_id: str) -> str:
+    return report_path('trace-' + report_id + '.json')
+
+
+def get_profile_filename(report_id: str) -> str:
+    return report_path('trace-' + report_id + '.prof')
+
+
+def get_shard_profile_filename(report_id: str, pid: int) -> str:
+    """Shard processes write their own profile, merged by the process writing the trace"""
+    return report_path('trace-' + report_id + f'.{pid}.prof')
+
+
+def get_partial_trace_filename(partial_report_id: str) -> str:
+    """Shards computed by report workers hand their trace to the coordinator through this file"""
+    return report_path('trace-' + partial_report_id + '.pickle')
+
+
+class BatchTrace:
+    """Spans of the stores of one kernel batch, filled in by generate_store_reports and compute_uptime"""
+
+    def __init__(self, size: int):
+        self.timezone = np.zeros(size)
+        self.polls = np.zeros(size)
+        self.days = np.zeros(size)
+        self.events = np.zeros(size, dtype=np.int64)
+        self.intervals = np.zeros(size, dtype=np.int64)
+        self.kernel_seconds = 0.0
+        self.kernel_windows = 0
+
+
+class ReportTrace:
+    def __init__(self, report_id: str, mode: TraceMode):
+        self.report_id = report_id
+        self.mode = TraceMode(mode)
+        self.started_at = datetime.utcnow()
+        self.started = perf_counter()
+        # name: [seconds, calls]
+        self.phases: Dict[str, List[float]] = {}
+        self.store_ids: List[str] = []
+        self.spans: Dict[str, List[np.ndarray]] = {name: [] for name in STORE_SPANS + ["events", "intervals"]}
+        # load times of the stores yielded but not yet part of a finished batch.
+        self.pending_loads: List[float] = []
+        self.kernel_windows = 0
+        self.profiler = cProfile.Profile() if self.mode == TraceMode.profile else None
+        self.profiled_batches = 0
+
+    def add_phase(self, name: str, seconds: float, calls: int = 1):
+        phase = self.phases.setdefault(name, [0.0, 0])
+        phase[0] += seconds
+        phase[1] += calls
+
+    @contextmanager
+    def phase(self, name: str):
+        started = perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase(name, perf_counter() - started)
+
+    def timed_stores(self, stores: Iterable) -> Iterator:
+        """Pass stores through, timing how long loading each one took"""
+        iterator = iter(stores)
+        while True:
+            started = perf_counter()
+            try:
+                store = next(iterator)
+            except StopIteration:
+                return
+            self.pending_loads.append(perf_counter() - started)
+            yield store
+
+    def sampled_batches(self, batches: Iterable[list]) -> Iterator[list]:
+        """Pass batches through, loading and computing one in every REPORT_TRACE_PROFILE_EVERY under the profiler"""
+        if self.profiler is None:
+            yield from batches
+            return
+        iterator = iter(batches)
+        every = max(1, settings.REPORT_TRACE_PROFILE_EVERY)
+        for i in count():
+            sampled = i % every == 0
+            if sampled:
+                self.profiler.enable()
+            try:
+                batch = next(iterator)
+                if sampled:
+                    self.profiled_batches += 1
+                yield batch
+            except StopIteration:
+                return
+            finally:
+                if sampled:
+                    self.profiler.disable()
+
+    def finish_batch(self, store_ids: List[str], batch: BatchTrace):
+        loads, self.pending_loads = self.pending_loads[:len(store_ids)], self.pending_loads[len(store_ids):]
+        # apportion the kernel's time by the size of each store's input.
+        weights = batch.events + batch.intervals + 1
+        self.store_ids.extend(store_ids)
+        self.spans["load"].append(np.array(loads + [0.0] * (len(store_ids) - len(loads))))
+        self.spans["timezone"].append(batch.timezone)
+        self.spans["polls"].append(batch.polls)
+        self.spans["kernel"].append(batch.kernel_seconds * weights / weights.sum())
+        self.spans["days"].append(batch.days)
+        self.spans["events"].append(batch.events)
+        self.spans["intervals"].append(batch.intervals)
+        self.kernel_windows = batch.kernel_windows
+        for name in STORE_SPANS:
+            if name != "kernel":
+                self.add_phase(name, float(self.spans[name][-1].sum()), len(store_ids))
+        self.add_phase("kernel", batch.kernel_seconds)
+
+    def store_columns(self) -> Dict[str, np.ndarray]:
+        return {name: np.concatenate(arrays) if arrays else np.zeros(0) for name, arrays in self.spans.items()}
+
+    def export_partial(self) -> dict:
+        """What a shard process hands back to be merged into the report's trace"""
+        if self.profiler is not None:
+            make_report_dir()
+            self.profiler.dump_stats(get_shard_profile_filename(self.report_id, os.getpid()))
+        return {"phases": self.phases, "store_ids": self.store_ids, "spans": self.store_columns(),
+                "kernel_windows": self.kernel_windows, "profiled_batches": self.profiled_batches}
+
+    def merge(self, partial: dict):
+        for name, (seconds, calls) in partial["phases"].items():
+            self.add_phase(name, seconds, calls)
+        self.store_ids.extend(partial["store_ids"])
+        for name, values in partial["spans"].items():
+            self.spans[name].append(values)
+        self.kernel_windows = partial["kernel_windows"] or self.kernel_windows
+        self.profiled_batches += partial["profiled_batches"]
+
+    def profile_summary(self) -> Optional[dict]:
+        if self.profiler is None:
+            return None
+        files = glob.glob(glob.escape(report_path('trace-' + self.report_id)) + '.*.prof')
+        self.profiler.create_stats()
+        # the batches ran in this process, in shard processes, or there were none.
+        sources = ([self.profiler] if self.profiler.stats else []) + files
+        rows = []
+        if sources:
+            stats = pstats.Stats(*sources, stream=io.StringIO())
+            stats.dump_stats(get_profile_filename(self.report_id))
+            # (file, line, function): (primitive calls, calls, own time, cumulative time, callers)
+            rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:PROFILE_TOP_FUNCTIONS]
+        for file in files:
+            os.remove(file)
+        return {
+            "file": get_profile_filename(self.report_id) if sources else None,
+            "every": settings.REPORT_TRACE_PROFILE_EVERY,
+            "sampled_batches": self.profiled_batches,
+            "top_functions": [{"function": f"{file}:{line}({function})", "calls": calls,
+                               "own_seconds": round(own, 6), "cumulative_seconds": round(cumulative, 6)}
+                              for (file, line, function), (_, calls, own, cumulative, _) in rows],
+        }
+
+    def export(self, stores: int) -> dict:
+        wall = perf_counter() - self.started
+        columns = self.store_columns()
+        total = sum(columns[name] for name in STORE_SPANS) if self.store_ids else np.zeros(0)
+        slowest = np.argsort(-total, kind="stable")[:settings.REPORT_TRACE_TOP_N]
+        phases = {name: {"seconds": round(seconds, 6), "calls": calls} for name, (seconds, calls) in self.phases.items()}
+        # writing the report, progress updates and whatever else wasn't traced.
+        phases["other"] = {"seconds": round(max(wall - sum(seconds for seconds, _ in self.phases.values()), 0), 6),
+                           "calls": 1}
+        return {
+            "report_id": self.report_id,
+            "mode": self.mode.value,
+            "started_at": self.started_at.isoformat(),
+            "wall_seconds": round(wall, 6),
+            "stores": stores,
+            "use_rollup": settings.REPORT_USE_ROLLUP,
+            "kernel_windows": self.kernel_windows,
+            "phases": phases,
+            "slowest_stores": [{
+                "store_id": self.store_ids[i],
+                "total_seconds": round(float(total[i]), 6),
+                **{f"{name}_seconds": round(float(columns[name][i]), 6) for name in STORE_SPANS},
+                "events": int(columns["events"][i]),
+                "intervals": int(columns["intervals"][i]),
+            } for i in slowest],
+            "profile": self.profile_summary(),
+            "store_spans": {
+                "store_id": self.store_ids,
+                **{name: np.round(columns[name], 6).tolist() for name in STORE_SPANS},
+                "events": columns["events"].tolist(),
+                "intervals": columns["intervals"].tolist(),
+            },
+        }
+
+    def write(self, stores: int) -> str:
+        path = get_trace_filename(self.report_id)
+        make_report_dir()
+        with open(path + '.tmp', 'w') as file:
+            json.dump(self.export(stores), file)
+        os.replace(path + '.tmp', path)
+        return path
+
+
+def load_trace(report_id: str, include_stores: bool = False) -> Optional[dict]:
+    try:
+        with open(get_trace_filename(report_id)) as file:
+            trace = json.load(file)
+    except FileNotFoundError:
+        return None
+    if not include_stores:
+        trace.pop("store_spans", None)
+    return trace
@@ -1,22 +1,34 @@
-from datetime import datetime, timedelta, timezone, time
-from enum import Enum
-from typing import List
-from zoneinfo import ZoneInfo
-
-import pandas as pd
-from pandas.errors import EmptyDataError
-from sqlalchemy import func
-from sqlmodel import select, Session
-
-from src.business_hours.models import BusinessHours
+import os
+import pickle
+from collections import Counter
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+from functools import partial
+from itertools import islice
+from time import perf_counter, sleep
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from sqlmodel import Session
+
+from src.config import settings
+from src.report.batch import (StoreRange, StoreReportData, count_stores, get_max_timestamp, iter_store_report_data,
+                              load_store_ids)
+from src.report.engine import DAYS_IN_WEEK, StoreStatusEnum, as_utc, compute_uptime, report_windows
+from src.report.jobs import complete_job, fail_job, start_job, track_progress, update_job
+from src.report.models import ReportJob, ReportShard, ReportState
+from src.report.parallel import map_shards, shard_store_ranges, worker_session
+from src.report.ranges import RANGE_REPORT_COLUMNS, ReportRange, iter_range_report
+from src.report.shards import (LeaseRenewal, ShardLease, ShardMode, claim_shards, complete_shard, count_shard_states,
+                               create_shards, drop_shards, fail_shard, list_shards, local_worker_id,
+                               remove_partial_files, shard_report_id)
+from src.report.storage import iter_stored_rows, store_report_to_disk
+from src.report.trace import BatchTrace, ReportTrace, get_partial_trace_filename
+from src.report.version import ReportDataVersion, get_data_version
+from src.rollup.utils import refresh_report_days
 from src.store.models import Store
-from src.store.utils import get_timezone
-from src.store_status.models import StoreStatus
-
 
-class StoreStatusEnum(str, Enum):
-    active = "active"
-    inactive = "inactive"
+# number of stores handed to the uptime/downtime kernel at once.
+KERNEL_BATCH_SIZE = 1000
 
 
 class WeeklyReport:
@@ -27,7 +39,7 @@ class WeeklyReport:
         self.uptime_last_hour = 0
         self.downtime_last_hour = 0
 
-    def update_last_hour_records(self, minutes: int, status: str):
+    def update_last_hour_records(self, minutes: float, status: str):
         if not (0 <= minutes <= 60):
             raise ValueError(f"minutes={minutes}. minutes must be between 0, 60.")
 
@@ -36,7 +48,7 @@ class WeeklyReport:
         elif status == StoreStatusEnum.inactive.value:
             self.downtime_last_hour += minutes
 
-    def record_hours(self, day: int, hours: int, status: str):
+    def record_hours(self, day: int, hours: float, status: str):
         if day < 0:
             raise ValueError(f"day={day}. day cannot be < 0.")
 
@@ -66,183 +78,263 @@ class WeeklyReport:
             "store_id": self.store_id,
             "uptime_last_hour": self.uptime_last_hour,
             "uptime_last_day": last_day_report["uptime"],
-            "uptime_last_week": uptime_last_week,
+            "uptime_last_week": round(uptime_last_week, 2),
             "downtime_last_hour": self.downtime_last_hour,
             "downtime_last_day": last_day_report["downtime"],
-            "downtime_last_week": downtime_last_week,
+            "downtime_last_week": round(downtime_last_week, 2),
         }
 
 
-def get_filename(report_id: str) -> str:
-    file_name = 'report-' + report_id + '.csv'
-    return file_name
-
+def get_job_status(job: ReportJob) -> dict:
+    status = {
+        "status": job.state,
+        "stores_processed": job.stores_processed,
+        "stores_total": job.stores_total,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+        "error": job.error,
+    }
+    if job.granularity is not None:
+        status.update(start_utc=job.range_start_utc, end_utc=job.range_end_utc, granularity=job.granularity)
+    return status
+
+
+def generate_store_reports(batch: List[StoreReportData], max_timestamp_utc: datetime,
+                           trace: Optional[ReportTrace] = None) -> List[dict]:
+    """Compute the weekly reports of a batch of stores with a single kernel call.
+
+    When the batch carries daily rollups, only the last hour is computed from polls.
+    """
+    max_timestamp_utc = as_utc(max_timestamp_utc)
+    use_rollup = len(batch) > 0 and batch[0].daily_uptime is not None
+    batch_trace = BatchTrace(len(batch)) if trace is not None else None
+    windows = []
+    for i, data in enumerate(batch):
+        if batch_trace is not None:
+            started = perf_counter()
+        windows.append(report_windows(max_timestamp_utc, data.metadata.zone))
+        if batch_trace is not None:
+            batch_trace.timezone[i] = perf_counter() - started
+    if use_rollup:
+        windows = [store_windows[:1] for store_windows in windows]
+    uptime, downtime = compute_uptime(batch, windows, batch_trace)
 
-def store_report_to_disk(report_id: str, reports):
-    df = pd.DataFrame(reports)
-    file_name = get_filename(report_id)
-    df.to_csv(file_name, index=False)
-    print(f"stored {file_name} to disk.")
+    reports = []
+    for i, data in enumerate(batch):
+        if batch_trace is not None:
+            started = perf_counter()
+        weekly_report = WeeklyReport(data.store_id)
+        weekly_report.update_last_hour_records(round(float(uptime[i, 0]), 2), StoreStatusEnum.active.value)
+        weekly_report.update_last_hour_records(round(float(downtime[i, 0]), 2), StoreStatusEnum.inactive.value)
+
+        today = max_timestamp_utc.astimezone(data.metadata.zone).date()
+        for day in range(1, DAYS_IN_WEEK + 1):
+            if use_rollup:
+                uptime_minutes, downtime_minutes = data.daily_uptime.get(today - timedelta(days=day), (0, 0))
+            else:
+                uptime_minutes, downtime_minutes = float(uptime[i, day]), float(downtime[i, day])
+            weekly_report.record_hours(day=day, hours=round(uptime_minutes / 60, 2),
+                                       status=StoreStatusEnum.active.value)
+            weekly_report.record_hours(day=day, hours=round(downtime_minutes / 60, 2),
+                                       status=StoreStatusEnum.inactive.value)
+        reports.append(weekly_report.get_report())
+        if batch_trace is not None:
+            batch_trace.days[i] = perf_counter() - started
+    if trace is not None:
+        trace.finish_batch([data.store_id for data in batch], batch_trace)
+    return reports
+
+
+def generate_store_report(data: StoreReportData, max_timestamp_utc: datetime) -> dict:
+    """Compute a store's weekly report from its already loaded timezone, business hours and events"""
+    return generate_store_reports([data], max_timestamp_utc)[0]
+
+
+def iter_batches(iterable: Iterable, size: int) -> Iterator[List]:
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def iter_report_rows(session: Session, max_timestamp_utc: datetime, store_range: StoreRange = None,
+                     trace: Optional[ReportTrace] = None) -> Iterator[dict]:
+    if settings.REPORT_USE_ROLLUP:
+        with trace.phase("rollup_refresh") if trace is not None else nullcontext():
+            refresh_report_days(session, max_timestamp_utc, store_range)
+    store_report_data = iter_store_report_data(session, max_timestamp_utc, store_range,
+                                               with_daily_uptime=settings.REPORT_USE_ROLLUP)
+    if trace is not None:
+        store_report_data = trace.timed_stores(store_report_data)
+    batches = iter_batches(store_report_data, KERNEL_BATCH_SIZE)
+    if trace is not None:
+        batches = trace.sampled_batches(batches)
+    for batch in batches:
+        yield from generate_store_reports(batch, max_timestamp_utc, trace)
+
+
+def generate_reports_for_stores(session: Session, store_ids: List[str], max_timestamp_utc: datetime) -> List[dict]:
+    """Compute the reports of a few stores straight from their polls, leaving the daily rollup alone"""
+    store_report_data = iter_store_report_data(session, max_timestamp_utc, store_ids)
+    return [report for batch in iter_batches(store_report_data, KERNEL_BATCH_SIZE)
+            for report in generate_store_reports(batch, max_timestamp_utc)]
 
 
-def load_report_from_disk(report_id: str):
-    file_name = get_filename(report_id)
+def report_generator(store: Store, session: Session):
+    """Compute a single store's weekly report"""
+    max_timestamp_utc: datetime = get_max_timestamp(session)
+    return generate_reports_for_stores(session, [store.store_id], max_timestamp_utc)[0]
+
+
+def generate_shard_reports(store_range: StoreRange, max_timestamp_utc: datetime) -> List[dict]:
+    """Runs in a report worker process, using the worker's own session"""
+    with worker_session() as session:
+        return list(iter_report_rows(session, max_timestamp_utc, store_range))
+
+
+def generate_traced_shard_reports(store_range: StoreRange, max_timestamp_utc: datetime, report_id: str,
+                                  trace_mode: str) -> Tuple[List[dict], dict]:
+    """generate_shard_reports, also handing back the shard's trace"""
+    trace = ReportTrace(report_id, trace_mode)
+    with worker_session() as session:
+        reports = list(iter_report_rows(session, max_timestamp_utc, store_range, trace))
+    return reports, trace.export_partial()
+
+
+def iter_traced_shards(shard_results: Iterable[Tuple[List[dict], dict]], trace: ReportTrace) -> Iterator[List[dict]]:
+    for reports, partial_trace in shard_results:
+        trace.merge(partial_trace)
+        yield reports
+
+
+def compute_shard(session: Session, lease: ShardLease, worker_id: str) -> Optional[int]:
+    """Compute a claimed shard into its partial report while renewing its lease. Returns the number of stores, None
+    when the shard failed or another worker took it over"""
+    trace = ReportTrace(lease.report_id, lease.trace_mode) if lease.trace_mode else None
+    with LeaseRenewal(lease, worker_id) as renewal:
+        try:
+            stores = store_report_to_disk(lease.partial_report_id, iter_report_rows(
+                session, lease.watermark_utc, lease.store_range, trace))
+            if trace is not None:
+                with open(get_partial_trace_filename(lease.partial_report_id), 'wb') as file:
+                    pickle.dump(trace.export_partial(), file)
+        except Exception as e:
+            print(f"shard {lease.shard} of report {lease.report_id} failed: {str(e)}")
+            fail_shard(lease, worker_id, e)
+            return None
+    if renewal.lost or not complete_shard(lease, worker_id, stores):
+        print(f"shard {lease.shard} of report {lease.report_id} was taken over by another worker")
+        remove_partial_files(lease.partial_report_id)
+        return None
+    return stores
+
+
+def run_report_shard(lease: ShardLease, worker_id: str) -> Optional[int]:
+    """Runs in a process of a report worker's pool"""
+    with worker_session() as session:
+        return compute_shard(session, lease, worker_id)
+
+
+def wait_for_shards(report_id: str, session: Session) -> List[ReportShard]:
+    """Compute the report's queued shards in this process until every shard is complete, taking over the shards
+    whose worker stopped renewing its lease"""
+    worker_id = local_worker_id()
+    while True:
+        # a read transaction would keep seeing the same rows.
+        session.commit()
+        shards = list_shards(session, report_id)
+        failed = [shard for shard in shards if shard.state == ReportState.failed.value]
+        if failed:
+            raise RuntimeError(f"shard {failed[0].shard} failed: {failed[0].error}")
+        update_job(report_id, stores_processed=sum(shard.stores or 0 for shard in shards))
+        if count_shard_states(shards)[ReportState.complete.value] == len(shards):
+            return shards
+        leases = claim_shards(session, worker_id, 1, report_id)
+        if leases:
+            compute_shard(session, leases[0], worker_id)
+        else:
+            # the remaining shards are leased to other workers.
+            sleep(settings.REPORT_QUEUE_POLL_SECONDS)
+
+
+def iter_distributed_reports(report_id: str, session: Session, max_timestamp_utc: datetime,
+                             trace_mode: Optional[str], trace: Optional[ReportTrace]) -> Iterator[dict]:
+    """Weekly reports of every store, computed in shards by every report worker sharing the database and merged
+    in shard order. The shards of a coordinator that died are kept for the next run of the report"""
     try:
-        df = pd.read_csv(file_name)
-        # Convert the DataFrame to a list of dictionaries (each row)
-        data = df.to_dict(orient="records")
-        return data
-    except EmptyDataError:
-        print(f"file '{file_name}' has no data.")
-        return {}
-
-
-def get_report_status(report_id: str):
+        create_shards(session, report_id, shard_store_ranges(load_store_ids(session), settings.REPORT_SHARD_SIZE),
+                      max_timestamp_utc, trace_mode)
+        shards = [(shard.shard, shard.attempts, shard.worker_id) for shard in wait_for_shards(report_id, session)]
+        print(f"merging {len(shards)} shards of report {report_id} computed by "
+              f"{dict(Counter(worker_id for _, _, worker_id in shards))}")
+        for shard, attempt, _ in shards:
+            partial_report_id = shard_report_id(report_id, shard, attempt)
+            if trace is not None and os.path.exists(get_partial_trace_filename(partial_report_id)):
+                with open(get_partial_trace_filename(partial_report_id), 'rb') as file:
+                    trace.merge(pickle.load(file))
+            yield from iter_stored_rows(partial_report_id)
+    except Exception:
+        drop_shards(session, report_id)
+        raise
+    drop_shards(session, report_id)
+
+
+def iter_fleet_reports(report_id: str, session: Session, max_timestamp_utc: datetime, trace_mode: Optional[str],
+                       trace: Optional[ReportTrace]) -> Iterator[dict]:
+    """Weekly reports of every store, computed by REPORT_WORKERS processes or by the report workers"""
+    if settings.REPORT_SHARD_MODE == ShardMode.distributed:
+        # the progress of the report is that of its shards.
+        return iter_distributed_reports(report_id, session, max_timestamp_utc, trace_mode, trace)
+    if settings.REPORT_WORKERS <= 1:
+        return track_progress(report_id, iter_report_rows(session, max_timestamp_utc, trace=trace))
+    shards = shard_store_ranges(load_store_ids(session), settings.REPORT_SHARD_SIZE)
+    if trace is not None:
+        shard_reports = iter_traced_shards(map_shards(partial(
+            generate_traced_shard_reports, max_timestamp_utc=max_timestamp_utc, report_id=report_id,
+            trace_mode=trace_mode), shards), trace)
+    else:
+        shard_reports = map_shards(partial(generate_shard_reports, max_timestamp_utc=max_timestamp_utc), shards)
+    return track_progress(report_id, (report for shard in shard_reports for report in shard))
+
+
+def write_range_report(report_id: str, session: Session, report_range: ReportRange, version: ReportDataVersion,
+                       trace: Optional[ReportTrace]) -> int:
+    """Reading the cumulative arrays is cheap, range reports are computed in this process. Returns the number of
+    stores"""
+    stores = 0
+
+    def counted(store_rows: Iterable[List[dict]]) -> Iterator[dict]:
+        nonlocal stores
+        for rows in store_rows:
+            stores += 1
+            yield from rows
+
+    store_report_to_disk(report_id, counted(track_progress(report_id, iter_range_report(
+        session, report_range, version, trace))), RANGE_REPORT_COLUMNS)
+    return stores
+
+
+def create_report(report_id: str, session: Session, trace_mode: Optional[str] = None,
+                  report_range: Optional[ReportRange] = None):
+    trace = ReportTrace(report_id, trace_mode) if trace_mode else None
     try:
-        report = load_report_from_disk(report_id)
-
-        return {
-            "status": "COMPLETE",
-            "report": report
-        }
+        version = get_data_version(session)
+        max_timestamp_utc: datetime = version.watermark_utc
+        start_job(report_id, count_stores(session), version)
+        if report_range is not None:
+            stores = write_range_report(report_id, session, report_range, version, trace)
+        else:
+            reports = iter_fleet_reports(report_id, session, max_timestamp_utc, trace_mode, trace)
+            stores = store_report_to_disk(report_id, reports)
+        if trace is not None:
+            print(f"wrote the trace of report {report_id} to {trace.write(stores)}.")
     except Exception as e:
-        print(e)
-        return {"status": "RUNNING"}
-
-
-def find_business_hours_by_day(db_business_hours: List["BusinessHours"], day_of_week: int) -> dict:
-    """Find the business hours for a particular day of the week (Mon=0, Sun=6)"""
-    # select the business day and respective timings.
-    business_hours = {}
-    for dbh in db_business_hours:
-        if dbh.day_of_week == day_of_week:
-            business_hours["start_time"] = dbh.start_time_local
-            business_hours["end_time"] = dbh.end_time_local
-            business_hours["day"] = dbh.day_of_week
-            break
-    # if no business day is found, fallback to 24x7 timings.
-    if len(business_hours) == 0:
-        business_hours["start_time"] = time().fromisoformat("00:00:00")
-        business_hours["end_time"] = time().fromisoformat("23:59:59")
-        business_hours["day"] = day_of_week
-
-    return business_hours
-
-
-def calculate_last_hour(max_timestamp_utc, store: Store, db_business_hours: List["BusinessHours"], session: Session,
-                        weekly_report: WeeklyReport, timezone: str):
-    """Calculate uptime/downtime for the last hour"""
-    one_hour_ago = max_timestamp_utc + timedelta(hours=-1)
-    last_hour_events_statement = select(StoreStatus).where(StoreStatus.store_id == store.store_id,
-                                                           StoreStatus.timestamp_utc >= one_hour_ago,
-                                                           StoreStatus.timestamp_utc < max_timestamp_utc).order_by(
-        StoreStatus.timestamp_utc)
-
-    # last hour's events
-    last_hour_events: List["StoreStatus"] = session.exec(last_hour_events_statement).all()
-    # day_of_week in db_business_hours is 0 indexed (0-6) but
-    # `isoweekday()` is 1 indexed (1-7)
-    day_of_week = one_hour_ago.isoweekday() - 1
-    bh = find_business_hours_by_day(db_business_hours, day_of_week)
-    opening_time: time = bh["start_time"]
-    closing_time: time = bh["end_time"]
-
-    window = opening_time
-    while window < closing_time:
-        if not (one_hour_ago.time() <= opening_time <= max_timestamp_utc.time()):
-            break
-
-        if len(last_hour_events) == 0:
-            minutes: int = 60
-            weekly_report.update_last_hour_records(minutes, StoreStatusEnum.inactive.value)
-            break
-
-        e = last_hour_events.pop()  # oldest event first
-        event_timestamp_local = e.timestamp_utc.astimezone(ZoneInfo(timezone))
-
-        if event_timestamp_local.time() >= closing_time:
-            minutes: int = abs(closing_time.minute - window.minute)
-            weekly_report.update_last_hour_records(minutes, e.status)
-            break
-        elif window <= event_timestamp_local.time() < closing_time:
-            minutes: int = abs(event_timestamp_local.time().minute - window.minute)
-            weekly_report.update_last_hour_records(minutes, status=e.status)
-            window = event_timestamp_local.time()
-
-
-def report_generator(store: Store, session: Session):
-    max_timestamp_utc: datetime = session.exec(select([func.max(StoreStatus.timestamp_utc)])).first()
-    timezone_str: str = get_timezone(store.store_id, session)
-
-    # convert max timestamp into current store's local timezone for easy comparisons.
-    max_timestamp_local: datetime = max_timestamp_utc.astimezone(ZoneInfo(timezone_str))
-
-    db_business_hours = session.exec(
-        select(BusinessHours).where(BusinessHours.store_id == store.store_id).order_by(BusinessHours.day_of_week)).all()
-
-    weekly_report = WeeklyReport(store.store_id)
-
-    calculate_last_hour(max_timestamp_utc=max_timestamp_utc, store=store, db_business_hours=db_business_hours,
-                        session=session, weekly_report=weekly_report, timezone=timezone_str)
-
-    """Calculating the uptime/downtime for each day of the week."""
-    curr_t = datetime(year=max_timestamp_local.year, month=max_timestamp_local.month, day=max_timestamp_local.day,
-                      tzinfo=max_timestamp_local.tzinfo)
-    days_in_week = 7
-    days = []
-    for i in range(days_in_week):
-        curr_t = curr_t + timedelta(days=-1)
-        days.append(curr_t)
-
-        current_day_utc = curr_t.astimezone(timezone.utc)
-        next_day_utc = current_day_utc + timedelta(days=1)
-        store_events_statement = select(StoreStatus).where(StoreStatus.store_id == store.store_id,
-                                                           StoreStatus.timestamp_utc >= current_day_utc,
-                                                           StoreStatus.timestamp_utc < next_day_utc).order_by(
-            StoreStatus.timestamp_utc)
-        # current day's events
-        store_events: List["StoreStatus"] = session.exec(store_events_statement).all()
-
-        current_day_of_week = curr_t.isoweekday() - 1
-        # day_of_week in db_business_hours is 0 indexed (0-6) but
-        # `isoweekday()` is 1 indexed (1-7)
-        business_hours_today = find_business_hours_by_day(db_business_hours, current_day_of_week)
-        start_time = business_hours_today["start_time"]
-        end_time = business_hours_today["end_time"]
-        window = start_time
-
-        while window < end_time:
-            if len(store_events) == 0:
-                weekly_report.record_hours(day=(i + 1), hours=abs(end_time.hour - window.hour),
-                                           status=StoreStatusEnum.inactive.value)
-                break
-
-            e = store_events.pop()  # oldest event first
-            event_timestamp_local = e.timestamp_utc.astimezone(ZoneInfo(timezone_str))
-
-            if event_timestamp_local.time() >= end_time:
-                weekly_report.record_hours(day=(i + 1), hours=abs(end_time.hour - window.hour), status=e.status)
-                break
-            elif window <= event_timestamp_local.time() < end_time:
-                weekly_report.record_hours(day=(i + 1), hours=abs(event_timestamp_local.time().hour - window.hour),
-                                           status=e.status)
-                window = event_timestamp_local.time()
-
-    return weekly_report.get_report()
-
-
-def create_report(report_id: str, session: Session):
-    reports = []
-    statement = select(Store)
-    results = session.exec(statement)
-    stores: List["Store"] = results.all()
-    for store in stores:
-        report = report_generator(store, session)
-        reports.append(report)
-
-    store_report_to_disk(report_id, reports)
+        print(f"report {report_id} failed: {str(e)}")
+        fail_job(report_id, e)
+        return {"report_id": report_id, "error": str(e)}
 
+    complete_job(report_id, stores)
     return {
         "report_id": report_id,
-        "report": reports,
+        "stores": stores,
     }
@@ -0,0 +1,39 @@
+"""Version of the data a report is computed from.
+
+A report only depends on the polls, timezones and business hours as of the watermark, so
+the version is the watermark plus a counter that every write of those tables bumps in its
+own transaction. Two reports computed at the same version are identical, a trigger made
+while the version is unchanged gets the last report back instead of computing it again.
+"""
+from datetime import datetime
+from typing import NamedTuple, Optional, Union
+
+from sqlalchemy import update
+from sqlalchemy.engine import Connection
+from sqlmodel import Session, select
+
+from src.report.models import DataVersion
+from src.store_status.watermark import store_status_watermark
+
+
+class ReportDataVersion(NamedTuple):
+    watermark_utc: Optional[datetime]
+    changes: int
+
+
+def bump_data_version(session: Union[Session, Connection]):
+    """Called by every write that can change a report, before its transaction commits"""
+    session.execute(update(DataVersion).where(DataVersion.id == 1).values(changes=DataVersion.changes + 1))
+
+
+def bump_metadata_version(session: Union[Session, Connection]):
+    """Called by the writes of timezones and business hours instead of bump_data_version"""
+    session.execute(update(DataVersion).where(DataVersion.id == 1).values(
+        changes=DataVersion.changes + 1, metadata_changes=DataVersion.metadata_changes + 1))
+
+
+def get_data_version(session: Session) -> ReportDataVersion:
+    # read before the report reads any data, so a report includes at least every write its version counts.
+    changes = session.exec(select(DataVersion.changes).where(DataVersion.id == 1)).first() or 0
+    # the watermark cached by a process may lag behind the counter, both have to be current to be compared.
+    return ReportDataVersion(watermark_utc=store_status_watermark.refresh(session), changes=changes)
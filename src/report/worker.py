@@ -0,0 +1,184 @@
+"""Report worker: runs the queued report jobs outside of the web server.
+
+The worker polls the queue, claims up to REPORT_QUEUE_CONCURRENCY jobs and runs each one in
+its own process of a pool, with its own engine. While a job runs, the worker refreshes its
+heartbeat; jobs of a worker that died are queued again once their heartbeat goes stale.
+With REPORT_SHARD_MODE=distributed, free slots first go to the queued shards of running
+reports (see src/report/shards.py), wherever their report runs.
+
+Every server process started with REPORT_WORKER_MODE=process starts a worker process, but
+only the one holding the lock file of REPORT_DIR runs reports: the others wait to take over
+once it stops, so the server processes sharing a REPORT_DIR run a single worker.
+"""
+import fcntl
+import multiprocessing
+import os
+import signal
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+from threading import Event
+from typing import Dict, Optional, Tuple
+
+from sqlmodel import Session
+
+import src.db
+from src.config import settings
+from src.db import utcnow
+from src.report.jobs import fail_job, get_job
+from src.report.parallel import init_worker, worker_session
+from src.report.queue import claim_jobs, heartbeat, requeue_jobs, requeue_stale_jobs
+from src.report.ranges import ReportRange
+from src.report.shards import ShardMode, claim_shards, local_worker_id, release_shards
+from src.report.storage import make_report_dir, report_path
+from src.report.utils import create_report, run_report_shard
+
+# seconds the server waits for its worker process to stop before killing it.
+STOP_TIMEOUT_SECONDS = 10
+# held by the worker process running reports, in REPORT_DIR.
+WORKER_LOCK_NAME = "report-worker.lock"
+
+
+def reset_signals():
+    """Forked processes inherit the signal handlers of the server (or of the worker script), which would
+    ignore being terminated. Interrupts are left to the parent, which stops its children itself."""
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def init_job_process():
+    """Lead a process group, so stopping the job also stops the shard processes it starts"""
+    reset_signals()
+    os.setpgid(0, 0)
+    init_worker()
+
+
+def run_report_job(report_id: str) -> dict:
+    """Runs in a process of the worker's pool"""
+    with worker_session() as session:
+        job = get_job(session, report_id)
+        if job is None:
+            return create_report(report_id, session)
+        return create_report(report_id, session, job.trace_mode, ReportRange.from_job(job))
+
+
+class ReportWorker:
+    def __init__(self, concurrency: int, poll_seconds: float, stale_after: timedelta):
+        self.concurrency = concurrency
+        self.poll_seconds = poll_seconds
+        self.stale_after = stale_after
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.running: Dict[str, Future] = {}
+        # (report_id, shard) of the shards of distributed reports running in the pool.
+        self.shards: Dict[Tuple[str, int], Future] = {}
+        self.worker_id = local_worker_id()
+
+    def collect_finished(self):
+        for report_id, future in list(self.running.items()):
+            if not future.done():
+                continue
+            del self.running[report_id]
+            if future.exception() is not None:
+                # create_report records its own failures, this is a crashed pool process.
+                print(f"report {report_id} failed: {str(future.exception())}")
+                fail_job(report_id, future.exception())
+                self.check_pool(future)
+        for (report_id, shard), future in list(self.shards.items()):
+            if not future.done():
+                continue
+            del self.shards[(report_id, shard)]
+            if future.exception() is not None:
+                # the shard's lease expires and another worker claims it.
+                print(f"shard {shard} of report {report_id} failed: {str(future.exception())}")
+                self.check_pool(future)
+
+    def check_pool(self, future: Future):
+        if isinstance(future.exception(), BrokenProcessPool) and self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+    def tick(self):
+        """Reap finished jobs, refresh the heartbeats of running ones and claim new ones"""
+        self.collect_finished()
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.concurrency, initializer=init_job_process)
+        with Session(src.db.engine) as session:
+            heartbeat(session, list(self.running))
+            requeued = requeue_stale_jobs(session, utcnow() - self.stale_after)
+            if requeued:
+                print(f"queued {requeued} reports of a stopped worker again")
+            if settings.REPORT_SHARD_MODE == ShardMode.distributed:
+                # finishing the reports already running comes before starting new ones.
+                for lease in claim_shards(session, self.worker_id, self.free_slots()):
+                    self.shards[(lease.report_id, lease.shard)] = self.executor.submit(
+                        run_report_shard, lease, self.worker_id)
+            for report_id in claim_jobs(session, self.free_slots()):
+                self.running[report_id] = self.executor.submit(run_report_job, report_id)
+
+    def free_slots(self) -> int:
+        return self.concurrency - len(self.running) - len(self.shards)
+
+    def stop(self):
+        """Give the running jobs back to the queue and stop the pool without waiting for them"""
+        with Session(src.db.engine) as session:
+            requeue_jobs(session, [report_id for report_id, future in self.running.items() if not future.done()])
+            if self.shards:
+                release_shards(session, self.worker_id)
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        for process in multiprocessing.active_children():
+            try:
+                os.killpg(process.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self, stop: Event):
+        print(f"report worker started, running up to {self.concurrency} reports at once")
+        try:
+            while not stop.is_set():
+                try:
+                    self.tick()
+                except Exception as e:
+                    print(f"report worker error: {str(e)}")
+                stop.wait(self.poll_seconds)
+        finally:
+            self.stop()
+
+
+def wait_for_lock(file, stop: Event, poll_seconds: float) -> bool:
+    """Take the lock of an open file once no other process holds it, False if stopped first"""
+    while True:
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            if stop.wait(poll_seconds):
+                return False
+
+
+def run_worker(stop: Event):
+    """Entry point of a worker process"""
+    reset_signals()
+    # a forked worker must not share the connections of the server's pool.
+    src.db.engine.dispose(close=False)
+    make_report_dir()
+    with open(report_path(WORKER_LOCK_NAME), "a") as lock:
+        if not wait_for_lock(lock, stop, settings.REPORT_QUEUE_POLL_SECONDS):
+            return
+        ReportWorker(settings.REPORT_QUEUE_CONCURRENCY, settings.REPORT_QUEUE_POLL_SECONDS,
+                     timedelta(seconds=settings.REPORT_JOB_STALE_SECONDS)).run(stop)
+
+
+def start_worker_process() -> Tuple[multiprocessing.Process, Event]:
+    """Run a report worker in a child process of the server"""
+    stop = multiprocessing.Event()
+    process = multiprocessing.Process(target=run_worker, args=(stop,), name="report-worker")
+    process.start()
+    return process, stop
+
+
+def stop_worker_process(process: multiprocessing.Process, stop: Event):
+    stop.set()
+    process.join(STOP_TIMEOUT_SECONDS)
+    if process.is_alive():
+        process.terminate()
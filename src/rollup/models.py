@@ -0,0 +1,24 @@
+from typing import Optional
+from datetime import date, datetime
+
+from sqlmodel import Field, SQLModel, UniqueConstraint
+
+
+class DailyUptime(SQLModel, table=True):
+    """Uptime/downtime of a store during one local day, within business hours"""
+    __table_args__ = (
+        UniqueConstraint("store_id", "local_date", name="unique_store_day"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    local_date: date
+    uptime_minutes: float = 0
+    downtime_minutes: float = 0
+    computed_at: Optional[datetime] = None
+
+    # dirty rows are recomputed by the next refresh. dirtied_at tells a refresh
+    # whether the row was dirtied again while it was being recomputed.
+    dirty: bool = Field(default=True, index=True)
+    dirtied_at: Optional[datetime] = Field(default=None, index=True)
+
+    store_id: str = Field(foreign_key="store.store_id")
@@ -0,0 +1,18 @@
+from fastapi import APIRouter, Depends, status
+from sqlmodel import Session
+
+from src.db import get_session
+from src.rollup.utils import mark_all_dirty, refresh_dirty_days
+
+router = APIRouter(
+    responses={status.HTTP_404_NOT_FOUND: {"description": "Not found"}}
+)
+
+
+@router.post("/refresh")
+def refresh_rollup(*, full: bool = False, session: Session = Depends(get_session)):
+    """Recompute the days marked dirty since the last refresh, or every day with `full`"""
+    if full:
+        mark_all_dirty(session)
+    refreshed = refresh_dirty_days(session)
+    return {"refreshed_days": refreshed}
@@ -0,0 +1,169 @@
+from bisect import bisect_left
+from datetime import date, datetime, timedelta, timezone
+from itertools import groupby, islice
+from typing import Iterable, List, Optional, Tuple
+
+from sqlalchemy import bindparam, update
+from sqlmodel import Session, select
+
+from src.db import byte_order, dialect_insert, utcnow
+from src.report.batch import (GroupCursor, StoreRange, StoreReportData, in_store_range, store_events_statement,
+                              stream_rows, stream_store_ids)
+from src.report.engine import DAYS_IN_WEEK, as_utc, compute_uptime, local_day_window
+from src.rollup.models import DailyUptime
+from src.store.cache import LOAD_BATCH_SIZE, store_metadata_cache
+from src.store_status.watermark import store_status_watermark
+
+# number of dirty days recomputed per kernel call.
+REFRESH_BATCH_SIZE = 5000
+# number of store_ids per IN list, keeps sqlite below its bound parameter limit.
+UPDATE_BATCH_SIZE = 1000
+# rows per executemany of the dirty days upsert.
+UPSERT_BATCH_SIZE = 10_000
+
+
+def chunks(items: List, size: int) -> Iterable[List]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def upsert_dirty_days(session: Session, days: Iterable[Tuple[str, date]]):
+    """Mark (store_id, local_date) days dirty, creating the ones that don't exist yet"""
+    now = utcnow()
+    values = [{"store_id": store_id, "local_date": local_date, "dirty": True, "dirtied_at": now,
+               "uptime_minutes": 0, "downtime_minutes": 0} for store_id, local_date in sorted(set(days))]
+    if not values:
+        return
+    # a single-row statement run with every row's parameters: compiled once, instead of once per multi-row batch.
+    statement = dialect_insert(DailyUptime.__table__)
+    statement = statement.on_conflict_do_update(index_elements=["store_id", "local_date"],
+                                                set_={"dirty": True, "dirtied_at": statement.excluded.dirtied_at})
+    for batch in chunks(values, UPSERT_BATCH_SIZE):
+        session.execute(statement, batch)
+
+
+def mark_spans_dirty(session: Session, spans: Iterable[Tuple[str, datetime, Optional[datetime]]]):
+    """Mark the days overlapping (store_id, start_utc, end_utc) spans over which a store's status changed.
+
+    A span without an end lasts until the store's next poll, so every day up to the most
+    recent poll is marked, and the day after it as well.
+    """
+    spans = list(spans)
+    if not spans:
+        return
+    metadata = store_metadata_cache.get_many(session, sorted({store_id for store_id, _, _ in spans}))
+    watermark = store_status_watermark.get(session)
+    days = set()
+    for store_id, start_utc, end_utc in spans:
+        zone = metadata[store_id].zone
+        local_date = as_utc(start_utc).astimezone(zone).date()
+        if end_utc is None:
+            last_date = as_utc(max(start_utc, watermark or start_utc)).astimezone(zone).date() + timedelta(days=1)
+        else:
+            last_date = as_utc(end_utc).astimezone(zone).date()
+        while local_date <= last_date:
+            days.add((store_id, local_date))
+            local_date += timedelta(days=1)
+    upsert_dirty_days(session, days)
+
+
+def mark_store_dirty(session: Session, store_id: str):
+    """A store's timezone or business hours changed, every one of its days has to be recomputed"""
+    session.exec(update(DailyUptime).where(DailyUptime.store_id == store_id).values(dirty=True, dirtied_at=utcnow()))
+
+
+def mark_stores_dirty(session: Session, store_ids: List[str]):
+    now = utcnow()
+    for batch in chunks(store_ids, UPDATE_BATCH_SIZE):
+        session.exec(update(DailyUptime).where(DailyUptime.store_id.in_(batch)).values(dirty=True, dirtied_at=now))
+
+
+def mark_all_dirty(session: Session):
+    """Every day has to be recomputed, e.g. after a change to how uptime is computed"""
+    session.exec(update(DailyUptime).values(dirty=True, dirtied_at=utcnow()))
+
+
+def ensure_report_days(session: Session, max_timestamp_utc: datetime, store_range: StoreRange = None):
+    """Create (dirty) rows for the days of a report that haven't been rolled up yet"""
+    max_timestamp_utc = as_utc(max_timestamp_utc)
+    first_date = max_timestamp_utc.date() - timedelta(days=DAYS_IN_WEEK + 1)
+    statement = select(DailyUptime.store_id, DailyUptime.local_date).where(DailyUptime.local_date >= first_date)
+    statement = in_store_range(statement, DailyUptime.store_id, store_range).order_by(
+        byte_order(DailyUptime.store_id))
+    existing = GroupCursor((store_id, {row.local_date for row in rows})
+                           for store_id, rows in groupby(stream_rows(session, statement), key=lambda row: row.store_id))
+
+    missing = []
+    store_ids = stream_store_ids(session, store_range)
+    while batch := list(islice(store_ids, LOAD_BATCH_SIZE)):
+        metadata = store_metadata_cache.get_many(session, batch)
+        for store_id in batch:
+            store_days = existing.take(store_id, set())
+            today = max_timestamp_utc.astimezone(metadata[store_id].zone).date()
+            for i in range(1, DAYS_IN_WEEK + 1):
+                if today - timedelta(days=i) not in store_days:
+                    missing.append((store_id, today - timedelta(days=i)))
+    upsert_dirty_days(session, missing)
+
+
+def recompute_days(session: Session, rows: List) -> int:
+    """Recompute a batch of dirty (id, store_id, local_date, dirtied_at) rows"""
+    store_ids = sorted({row.store_id for row in rows})
+    metadata = store_metadata_cache.get_many(session, store_ids)
+
+    first_date = min(row.local_date for row in rows) - timedelta(days=2)
+    last_date = max(row.local_date for row in rows) + timedelta(days=2)
+    statement = store_events_statement(datetime.combine(first_date, datetime.min.time()),
+                                       datetime.combine(last_date, datetime.min.time()), store_ids)
+    events = {store_id: list(group) for store_id, group in groupby(session.exec(statement), key=lambda e: e.store_id)}
+    timestamps = {store_id: [as_utc(e.timestamp_utc) for e in group] for store_id, group in events.items()}
+
+    batch, windows = [], []
+    for row in rows:
+        window = local_day_window(row.local_date, metadata[row.store_id].zone)
+        store_events = events.get(row.store_id, [])
+        store_timestamps = timestamps.get(row.store_id, [])
+        start = datetime.fromtimestamp(window[0], timezone.utc)
+        end = datetime.fromtimestamp(window[1], timezone.utc)
+        batch.append(StoreReportData(
+            store_id=row.store_id,
+            metadata=metadata[row.store_id],
+            # from the interval in progress at the start of the day.
+            events=store_events[max(bisect_left(store_timestamps, start) - 1, 0):bisect_left(store_timestamps, end)],
+        ))
+        windows.append([window])
+
+    uptime, downtime = compute_uptime(batch, windows)
+
+    table = DailyUptime.__table__
+    # rows dirtied again since they were read keep their dirty flag.
+    statement = update(table).where(table.c.id == bindparam("row_id"),
+                                    table.c.dirtied_at == bindparam("row_dirtied_at")).values(
+        uptime_minutes=bindparam("uptime"), downtime_minutes=bindparam("downtime"), dirty=False,
+        computed_at=bindparam("now"))
+    now = utcnow()
+    session.execute(statement, [
+        {"row_id": row.id, "row_dirtied_at": row.dirtied_at, "uptime": float(uptime[i, 0]),
+         "downtime": float(downtime[i, 0]), "now": now} for i, row in enumerate(rows)])
+    return len(rows)
+
+
+def refresh_dirty_days(session: Session, store_range: StoreRange = None) -> int:
+    """Catch-up job: recompute only the days marked dirty since the last run"""
+    statement = select(DailyUptime.id, DailyUptime.store_id, DailyUptime.local_date, DailyUptime.dirtied_at).where(
+        DailyUptime.dirty.is_(True))
+    statement = in_store_range(statement, DailyUptime.store_id, store_range).order_by(
+        DailyUptime.store_id, DailyUptime.local_date)
+    rows = session.exec(statement).all()
+
+    refreshed = 0
+    for batch in chunks(rows, REFRESH_BATCH_SIZE):
+        refreshed += recompute_days(session, batch)
+    session.commit()
+    return refreshed
+
+
+def refresh_report_days(session: Session, max_timestamp_utc: datetime, store_range: StoreRange = None) -> int:
+    """Bring the days a report reads up to date"""
+    ensure_report_days(session, max_timestamp_utc, store_range)
+    return refresh_dirty_days(session, store_range)
@@ -0,0 +1,177 @@
+"""Process-wide cache of store metadata.
+
+Timezones and business hours rarely change, so each store's timezone, its shared ZoneInfo
+and its parsed weekly schedule are kept in memory. Every write of timezones or business
+hours moves the metadata_changes counter of the dataversion table, wherever it's made:
+each lookup reads the counter, and the whole cache is dropped once it moved, so the report
+worker processes see the writes made through the server (and the other way around).
+Lookups that can do with metadata up to `max_age` seconds old (the live status routes)
+only read it that often, and a warm cache then answers them without the database.
+"""
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from itertools import groupby
+from threading import Lock
+from typing import Dict, Iterable, List, NamedTuple, Optional
+from zoneinfo import ZoneInfo
+
+from sqlmodel import Session, select
+
+from src.business_hours.models import BusinessHours
+from src.business_hours.schedule import WeeklySchedule
+from src.config import settings
+from src.report.models import DataVersion
+from src.store.models import Store
+from src.store.utils import DEFAULT_TIMEZONE
+from src.timezones.models import Timezone
+
+# number of stores loaded per query on a cache miss.
+LOAD_BATCH_SIZE = 1000
+
+
+class StoreMetadata(NamedTuple):
+    store_id: str
+    timezone_str: str
+    zone: ZoneInfo
+    schedule: WeeklySchedule
+
+
+@lru_cache(maxsize=None)
+def get_zone(timezone_str: str) -> ZoneInfo:
+    return ZoneInfo(timezone_str)
+
+
+def build_metadata(store_id: str, timezone_str: str, business_hours: Iterable) -> StoreMetadata:
+    return StoreMetadata(store_id=store_id, timezone_str=timezone_str, zone=get_zone(timezone_str),
+                         schedule=WeeklySchedule.from_business_hours(business_hours))
+
+
+def get_metadata_version(session: Session) -> int:
+    return session.exec(select(DataVersion.metadata_changes).where(DataVersion.id == 1)).first() or 0
+
+
+def load_store_metadata(session: Session, store_ids: List[str]) -> Dict[str, StoreMetadata]:
+    timezones, business_hours = {}, {}
+    for i in range(0, len(store_ids), LOAD_BATCH_SIZE):
+        batch = store_ids[i:i + LOAD_BATCH_SIZE]
+        statement = select(Timezone.store_id, Timezone.timezone_str).where(Timezone.store_id.in_(batch))
+        timezones.update(session.exec(statement).all())
+        statement = select(BusinessHours.store_id, BusinessHours.day_of_week, BusinessHours.start_time_local,
+                           BusinessHours.end_time_local).where(BusinessHours.store_id.in_(batch)).order_by(
+            BusinessHours.store_id, BusinessHours.day_of_week)
+        for store_id, rows in groupby(session.exec(statement), key=lambda row: row.store_id):
+            business_hours[store_id] = list(rows)
+    return {store_id: build_metadata(store_id, timezones.get(store_id, DEFAULT_TIMEZONE),
+                                     business_hours.get(store_id, []))
+            for store_id in store_ids}
+
+
+class StoreMetadataCache:
+    """LRU of StoreMetadata keyed by store_id, bounded by number of stores"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.entries: OrderedDict = OrderedDict()
+        self.lock = Lock()
+        # metadata_changes the entries were loaded at, and when it was last read.
+        self.version: Optional[int] = None
+        self.checked_at: Optional[float] = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def sync(self, session: Session, max_age: float = 0) -> int:
+        """Drop every entry once timezones or business hours were written since they were loaded, returns the
+        version the entries loaded from now on are current with. The version read less than max_age seconds ago
+        is trusted"""
+        with self.lock:
+            if self.checked_at is not None and time.monotonic() - self.checked_at < max_age:
+                return self.version
+        version = get_metadata_version(session)
+        with self.lock:
+            if version != self.version:
+                self.entries.clear()
+                self.version = version
+            self.checked_at = time.monotonic()
+        return version
+
+    def put_many(self, entries: Dict[str, StoreMetadata], version: int):
+        with self.lock:
+            if version != self.version:
+                # loaded before a write another lookup already saw, it may be stale.
+                return
+            for store_id, metadata in entries.items():
+                self.entries[store_id] = metadata
+                self.entries.move_to_end(store_id)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_many(self, session: Session, store_ids: List[str], max_age: float = 0) -> Dict[str, StoreMetadata]:
+        """Metadata of every store in store_ids, the misses are loaded with a few bulk queries. With max_age,
+        metadata written by another process in the last max_age seconds may be missed"""
+        version = self.sync(session, max_age)
+        found, missing = {}, []
+        with self.lock:
+            for store_id in store_ids:
+                metadata = self.entries.get(store_id)
+                if metadata is None:
+                    missing.append(store_id)
+                else:
+                    self.entries.move_to_end(store_id)
+                    found[store_id] = metadata
+            self.hits += len(found)
+            self.misses += len(missing)
+
+        if missing:
+            loaded = load_store_metadata(session, missing)
+            self.put_many(loaded, version)
+            found.update(loaded)
+        return found
+
+    def get(self, session: Session, store_id: str, max_age: float = 0) -> StoreMetadata:
+        return self.get_many(session, [store_id], max_age)[store_id]
+
+    def warm_up(self, session: Session) -> int:
+        """Load the metadata of every store (up to max_size) with one query per table"""
+        version = self.sync(session)
+        timezones = dict(session.exec(select(Timezone.store_id, Timezone.timezone_str)).all())
+        statement = select(BusinessHours.store_id, BusinessHours.day_of_week, BusinessHours.start_time_local,
+                           BusinessHours.end_time_local).order_by(BusinessHours.store_id, BusinessHours.day_of_week)
+        business_hours = {store_id: list(rows)
+                          for store_id, rows in groupby(session.exec(statement), key=lambda row: row.store_id)}
+        store_ids = session.exec(select(Store.store_id).order_by(Store.store_id).limit(self.max_size)).all()
+        self.put_many({store_id: build_metadata(store_id, timezones.get(store_id, DEFAULT_TIMEZONE),
+                                                business_hours.get(store_id, []))
+                       for store_id in store_ids}, version)
+        return len(store_ids)
+
+    def invalidate(self, store_id: str):
+        with self.lock:
+            self.entries.pop(store_id, None)
+
+    def invalidate_many(self, store_ids: Iterable[str]):
+        with self.lock:
+            for store_id in store_ids:
+                self.entries.pop(store_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.checked_at = None
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            }
+
+
+store_metadata_cache = StoreMetadataCache(settings.STORE_CACHE_SIZE)
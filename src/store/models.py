@@ -2,6 +2,9 @@ from typing import Optional, List, TYPE_CHECKING
 
 from sqlmodel import Field, SQLModel, Relationship
 
+# longest store_id accepted, the width of the store_id column of columnar reports.
+STORE_ID_MAX_LENGTH = 64
+
 if TYPE_CHECKING:
     from src.store_status.models import StoreStatus
     from src.business_hours.models import BusinessHours
@@ -1,8 +1,12 @@
-from fastapi import APIRouter, Depends, status, HTTPException, Query
-from typing import List
+from fastapi import APIRouter, Depends, status, HTTPException, Query, Response
+from typing import List, Optional
+from src.store.cache import store_metadata_cache
 from src.store.models import Store
-from src.db import get_session
+from src.store.utils import check_store_ids
+from src.db import get_async_session, get_session
+from src.report.version import bump_data_version
 from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from sqlalchemy.exc import IntegrityError
 
@@ -15,7 +19,9 @@ router = APIRouter(
 def create_store(*, session: Session = Depends(get_session), store: Store):
     db_store = Store.from_orm(store)
     try:
+        check_store_ids([db_store.store_id])
         session.add(db_store)
+        bump_data_version(session)
         session.commit()
         session.refresh(db_store)
         return db_store
@@ -23,6 +29,9 @@ def create_store(*, session: Session = Depends(get_session), store: Store):
         session.rollback()
         print(f"Duplicate key error: {str(e)}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Duplicate key error: {str(e)}")
+    except ValueError as e:
+        session.rollback()
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
     except Exception as e:
         session.rollback()
         print(f"An error occurred: {str(e)}")
@@ -30,16 +39,34 @@ def create_store(*, session: Session = Depends(get_session), store: Store):
 
 
 @router.get("/all", response_model=List[Store])
-def get_stores(*, skip: int = 0, limit: int = Query(default=100, le=100), session: Session = Depends(get_session)):
-    statement = select(Store).offset(skip).limit(limit)
+def get_stores(*, response: Response, after: Optional[str] = None, skip: int = Query(default=0, deprecated=True),
+               limit: int = Query(default=100, ge=1, le=100), session: Session = Depends(get_session)):
+    """Stores ordered by store_id. Pass the `X-Next-Cursor` header of a page as `after` to get the next page, the
+    last page has no cursor"""
+    statement = select(Store).order_by(Store.store_id)
+    if after is not None:
+        statement = statement.where(Store.store_id > after)
+    # one more store than the page tells whether there's a next page.
+    statement = statement.offset(skip).limit(limit + 1)
     results = session.exec(statement)
     stores = results.all()
+    if len(stores) > limit:
+        stores = stores[:limit]
+        response.headers["X-Next-Cursor"] = stores[-1].store_id
     return stores
 
 
+@router.get("/metadata-cache")
+def get_metadata_cache_stats():
+    """Size and hit/miss counters of the store metadata cache"""
+    return store_metadata_cache.stats()
+
+
 @router.get("/{store_id}")
-def get_store(*, store_id: str, session: Session = Depends(get_session)):
+async def get_store(*, store_id: str, session: AsyncSession = Depends(get_async_session)):
     statement = select(Store).where(Store.store_id == store_id)
-    results = session.exec(statement)
-    store = results.one()
+    results = await session.exec(statement)
+    store = results.first()
+    if store is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"store {store_id} not found")
     return store
@@ -1,19 +1,32 @@
-from typing import Optional
+from typing import Iterable, List, Optional
+from src.db import dialect_insert
+from src.store.models import STORE_ID_MAX_LENGTH, Store
 from src.timezones.models import Timezone
 from sqlmodel import Session, select
 
+DEFAULT_TIMEZONE = "America/Chicago"
+# rows per batch of inserts or IN list, keeps sqlite below its bound parameter limit.
+INSERT_BATCH_SIZE = 5000
+
 
 def get_timezone(store_id, session: Session) -> str:
     """Get Store's timezone_str (if exists) else default timezone"""
-    result: Optional[Timezone] = None
-    try:
-        statement = select(Timezone).where(Timezone.store_id == store_id)
-        result = session.exec(statement).one()
-    except Exception as e:
-        print(e)
+    statement = select(Timezone.timezone_str).where(Timezone.store_id == store_id)
+    timezone_str: Optional[str] = session.exec(statement).first()
+    return timezone_str or DEFAULT_TIMEZONE
+
+
+def check_store_ids(store_ids: Iterable[str]):
+    """Raise ValueError for a store_id too long to be reported"""
+    for store_id in store_ids:
+        if len(store_id) > STORE_ID_MAX_LENGTH:
+            raise ValueError(f"store_id '{store_id}' is longer than {STORE_ID_MAX_LENGTH} characters")
+
 
-    default_timezone = "America/Chicago"
-    if result is None:
-        return default_timezone
-    else:
-        return result.timezone_str
+def insert_missing_stores(session: Session, store_ids: List[str]):
+    """Create the stores that don't exist yet, raises ValueError if a store_id is too long"""
+    check_store_ids(store_ids)
+    # run with every batch's parameters, so it's compiled once.
+    statement = dialect_insert(Store.__table__).on_conflict_do_nothing(index_elements=["store_id"])
+    for i in range(0, len(store_ids), INSERT_BATCH_SIZE):
+        session.execute(statement, [{"store_id": store_id} for store_id in store_ids[i:i + INSERT_BATCH_SIZE]])
@@ -0,0 +1,104 @@
+"""Export of raw store status polls, streamed as NDJSON or CSV.
+
+Rows are read through a server-side cursor and written out a chunk at a time, so an export
+holds at most EXPORT_CHUNK_ROWS rows in memory however many it returns. Timestamps are written
+the way the sample `store-status.csv` has them, so an export can be loaded again with POST
+/store-status/bulk or the seed script. Chunks are gzipped on the fly when the client accepts it.
+"""
+import csv
+import json
+import zlib
+from datetime import datetime
+from enum import Enum
+from typing import Iterable, Iterator, List, Optional
+
+from sqlmodel import Session, select
+
+from src.db import engine
+from src.report.batch import STREAM_BATCH_SIZE, stream_rows
+from src.report.storage import CsvBuffer
+from src.store_status.models import StoreStatus
+from src.store_status.utils import FIELDS
+
+# rows formatted and sent to the client at once.
+EXPORT_CHUNK_ROWS = STREAM_BATCH_SIZE
+# most store_ids accepted by a single export.
+MAX_EXPORT_STORES = 1000
+# zlib window bits producing a gzip stream.
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+class ExportFormat(str, Enum):
+    ndjson = "ndjson"
+    csv = "csv"
+
+
+MEDIA_TYPES = {ExportFormat.ndjson: "application/x-ndjson", ExportFormat.csv: "text/csv"}
+
+
+def accepts_gzip(accept_encoding: str) -> bool:
+    """Whether an Accept-Encoding header allows gzip (or any encoding) with a non-zero quality"""
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        if coding.strip().lower() not in ("gzip", "*"):
+            continue
+        quality = params.strip().lower()
+        if quality.startswith("q="):
+            try:
+                return float(quality[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+
+def format_timestamp(timestamp: datetime) -> str:
+    return timestamp.isoformat(sep=" ") + " UTC"
+
+
+def export_statement(store_ids: Optional[List[str]], start_utc: Optional[datetime], end_utc: Optional[datetime]):
+    statement = select(StoreStatus.store_id, StoreStatus.status, StoreStatus.timestamp_utc)
+    if store_ids:
+        statement = statement.where(StoreStatus.store_id.in_(store_ids))
+    if start_utc is not None:
+        statement = statement.where(StoreStatus.timestamp_utc >= start_utc)
+    if end_utc is not None:
+        statement = statement.where(StoreStatus.timestamp_utc < end_utc)
+    return statement.order_by(StoreStatus.store_id, StoreStatus.timestamp_utc)
+
+
+def iter_ndjson(chunks: Iterable[list]) -> Iterator[str]:
+    for rows in chunks:
+        yield "".join(f'{{"store_id": {json.dumps(row.store_id)}, "status": {json.dumps(row.status)}, '
+                      f'"timestamp_utc": "{format_timestamp(row.timestamp_utc)}"}}\n' for row in rows)
+
+
+def iter_csv(chunks: Iterable[list]) -> Iterator[str]:
+    buffer = CsvBuffer()
+    writer = csv.writer(buffer)
+    writer.writerow(FIELDS)
+    yield buffer.pop()
+    for rows in chunks:
+        writer.writerows((row.store_id, row.status, format_timestamp(row.timestamp_utc)) for row in rows)
+        yield buffer.pop()
+
+
+def gzip_chunks(chunks: Iterable[str]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, GZIP_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk.encode())
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def iter_store_status_export(store_ids: Optional[List[str]], start_utc: Optional[datetime],
+                             end_utc: Optional[datetime], export_format: ExportFormat) -> Iterator[str]:
+    """Runs while the response is streamed, with its own session, since the request's is closed by then"""
+    with Session(engine) as session:
+        rows = stream_rows(session, export_statement(store_ids, start_utc, end_utc))
+        chunks = rows.partitions(EXPORT_CHUNK_ROWS)
+        if export_format == ExportFormat.csv:
+            yield from iter_csv(chunks)
+        else:
+            yield from iter_ndjson(chunks)
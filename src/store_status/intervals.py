@@ -0,0 +1,206 @@
+"""Run-length compaction of polls into the storestatusinterval table.
+
+Consecutive polls of a store with the same status collapse into a single interval (its
+first and last poll, status and number of polls). A status holds until the next poll, so a
+store's status over time only changes at the first poll of each interval: reports read the
+intervals instead of the polls, and a week of a store polled every hour is a handful of
+rows rather than 168.
+
+Intervals are kept up to date by the ingest routes, in the transaction inserting the polls.
+Polls newer than a store's last interval extend it or start new ones. Late polls (older
+than the store's last poll) re-derive the store's intervals around them from the polls.
+Every change returns the span of time whose status changed, so the days that depend on it
+are recomputed. `python -m scripts.migrate compact` derives every interval again.
+"""
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import and_, bindparam, delete, func, text, update
+from sqlalchemy.engine import Connection
+from sqlmodel import Session, select
+
+from src.store_status.models import StoreStatus, StoreStatusInterval
+
+# stores whose last interval is read at once.
+LOOKUP_BATCH_SIZE = 1000
+# rows deleted per statement by the retention job.
+DELETE_BATCH_SIZE = 10_000
+
+
+class Run(NamedTuple):
+    start_utc: datetime
+    end_utc: datetime
+    status: str
+    poll_count: int
+
+
+class Span(NamedTuple):
+    """Time from start_utc to end_utc (None: from then on) over which a store's status changed"""
+    store_id: str
+    start_utc: datetime
+    end_utc: Optional[datetime]
+
+
+def run_lengths(polls: Iterable[Tuple[datetime, str]]) -> List[Run]:
+    """Runs of consecutive (timestamp_utc, status) polls with the same status, polls ordered by time"""
+    runs = []
+    for timestamp_utc, status in polls:
+        if runs and runs[-1].status == status:
+            runs[-1] = runs[-1]._replace(end_utc=timestamp_utc, poll_count=runs[-1].poll_count + 1)
+        else:
+            runs.append(Run(timestamp_utc, timestamp_utc, status, 1))
+    return runs
+
+
+def interval_rows(store_id: str, runs: List[Run]) -> List[dict]:
+    return [{"store_id": store_id, **run._asdict()} for run in runs]
+
+
+def last_intervals(session: Session, store_ids: List[str]) -> Dict[str, tuple]:
+    """Most recent interval of each store, locked until the transaction ends (postgres)"""
+    latest = select(StoreStatusInterval.store_id, func.max(StoreStatusInterval.start_utc).label("start_utc")).where(
+        StoreStatusInterval.store_id.in_(store_ids)).group_by(StoreStatusInterval.store_id).subquery()
+    statement = select(StoreStatusInterval.id, StoreStatusInterval.store_id, StoreStatusInterval.start_utc,
+                       StoreStatusInterval.end_utc, StoreStatusInterval.status,
+                       StoreStatusInterval.poll_count).join(latest, and_(
+                           StoreStatusInterval.store_id == latest.c.store_id,
+                           StoreStatusInterval.start_utc == latest.c.start_utc)).with_for_update(of=StoreStatusInterval)
+    return {row.store_id: row for row in session.exec(statement)}
+
+
+# statements of recompact_store, built once so every late poll reuses their compiled form.
+RUN_START_STATEMENT = select(func.max(StoreStatusInterval.start_utc)).where(
+    StoreStatusInterval.store_id == bindparam("store_id"), StoreStatusInterval.start_utc <= bindparam("first_utc"))
+FOLLOWING_STATEMENT = select(StoreStatusInterval.id, StoreStatusInterval.start_utc, StoreStatusInterval.status,
+                             StoreStatusInterval.poll_count).where(
+    StoreStatusInterval.store_id == bindparam("store_id"),
+    StoreStatusInterval.start_utc > bindparam("last_utc")).order_by(StoreStatusInterval.start_utc).limit(1)
+POLLS_STATEMENT = select(StoreStatus.timestamp_utc, StoreStatus.status).where(
+    StoreStatus.store_id == bindparam("store_id"), StoreStatus.timestamp_utc >= bindparam("start_utc")).order_by(
+    StoreStatus.timestamp_utc)
+REPLACED_STATEMENT = delete(StoreStatusInterval.__table__).where(
+    StoreStatusInterval.store_id == bindparam("store_id"), StoreStatusInterval.start_utc >= bindparam("start_utc"))
+BOUNDED_POLLS_STATEMENT = POLLS_STATEMENT.where(StoreStatus.timestamp_utc < bindparam("until_utc"))
+BOUNDED_REPLACED_STATEMENT = REPLACED_STATEMENT.where(StoreStatusInterval.start_utc < bindparam("until_utc"))
+INSERT_STATEMENT = StoreStatusInterval.__table__.insert()
+
+
+def recompact_store(session: Session, store_id: str, first_utc: datetime, last_utc: datetime) -> Span:
+    """Derive the intervals of a store around late polls in [first_utc, last_utc] from its polls again.
+
+    Only the intervals from the one holding first_utc up to the first one starting after
+    last_utc are replaced.
+    """
+    table = StoreStatusInterval.__table__
+    start = session.exec(RUN_START_STATEMENT, params={"store_id": store_id, "first_utc": first_utc}).one() or first_utc
+    following = session.exec(FOLLOWING_STATEMENT, params={"store_id": store_id, "last_utc": last_utc}).first()
+
+    params = {"store_id": store_id, "start_utc": start}
+    if following is None:
+        polls = session.exec(POLLS_STATEMENT, params=params).all()
+        session.execute(REPLACED_STATEMENT, params)
+    else:
+        params["until_utc"] = following.start_utc
+        polls = session.exec(BOUNDED_POLLS_STATEMENT, params=params).all()
+        session.execute(BOUNDED_REPLACED_STATEMENT, params)
+
+    runs = run_lengths(polls)
+    if following is not None and runs and runs[-1].status == following.status:
+        # a late poll before the following interval with its status: it starts earlier.
+        session.execute(update(table).where(table.c.id == following.id).values(
+            start_utc=runs[-1].start_utc, poll_count=following.poll_count + runs[-1].poll_count))
+        runs.pop()
+    if runs:
+        session.execute(INSERT_STATEMENT, interval_rows(store_id, runs))
+
+    end = next((timestamp_utc for timestamp_utc, _ in polls if timestamp_utc > last_utc), None)
+    if end is None and following is not None:
+        end = following.start_utc
+    return Span(store_id, first_utc, end)
+
+
+def compact_polls(session: Session, polls: Iterable[Tuple[str, datetime, str]]) -> List[Span]:
+    """Fold newly inserted (store_id, timestamp_utc, status) polls into the intervals, before their transaction
+    commits. Returns the spans whose status changed"""
+    store_polls = defaultdict(list)
+    for store_id, timestamp_utc, status in polls:
+        if timestamp_utc.tzinfo is not None:
+            timestamp_utc = timestamp_utc.astimezone(timezone.utc).replace(tzinfo=None)
+        store_polls[store_id].append((timestamp_utc, status))
+    store_ids = sorted(store_polls)
+
+    table = StoreStatusInterval.__table__
+    spans, inserts, updates = [], [], []
+    for i in range(0, len(store_ids), LOOKUP_BATCH_SIZE):
+        batch = store_ids[i:i + LOOKUP_BATCH_SIZE]
+        last = last_intervals(session, batch)
+        for store_id in batch:
+            new_polls = sorted(store_polls[store_id])
+            interval = last.get(store_id)
+            if interval is not None and new_polls[0][0] < interval.end_utc:
+                spans.append(recompact_store(session, store_id, new_polls[0][0], new_polls[-1][0]))
+                continue
+            run = Run(interval.start_utc, interval.end_utc, interval.status, interval.poll_count) if interval else None
+            runs, changed_at = [], None
+            for timestamp_utc, status in new_polls:
+                if run is not None and timestamp_utc <= run.end_utc:
+                    # a poll that already exists.
+                    continue
+                if run is not None and run.status == status:
+                    run = run._replace(end_utc=timestamp_utc, poll_count=run.poll_count + 1)
+                    continue
+                if run is not None:
+                    runs.append(run)
+                run = Run(timestamp_utc, timestamp_utc, status, 1)
+                changed_at = changed_at or timestamp_utc
+            runs.append(run)
+            if interval is not None:
+                extended = runs.pop(0)
+                if extended.end_utc != interval.end_utc:
+                    updates.append({"interval_id": interval.id, "run_end_utc": extended.end_utc,
+                                    "run_poll_count": extended.poll_count})
+            inserts.extend(interval_rows(store_id, runs))
+            if changed_at is not None:
+                spans.append(Span(store_id, changed_at, None))
+
+    if updates:
+        session.execute(update(table).where(table.c.id == bindparam("interval_id")).values(
+            end_utc=bindparam("run_end_utc"), poll_count=bindparam("run_poll_count")), updates)
+    if inserts:
+        session.execute(INSERT_STATEMENT, inserts)
+    return spans
+
+
+def runs_statement():
+    """Intervals of the polls as (store_id, start_utc, end_utc, status, poll_count): polls of a run are numbered
+    consecutively both among the store's polls and among its polls with that status"""
+    polls = select(StoreStatus.store_id, StoreStatus.timestamp_utc, StoreStatus.status, (
+        func.row_number().over(partition_by=StoreStatus.store_id, order_by=StoreStatus.timestamp_utc) -
+        func.row_number().over(partition_by=[StoreStatus.store_id, StoreStatus.status],
+                               order_by=StoreStatus.timestamp_utc)).label("run"))
+    polls = polls.subquery()
+    return select(polls.c.store_id, func.min(polls.c.timestamp_utc), func.max(polls.c.timestamp_utc), polls.c.status,
+                  func.count()).group_by(polls.c.store_id, polls.c.status, polls.c.run)
+
+
+def rebuild_intervals(connection: Connection) -> int:
+    """Derive every interval from the polls again, returns the number of intervals"""
+    table = StoreStatusInterval.__table__
+    connection.execute(delete(table))
+    return connection.execute(table.insert().from_select(
+        ["store_id", "start_utc", "end_utc", "status", "poll_count"], runs_statement())).rowcount
+
+
+def apply_interval_retention(connection: Connection, cutoff: datetime) -> int:
+    """Delete the intervals that ended before cutoff, except the last one of each store, whose status still holds"""
+    deleted = 0
+    while True:
+        rowcount = connection.execute(text(
+            "DELETE FROM storestatusinterval WHERE id IN (SELECT id FROM storestatusinterval i WHERE end_utc < :cutoff "
+            "AND EXISTS (SELECT 1 FROM storestatusinterval later WHERE later.store_id = i.store_id "
+            f"AND later.start_utc > i.start_utc) LIMIT {DELETE_BATCH_SIZE})"), {"cutoff": cutoff}).rowcount
+        deleted += rowcount
+        if rowcount < DELETE_BATCH_SIZE:
+            break
+    return deleted
@@ -0,0 +1,277 @@
+"""In-memory view of the most recent polls of every store, for live last-hour uptime.
+
+Every store owns LIVE_STATUS_BUFFER_SIZE slots of two flat arrays (poll times in
+microseconds since the epoch, and whether the poll was active) used as a ring buffer
+holding its newest polls in order: appending a poll newer than the store's last one
+overwrites the oldest slot, an older poll is inserted in place (or dropped when it's older
+than every poll kept). The buffer is rebuilt from the polls of the last
+LIVE_STATUS_REBUILD_HOURS when the server starts, each store's status at their start
+carried in from its status intervals, then fed by the ingest routes once their polls are
+committed.
+
+Last-hour uptime follows the report: a poll's status holds until the next poll, a store is
+inactive before its first known poll, and only business hours count. Timezones and business
+hours come from the store metadata cache, checked for writes of other processes only every
+STORE_CACHE_TTL_SECONDS, so a warm server answers without the database.
+Each server process only sees the polls it ingested, polls inserted by other processes show
+up after a restart.
+"""
+from array import array
+from bisect import bisect_left
+from itertools import chain
+from datetime import datetime, timedelta, timezone
+from threading import Lock
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from sqlmodel import Session, select
+
+from src.business_hours.schedule import SECONDS_IN_DAY
+from src.config import settings
+from src.report.batch import carried_runs_statement, stream_rows
+from src.report.engine import StoreStatusEnum, business_intervals_utc
+from src.store.cache import StoreMetadata
+from src.store_status.models import StoreStatus
+from src.store_status.watermark import store_status_watermark
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECONDS = 1_000_000
+# 1970-01-05, the first Monday after the epoch, schedules count seconds from a Monday 00:00.
+FIRST_MONDAY = 4 * SECONDS_IN_DAY
+LAST_HOUR_SECONDS = 3600
+# stores computed at once while holding the lock, so ingestion isn't blocked by a whole fleet.
+COMPUTE_BATCH_SIZE = 1000
+
+
+def to_microseconds(timestamp_utc: datetime) -> int:
+    if timestamp_utc.tzinfo is not None:
+        timestamp_utc = timestamp_utc.astimezone(timezone.utc).replace(tzinfo=None)
+    return (timestamp_utc - EPOCH) // timedelta(microseconds=1)
+
+
+def from_microseconds(microseconds: int) -> datetime:
+    return EPOCH + timedelta(microseconds=microseconds)
+
+
+class LiveStoreStatus(NamedTuple):
+    store_id: str
+    # status of the last poll at or before the end of the hour, None without one.
+    status: Optional[str]
+    last_poll_utc: Optional[datetime]
+    uptime_last_hour: float
+    downtime_last_hour: float
+
+    def as_json(self) -> dict:
+        """Plain json types, a fleet's worth of statuses skips the response encoder"""
+        return {**self._asdict(), "last_poll_utc": self.last_poll_utc.isoformat() if self.last_poll_utc else None}
+
+
+def open_seconds_function(metadata: StoreMetadata, start: int, end: int):
+    """Business hours seconds of the store in [a, b) for start <= a <= b <= end, all in seconds since the epoch"""
+    zone = metadata.zone
+    offset = datetime.fromtimestamp(start, zone).utcoffset()
+    if datetime.fromtimestamp(end, zone).utcoffset() == offset:
+        # local time is utc shifted by a constant in the window, count from the schedule directly.
+        shift = int(offset.total_seconds()) - FIRST_MONDAY
+        return lambda a, b: metadata.schedule.open_seconds(a + shift, b + shift)
+    # the window crosses a daylight saving change, clip the utc business hours intervals instead.
+    intervals = business_intervals_utc(metadata.schedule, zone, datetime.fromtimestamp(start, zone).date(),
+                                       datetime.fromtimestamp(end, zone).date())
+    return lambda a, b: sum(max(min(b, hi) - max(a, lo), 0) for lo, hi in intervals)
+
+
+class LiveStatus:
+    def __init__(self, size: int):
+        self.size = size
+        self.rows: Dict[str, int] = {}
+        self.store_ids: List[str] = []
+        # self.size slots per store, slot `starts[row]` holds its oldest poll.
+        self.times = array("q")
+        self.active = array("b")
+        self.starts = array("l")
+        self.counts = array("l")
+        # most recent poll time of any store.
+        self.watermark: Optional[int] = None
+        self.lock = Lock()
+        # polls are only recorded by a process that loaded the buffer, scripts inserting polls don't pay for it.
+        self.loaded = False
+        # the polls of the db were loaded, see rebuild.
+        self.ready = False
+
+    def row(self, store_id: str) -> int:
+        row = self.rows.get(store_id)
+        if row is None:
+            row = self.rows[store_id] = len(self.store_ids)
+            self.store_ids.append(store_id)
+            self.times.frombytes(bytes(self.times.itemsize * self.size))
+            self.active.frombytes(bytes(self.active.itemsize * self.size))
+            self.starts.append(0)
+            self.counts.append(0)
+        return row
+
+    def polls(self, row: int) -> Tuple[List[int], List[int]]:
+        """Times and statuses of a store's polls, oldest first"""
+        base, start, count = row * self.size, self.starts[row], self.counts[row]
+        slots = [base + (start + i) % self.size for i in range(count)]
+        return [self.times[slot] for slot in slots], [self.active[slot] for slot in slots]
+
+    def insert(self, row: int, time: int, active: bool):
+        """Rare path: a poll older than the store's newest one"""
+        times, statuses = self.polls(row)
+        i = bisect_left(times, time)
+        if i < len(times) and times[i] == time:
+            return
+        if len(times) == self.size and i == 0:
+            # older than every poll kept.
+            return
+        times.insert(i, time)
+        statuses.insert(i, active)
+        times, statuses = times[-self.size:], statuses[-self.size:]
+        base = row * self.size
+        self.times[base:base + len(times)] = array("q", times)
+        self.active[base:base + len(statuses)] = array("b", statuses)
+        self.starts[row] = 0
+        self.counts[row] = len(times)
+
+    def add_locked(self, store_id: str, time: int, active: bool):
+        row = self.row(store_id)
+        base, start, count = row * self.size, self.starts[row], self.counts[row]
+        if count:
+            last = self.times[base + (start + count - 1) % self.size]
+            if time <= last:
+                if time < last:
+                    self.insert(row, time, active)
+                return
+        if count < self.size:
+            slot = (start + count) % self.size
+            self.counts[row] = count + 1
+        else:
+            slot = start
+            self.starts[row] = (start + 1) % self.size
+        self.times[base + slot] = time
+        self.active[base + slot] = active
+        if self.watermark is None or time > self.watermark:
+            self.watermark = time
+
+    def add_many(self, polls: Iterable[Tuple[str, datetime, str]]):
+        """Record committed (store_id, timestamp_utc, status) polls"""
+        if not self.loaded:
+            return
+        polls = sorted((to_microseconds(timestamp_utc), store_id, status == StoreStatusEnum.active.value)
+                       for store_id, timestamp_utc, status in polls)
+        with self.lock:
+            for time, store_id, active in polls:
+                self.add_locked(store_id, time, active)
+
+    def rebuild(self, session: Session) -> int:
+        """Load the polls of the last LIVE_STATUS_REBUILD_HOURS before the most recent one, returns the number
+        of polls read. Polls ingested meanwhile are kept."""
+        self.loaded = True
+        watermark = store_status_watermark.refresh(session)
+        if watermark is None:
+            self.ready = True
+            return 0
+        cutoff = watermark - timedelta(hours=settings.LIVE_STATUS_REBUILD_HOURS)
+        # the status interval in progress at the cutoff stands for its last poll before it, so stores without a
+        # recent poll keep their status.
+        carried = [(row.store_id, row.end_utc if row.end_utc < cutoff else row.start_utc, row.status)
+                   for row in session.exec(carried_runs_statement(cutoff))]
+        statement = select(StoreStatus.store_id, StoreStatus.timestamp_utc, StoreStatus.status).where(
+            StoreStatus.timestamp_utc >= cutoff).order_by(StoreStatus.store_id, StoreStatus.timestamp_utc)
+        polls = 0
+        for rows in chain([carried], stream_rows(session, statement).partitions()):
+            with self.lock:
+                for store_id, timestamp_utc, status in rows:
+                    self.add_locked(store_id, to_microseconds(timestamp_utc), status == StoreStatusEnum.active.value)
+            polls += len(rows)
+        self.ready = True
+        return polls
+
+    def end_of_hour(self, at: Optional[datetime]) -> Optional[int]:
+        """The end of the hour in seconds since the epoch: `at`, or the most recent poll"""
+        if at is not None:
+            return to_microseconds(at) // MICROSECONDS
+        with self.lock:
+            return self.watermark // MICROSECONDS if self.watermark is not None else None
+
+    def compute_locked(self, store_id: str, metadata: StoreMetadata, end: int) -> LiveStoreStatus:
+        start = end - LAST_HOUR_SECONDS
+        open_seconds = open_seconds_function(metadata, start, end)
+        total = open_seconds(start, end)
+        row = self.rows.get(store_id)
+        if row is None:
+            return LiveStoreStatus(store_id, None, None, 0.0, round(total / 60, 2))
+        base, first, count = row * self.size, self.starts[row], self.counts[row]
+        # newest first: polls up to the end of the hour, down to the last one at or before its start.
+        polls, last_poll = [], None
+        for i in range(count - 1, -1, -1):
+            slot = base + (first + i) % self.size
+            time = self.times[slot] // MICROSECONDS
+            if time > end:
+                continue
+            if last_poll is None:
+                last_poll = (self.times[slot], self.active[slot])
+            if time < end:
+                polls.append((time, self.active[slot]))
+            if time <= start:
+                break
+        up = 0
+        polls.reverse()
+        for i, (time, active) in enumerate(polls):
+            if active:
+                until = polls[i + 1][0] if i + 1 < len(polls) else end
+                up += open_seconds(max(time, start), until)
+        status = None
+        if last_poll is not None:
+            status = (StoreStatusEnum.active if last_poll[1] else StoreStatusEnum.inactive).value
+        return LiveStoreStatus(store_id, status, from_microseconds(last_poll[0]) if last_poll is not None else None,
+                               round(up / 60, 2), round((total - up) / 60, 2))
+
+    def compute(self, metadata: Dict[str, StoreMetadata], end: int) -> List[LiveStoreStatus]:
+        """Last-hour uptime of the stores of `metadata` for the hour ending at `end`"""
+        store_ids = list(metadata)
+        statuses = []
+        for i in range(0, len(store_ids), COMPUTE_BATCH_SIZE):
+            with self.lock:
+                statuses.extend(self.compute_locked(store_id, metadata[store_id], end)
+                                for store_id in store_ids[i:i + COMPUTE_BATCH_SIZE])
+        return statuses
+
+    def known_store_ids(self) -> List[str]:
+        with self.lock:
+            return sorted(self.store_ids)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "stores": len(self.store_ids),
+                "polls": sum(self.counts),
+                "buffer_size": self.size,
+                "bytes": self.times.itemsize * len(self.times) + self.active.itemsize * len(self.active),
+                "watermark_utc": from_microseconds(self.watermark) if self.watermark is not None else None,
+            }
+
+
+def hour_window(end: int) -> dict:
+    return {"window_start_utc": from_microseconds((end - LAST_HOUR_SECONDS) * MICROSECONDS).isoformat(),
+            "window_end_utc": from_microseconds(end * MICROSECONDS).isoformat()}
+
+
+def summarize(statuses: List[LiveStoreStatus], end: int, include_stores: bool = True) -> dict:
+    counts = {status.value: 0 for status in StoreStatusEnum}
+    for status in statuses:
+        if status.status is not None:
+            counts[status.status] += 1
+    summary = {
+        **hour_window(end),
+        "stores": len(statuses),
+        **counts,
+        "unknown": len(statuses) - sum(counts.values()),
+        "uptime_last_hour": round(sum(status.uptime_last_hour for status in statuses), 2),
+        "downtime_last_hour": round(sum(status.downtime_last_hour for status in statuses), 2),
+    }
+    if include_stores:
+        summary["store_statuses"] = [status.as_json() for status in statuses]
+    return summary
+
+
+live_status = LiveStatus(settings.LIVE_STATUS_BUFFER_SIZE)
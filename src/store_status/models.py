@@ -1,7 +1,7 @@
 from typing import Optional, TYPE_CHECKING
 from datetime import datetime
 
-from sqlmodel import Field, SQLModel, Relationship, UniqueConstraint
+from sqlmodel import Field, Index, SQLModel, Relationship, UniqueConstraint
 
 if TYPE_CHECKING:
     from src.store.models import Store
@@ -10,6 +10,8 @@ if TYPE_CHECKING:
 class StoreStatus(SQLModel, table=True):
     __table_args__ = (
         UniqueConstraint("timestamp_utc", "store_id", name="unique_store_event"),
+        # per-store range scans, covering the columns reports read.
+        Index("ix_storestatus_store_id_timestamp_utc", "store_id", "timestamp_utc", "status"),
     )
 
     id: Optional[int] = Field(default=None, primary_key=True)
@@ -18,3 +20,19 @@ class StoreStatus(SQLModel, table=True):
 
     store_id: str = Field(foreign_key="store.store_id")
     store: "Store" = Relationship(back_populates="status_polls")
+
+
+class StoreStatusInterval(SQLModel, table=True):
+    """A run of consecutive polls of a store with the same status, see src/store_status/intervals.py"""
+    __table_args__ = (
+        # also serves the lookups of a store's interval in progress at some time.
+        UniqueConstraint("store_id", "start_utc", name="unique_store_interval"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    store_id: str
+    # first and last poll of the run, its status holds until the first poll of the next run.
+    start_utc: datetime = Field(index=True)
+    end_utc: datetime
+    status: str
+    poll_count: int
@@ -0,0 +1,147 @@
+"""Weekly partitions of the storestatus table and the retention job.
+
+On postgres, storestatus is partitioned by range of timestamp_utc into one partition per
+week (Monday 00:00 utc to the next Monday), named `storestatus_p<YYYYMMDD>`, plus a
+default partition catching rows of weeks that don't have a partition yet. Maintenance
+moves those rows into their own weekly partitions and creates upcoming weeks ahead of time.
+Other databases keep a single table, the retention job deletes old rows from it.
+"""
+from datetime import date, datetime, timedelta
+from typing import List, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+TABLE = "storestatus"
+PARTITION_PREFIX = "storestatus_p"
+DEFAULT_PARTITION = "storestatus_default"
+WEEK = timedelta(weeks=1)
+# rows deleted per statement by the retention job on databases without partitions.
+DELETE_BATCH_SIZE = 10_000
+# key of the postgres advisory lock serializing partition maintenance, e.g. of servers starting at once (next to
+# the migrations' lock key).
+PARTITION_LOCK_KEY = 7_110_313
+
+
+def week_start(day: date) -> date:
+    return day - timedelta(days=day.weekday())
+
+
+def partition_name(week: date) -> str:
+    return PARTITION_PREFIX + week.strftime("%Y%m%d")
+
+
+def is_postgres(connection: Connection) -> bool:
+    return connection.dialect.name == "postgresql"
+
+
+def is_partitioned(connection: Connection) -> bool:
+    return connection.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table))"),
+        {"table": TABLE}).scalar()
+
+
+def list_partitions(connection: Connection) -> List[Tuple[str, date]]:
+    """(name, first day) of every weekly partition, ordered by week"""
+    names = connection.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(:table)"), {"table": TABLE}).scalars().all()
+    return sorted((name, datetime.strptime(name[len(PARTITION_PREFIX):], "%Y%m%d").date())
+                  for name in names if name.startswith(PARTITION_PREFIX))
+
+
+def convert_to_partitioned(connection: Connection):
+    """Replace storestatus with a table partitioned by week, keeping its rows and its id sequence.
+
+    Unique constraints on a partitioned table must contain the partition key, so the
+    primary key becomes (id, timestamp_utc).
+    """
+    if is_partitioned(connection):
+        return
+    connection.execute(text(f"""
+        CREATE TABLE {TABLE}_partitioned (
+            id integer NOT NULL DEFAULT nextval('{TABLE}_id_seq'),
+            timestamp_utc timestamp without time zone NOT NULL,
+            status varchar NOT NULL,
+            store_id varchar NOT NULL REFERENCES store (store_id),
+            CONSTRAINT {TABLE}_partitioned_pkey PRIMARY KEY (id, timestamp_utc),
+            CONSTRAINT unique_store_event_partitioned UNIQUE (timestamp_utc, store_id)
+        ) PARTITION BY RANGE (timestamp_utc)"""))
+    connection.execute(text(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {TABLE}_partitioned DEFAULT"))
+    connection.execute(text(f"INSERT INTO {TABLE}_partitioned (id, timestamp_utc, status, store_id) "
+                            f"SELECT id, timestamp_utc, status, store_id FROM {TABLE}"))
+    connection.execute(text(f"ALTER SEQUENCE {TABLE}_id_seq OWNED BY {TABLE}_partitioned.id"))
+    connection.execute(text(f"DROP TABLE {TABLE}"))
+    connection.execute(text(f"ALTER TABLE {TABLE}_partitioned RENAME TO {TABLE}"))
+    connection.execute(text(f"ALTER TABLE {TABLE} RENAME CONSTRAINT {TABLE}_partitioned_pkey TO {TABLE}_pkey"))
+    connection.execute(text(f"ALTER TABLE {TABLE} RENAME CONSTRAINT unique_store_event_partitioned "
+                            f"TO unique_store_event"))
+    connection.execute(text(f"CREATE INDEX ix_storestatus_store_id_timestamp_utc "
+                            f"ON {TABLE} (store_id, timestamp_utc, status)"))
+
+
+def split_default_partition(connection: Connection) -> List[str]:
+    """Move the rows of the default partition into weekly partitions, returns the partitions created"""
+    weeks = connection.execute(text(
+        f"SELECT DISTINCT date_trunc('week', timestamp_utc)::date FROM {DEFAULT_PARTITION}")).scalars().all()
+    created = []
+    for week in sorted(weeks):
+        name, bounds = partition_name(week), {"start": week, "end": week + WEEK}
+        connection.execute(text(f"CREATE TABLE {name} (LIKE {TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+        connection.execute(text(
+            f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE timestamp_utc >= :start AND timestamp_utc < :end "
+            f"RETURNING id, timestamp_utc, status, store_id) "
+            f"INSERT INTO {name} (id, timestamp_utc, status, store_id) SELECT * FROM moved"), bounds)
+        connection.execute(text(
+            f"ALTER TABLE {TABLE} ATTACH PARTITION {name} FOR VALUES FROM ('{bounds['start']}') TO ('{bounds['end']}')"))
+        created.append(name)
+    return created
+
+
+def create_upcoming_partitions(connection: Connection, today: date, weeks_ahead: int) -> List[str]:
+    """Create the partitions of the current week and the next weeks_ahead weeks if they're missing"""
+    existing = {name for name, _ in list_partitions(connection)}
+    created = []
+    for i in range(weeks_ahead + 1):
+        week = week_start(today) + WEEK * i
+        name = partition_name(week)
+        if name in existing:
+            continue
+        connection.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {TABLE} "
+            f"FOR VALUES FROM ('{week}') TO ('{week + WEEK}')"))
+        created.append(name)
+    return created
+
+
+def maintain_partitions(connection: Connection, today: date, weeks_ahead: int) -> List[str]:
+    """Give every week with rows its own partition and create the upcoming ones, returns the partitions created.
+    Holds the partition lock until the connection's transaction ends"""
+    if not is_postgres(connection) or not is_partitioned(connection):
+        return []
+    connection.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": PARTITION_LOCK_KEY})
+    return split_default_partition(connection) + create_upcoming_partitions(connection, today, weeks_ahead)
+
+
+def apply_retention(connection: Connection, cutoff: datetime) -> dict:
+    """Drop the polls before cutoff: whole weekly partitions on postgres, batched deletes elsewhere"""
+    if is_postgres(connection) and is_partitioned(connection):
+        dropped = []
+        for name, week in list_partitions(connection):
+            if datetime.combine(week + WEEK, datetime.min.time()) <= cutoff:
+                connection.execute(text(f"DROP TABLE {name}"))
+                dropped.append(name)
+        deleted = connection.execute(text(f"DELETE FROM {DEFAULT_PARTITION} WHERE timestamp_utc < :cutoff"),
+                                     {"cutoff": cutoff}).rowcount
+        return {"dropped_partitions": dropped, "deleted_rows": deleted}
+
+    deleted = 0
+    while True:
+        rowcount = connection.execute(text(
+            f"DELETE FROM {TABLE} WHERE id IN "
+            f"(SELECT id FROM {TABLE} WHERE timestamp_utc < :cutoff LIMIT {DELETE_BATCH_SIZE})"),
+            {"cutoff": cutoff}).rowcount
+        deleted += rowcount
+        if rowcount < DELETE_BATCH_SIZE:
+            break
+    return {"dropped_partitions": [], "deleted_rows": deleted}
@@ -0,0 +1,78 @@
+"""Pruning of the polls inside status intervals.
+
+Once compacted, the polls between the first and the last poll of an interval have the
+interval's status and change nothing a report computes, so the prune job deletes the ones
+older than STORE_STATUS_PRUNE_DAYS before the most recent poll. The first and last poll of
+every interval are kept, so the intervals can always be derived from the polls again, and
+an interval's poll_count counts the polls left. With STORE_STATUS_ARCHIVE_DIR set, the
+pruned polls are first appended to a gzipped NDJSON file in the export format, which
+POST /store-status/bulk and the seed script load again.
+"""
+import gzip
+import os
+from collections import Counter
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import and_, bindparam, delete, update
+from sqlmodel import Session, select
+
+from src.db import utcnow
+from src.report.batch import load_store_ids
+from src.store_status.export import iter_ndjson
+from src.store_status.models import StoreStatus, StoreStatusInterval
+
+# stores whose polls are pruned in a transaction of their own.
+PRUNE_BATCH_SIZE = 1000
+# rows deleted per statement, keeps sqlite below its bound parameter limit.
+DELETE_BATCH_SIZE = 1000
+
+
+def interior_polls_statement(store_ids, cutoff: datetime):
+    """Polls before cutoff strictly between the first and the last poll of their interval"""
+    return select(StoreStatus.id, StoreStatus.store_id, StoreStatus.status, StoreStatus.timestamp_utc,
+                  StoreStatusInterval.id.label("interval_id")).join(StoreStatusInterval, and_(
+                      StoreStatusInterval.store_id == StoreStatus.store_id,
+                      StoreStatusInterval.start_utc < StoreStatus.timestamp_utc,
+                      StoreStatusInterval.end_utc > StoreStatus.timestamp_utc)).where(
+        StoreStatus.store_id.in_(store_ids), StoreStatus.timestamp_utc < cutoff,
+        StoreStatusInterval.start_utc < cutoff).order_by(StoreStatus.store_id, StoreStatus.timestamp_utc)
+
+
+def archive_filename(archive_dir: str, cutoff: datetime) -> str:
+    return os.path.join(archive_dir, f"storestatus-{cutoff:%Y%m%dT%H%M%S}-{utcnow():%Y%m%dT%H%M%S}.ndjson.gz")
+
+
+def prune_polls(session: Session, cutoff: datetime, archive_dir: Optional[str] = None) -> dict:
+    """Delete the polls before cutoff inside status intervals, archiving them to archive_dir first if given"""
+    archive, archive_path = None, None
+    if archive_dir:
+        os.makedirs(archive_dir, exist_ok=True)
+        archive_path = archive_filename(archive_dir, cutoff)
+        archive = gzip.open(archive_path, "wt")
+    table = StoreStatusInterval.__table__
+    pruned, intervals = 0, 0
+    try:
+        store_ids = load_store_ids(session)
+        for i in range(0, len(store_ids), PRUNE_BATCH_SIZE):
+            rows = session.exec(interior_polls_statement(store_ids[i:i + PRUNE_BATCH_SIZE], cutoff)).all()
+            if not rows:
+                continue
+            if archive is not None:
+                # written out before the polls are deleted.
+                archive.writelines(iter_ndjson([rows]))
+                archive.flush()
+            for j in range(0, len(rows), DELETE_BATCH_SIZE):
+                session.execute(delete(StoreStatus).where(
+                    StoreStatus.id.in_([row.id for row in rows[j:j + DELETE_BATCH_SIZE]])))
+            counts = Counter(row.interval_id for row in rows)
+            session.execute(update(table).where(table.c.id == bindparam("interval_id")).values(
+                poll_count=table.c.poll_count - bindparam("pruned")),
+                [{"interval_id": interval_id, "pruned": count} for interval_id, count in counts.items()])
+            session.commit()
+            pruned += len(rows)
+            intervals += len(counts)
+    finally:
+        if archive is not None:
+            archive.close()
+    return {"cutoff": cutoff.isoformat(), "pruned_polls": pruned, "intervals": intervals, "archive": archive_path}
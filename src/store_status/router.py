@@ -1,7 +1,22 @@
-from fastapi import APIRouter, Depends, status, HTTPException
+from datetime import datetime
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, status, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from src.report.engine import as_naive_utc
+from src.store_status.export import (MAX_EXPORT_STORES, MEDIA_TYPES, ExportFormat, accepts_gzip, gzip_chunks,
+                                     iter_store_status_export)
+from src.store_status.live import hour_window, live_status, summarize
 from src.store_status.models import StoreStatus
-from src.db import get_session
+from src.store_status.utils import ingest_store_statuses, on_polls_committed, on_polls_inserted
+from src.config import settings
+from src.db import get_async_session, get_session
+from src.metrics.utils import record_ingest
+from src.store.cache import store_metadata_cache
+from src.store.utils import insert_missing_stores
 from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from sqlalchemy.exc import IntegrityError
 
@@ -11,18 +26,105 @@ router = APIRouter(
 
 
 @router.post("/", response_model=StoreStatus)
-def create_store(*, session: Session = Depends(get_session), store_status: StoreStatus):
+async def create_store(*, session: AsyncSession = Depends(get_async_session), store_status: StoreStatus):
     db_store_status = StoreStatus.from_orm(store_status)
     try:
+        # like the bulk route, reports only cover the stores that exist.
+        await session.run_sync(insert_missing_stores, [db_store_status.store_id])
         session.add(db_store_status)
-        session.commit()
-        session.refresh(db_store_status)
+        await session.run_sync(on_polls_inserted, [(db_store_status.store_id, db_store_status.timestamp_utc,
+                                                    db_store_status.status)])
+        await session.commit()
+        await session.refresh(db_store_status)
+        on_polls_committed(db_store_status.timestamp_utc, [(db_store_status.store_id, db_store_status.timestamp_utc,
+                                                            db_store_status.status)])
+        record_ingest("single", 1)
         return db_store_status
     except IntegrityError as e:
-        session.rollback()
+        await session.rollback()
         print(f"Duplicate key error: {str(e)}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Duplicate key error: {str(e)}")
+    except ValueError as e:
+        await session.rollback()
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+    except Exception as e:
+        await session.rollback()
+        print(f"An error occurred: {str(e)}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"an error occurred: {str(e)}")
+
+
+@router.post("/bulk")
+async def create_store_statuses(*, request: Request, session: Session = Depends(get_session)):
+    """Insert a JSON array, NDJSON (application/x-ndjson) or CSV (text/csv) body of store statuses,
+    skipping the ones that already exist"""
+    body = await request.body()
+    try:
+        result = await run_in_threadpool(ingest_store_statuses, session, body, request.headers.get("content-type", ""))
+        record_ingest("bulk", result["inserted"])
+        return result
+    except ValueError as e:
+        session.rollback()
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
     except Exception as e:
         session.rollback()
         print(f"An error occurred: {str(e)}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"an error occurred: {str(e)}")
+
+
+@router.get("/export")
+def export_store_statuses(*, request: Request, store_id: Optional[List[str]] = Query(default=None),
+                          start: Optional[datetime] = None, end: Optional[datetime] = None,
+                          export_format: ExportFormat = Query(default=ExportFormat.ndjson, alias="format")):
+    """Stream the polls of the given stores (every store by default) in [start, end), ordered by store and time,
+    gzipped when the client accepts it"""
+    if store_id is not None and len(store_id) > MAX_EXPORT_STORES:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail=f"at most {MAX_EXPORT_STORES} store_ids per export")
+    chunks = iter_store_status_export(sorted(set(store_id)) if store_id else None,
+                                      as_naive_utc(start) if start is not None else None,
+                                      as_naive_utc(end) if end is not None else None, export_format)
+    headers = {"Content-Disposition": f"attachment; filename=store-status.{export_format.value}",
+               "Vary": "Accept-Encoding"}
+    if accepts_gzip(request.headers.get("accept-encoding", "")):
+        headers["Content-Encoding"] = "gzip"
+        chunks = gzip_chunks(chunks)
+    return StreamingResponse(chunks, media_type=MEDIA_TYPES[export_format], headers=headers)
+
+
+def check_live_status():
+    if not settings.LIVE_STATUS_ENABLED:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="LIVE_STATUS_ENABLED is false")
+    if not live_status.ready:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="live status is loading")
+
+
+@router.get("/live")
+def get_live_statuses(*, session: Session = Depends(get_session), store_id: Optional[List[str]] = Query(default=None),
+                      at: Optional[datetime] = None, summary: bool = False):
+    """Current status and uptime/downtime in the hour before `at` (the most recent poll by default) of the given
+    stores, every store with a recent poll by default, computed from the polls kept in memory"""
+    check_live_status()
+    end = live_status.end_of_hour(as_naive_utc(at) if at is not None else None)
+    if end is None:
+        return JSONResponse({"stores": 0})
+    store_ids = sorted(set(store_id)) if store_id else live_status.known_store_ids()
+    metadata = store_metadata_cache.get_many(session, store_ids, settings.STORE_CACHE_TTL_SECONDS)
+    statuses = live_status.compute({store_id: metadata[store_id] for store_id in store_ids}, end)
+    return JSONResponse(summarize(statuses, end, include_stores=not summary))
+
+
+@router.get("/live/{store_id}")
+def get_live_status(*, session: Session = Depends(get_session), store_id: str, at: Optional[datetime] = None):
+    """Current status and uptime/downtime in the hour before `at` (the most recent poll by default) of a store"""
+    check_live_status()
+    end = live_status.end_of_hour(as_naive_utc(at) if at is not None else None)
+    if end is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="no polls yet")
+    metadata = store_metadata_cache.get(session, store_id, settings.STORE_CACHE_TTL_SECONDS)
+    return {**hour_window(end), **live_status.compute({store_id: metadata}, end)[0].as_json()}
+
+
+@router.get("/live-buffer")
+def get_live_buffer_stats():
+    """Stores, polls and memory of the in-memory buffer behind /live"""
+    return live_status.stats()
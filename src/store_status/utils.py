@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+import io
+import json
+from typing import Iterable, Tuple
+from datetime import datetime
+
+from sqlmodel import Session
+
+from src.db import dialect_insert
+from src.lazy import lazy_import
+from src.report.version import bump_data_version
+from src.rollup.utils import mark_spans_dirty
+from src.store.utils import insert_missing_stores
+from src.store_status.intervals import compact_polls
+from src.store_status.live import live_status
+from src.store_status.models import StoreStatus
+from src.store_status.watermark import store_status_watermark
+
+pd = lazy_import("pandas")
+
+# rows per executemany batch.
+BULK_INSERT_BATCH_SIZE = 5000
+STATUSES = {"active", "inactive"}
+FIELDS = ["store_id", "status", "timestamp_utc"]
+
+
+def on_polls_inserted(session: Session, polls: Iterable[Tuple[str, datetime, str]]):
+    """Keep everything derived from (store_id, timestamp_utc, status) polls up to date, called before the inserting
+    transaction commits"""
+    mark_spans_dirty(session, compact_polls(session, polls))
+    bump_data_version(session)
+
+
+def on_polls_committed(last_timestamp_utc: datetime, polls: Iterable[Tuple[str, datetime, str]]):
+    """Called once the polls are committed, with the latest of their timestamps and their (store_id, timestamp_utc,
+    status)"""
+    store_status_watermark.advance(last_timestamp_utc)
+    live_status.add_many(polls)
+
+
+def normalize_timestamps(timestamps: pd.Series) -> pd.Series:
+    """Parse timestamps like `2023-01-22 12:09:39.388884 UTC` (with any number of fractional digits) as naive utc"""
+    timestamps = timestamps.astype(str).str.replace(" UTC", "", regex=False)
+    return pd.to_datetime(timestamps, utc=True, format="ISO8601").dt.tz_localize(None)
+
+
+def normalize_store_statuses(df: pd.DataFrame) -> pd.DataFrame:
+    missing = [field for field in FIELDS if field not in df.columns]
+    if missing:
+        raise ValueError(f"missing fields: {', '.join(missing)}")
+
+    df = df[FIELDS].copy()
+    df["store_id"] = df["store_id"].astype(str).str.strip()
+    df["status"] = df["status"].astype(str).str.strip()
+    invalid = ~df["status"].isin(STATUSES)
+    if invalid.any():
+        raise ValueError(f"invalid status '{df['status'][invalid].iloc[0]}', must be one of {sorted(STATUSES)}")
+    df["timestamp_utc"] = normalize_timestamps(df["timestamp_utc"])
+    return df
+
+
+def parse_store_statuses(body: bytes, content_type: str) -> pd.DataFrame:
+    """Parse a JSON array, NDJSON or CSV (with a header row) body of store statuses"""
+    media_type = content_type.split(";")[0].strip().lower()
+    try:
+        if media_type == "text/csv":
+            df = pd.read_csv(io.BytesIO(body), dtype=str)
+        elif media_type in ("application/x-ndjson", "application/jsonl", "application/ndjson"):
+            df = pd.DataFrame([json.loads(line) for line in body.splitlines() if line.strip()])
+        else:
+            records = json.loads(body)
+            if not isinstance(records, list):
+                raise ValueError("expected a JSON array")
+            df = pd.DataFrame(records)
+    except ValueError as e:
+        raise ValueError(f"could not parse body as {media_type or 'json'}: {str(e)}")
+
+    if df.empty:
+        return pd.DataFrame(columns=FIELDS)
+    return normalize_store_statuses(df)
+
+
+def copy_store_statuses(session: Session, df: pd.DataFrame) -> int:
+    """Postgres: COPY the rows into a staging table, then move them over skipping duplicates"""
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False, columns=["timestamp_utc", "status", "store_id"])
+    buffer.seek(0)
+
+    cursor = session.connection().connection.cursor()
+    try:
+        cursor.execute("CREATE TEMP TABLE storestatus_staging "
+                       "(timestamp_utc timestamp, status varchar, store_id varchar) ON COMMIT DROP")
+        cursor.copy_expert("COPY storestatus_staging (timestamp_utc, status, store_id) FROM STDIN WITH CSV", buffer)
+        cursor.execute("INSERT INTO storestatus (timestamp_utc, status, store_id) "
+                       "SELECT timestamp_utc, status, store_id FROM storestatus_staging "
+                       "ON CONFLICT (timestamp_utc, store_id) DO NOTHING")
+        return cursor.rowcount
+    finally:
+        cursor.close()
+
+
+def insert_store_statuses(session: Session, df: pd.DataFrame) -> int:
+    """Batched executemany of a single INSERT, skipping duplicates"""
+    statement = dialect_insert(StoreStatus.__table__).on_conflict_do_nothing(
+        index_elements=["timestamp_utc", "store_id"])
+    timestamps = df["timestamp_utc"].astype(object).tolist()
+    rows = [{"store_id": store_id, "status": status, "timestamp_utc": timestamp_utc.to_pydatetime()}
+            for store_id, status, timestamp_utc in zip(df["store_id"].tolist(), df["status"].tolist(), timestamps)]
+    inserted = 0
+    for i in range(0, len(rows), BULK_INSERT_BATCH_SIZE):
+        inserted += session.execute(statement, rows[i:i + BULK_INSERT_BATCH_SIZE]).rowcount
+    return inserted
+
+
+def bulk_insert_store_statuses(session: Session, df: pd.DataFrame) -> int:
+    """Insert normalized store statuses in large batches, returns the number of rows inserted.
+
+    Stores referenced by the polls are created if they don't exist yet. Of several polls of a store at the same
+    time, only the first one is kept, like the insert does, so the intervals and the live status see the stored one.
+    """
+    if df.empty:
+        return 0
+    df = df.drop_duplicates(subset=["store_id", "timestamp_utc"], keep="first")
+    insert_missing_stores(session, sorted(df["store_id"].unique().tolist()))
+    if session.get_bind().dialect.name == "postgresql":
+        inserted = copy_store_statuses(session, df)
+    else:
+        inserted = insert_store_statuses(session, df)
+    if inserted:
+        on_polls_inserted(session, zip(df["store_id"].tolist(),
+                                       (timestamp.to_pydatetime() for timestamp in df["timestamp_utc"]),
+                                       df["status"].tolist()))
+    session.commit()
+    on_polls_committed(df["timestamp_utc"].max().to_pydatetime(),
+                       zip(df["store_id"].tolist(), df["timestamp_utc"].tolist(), df["status"].tolist()))
+    return inserted
+
+
+def ingest_store_statuses(session: Session, body: bytes, content_type: str) -> dict:
+    df = parse_store_statuses(body, content_type)
+    inserted = bulk_insert_store_statuses(session, df)
+    return {"received": len(df), "inserted": inserted, "skipped": len(df) - inserted}
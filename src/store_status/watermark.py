@@ -0,0 +1,55 @@
+"""The global watermark: the most recent poll across all stores.
+
+Reports are computed as of the watermark. Reading it is cheap (the unique constraint's
+index leads with timestamp_utc), but it's still cached for WATERMARK_TTL_SECONDS and
+moved forward by the ingest routes of this process, so it's only read from the db when
+another process may have inserted newer polls.
+"""
+import time
+from datetime import datetime, timezone
+from threading import Lock
+from typing import Optional
+
+from sqlalchemy import func
+from sqlmodel import Session, select
+
+from src.config import settings
+from src.store_status.models import StoreStatus
+
+
+class Watermark:
+    def __init__(self, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self.value: Optional[datetime] = None
+        self.loaded_at: Optional[float] = None
+        self.lock = Lock()
+
+    def get(self, session: Session) -> Optional[datetime]:
+        with self.lock:
+            if self.loaded_at is not None and time.monotonic() - self.loaded_at < self.ttl_seconds:
+                return self.value
+        value = session.exec(select([func.max(StoreStatus.timestamp_utc)])).first()
+        with self.lock:
+            self.value = value if self.value is None or value is None else max(self.value, value)
+            self.loaded_at = time.monotonic()
+            return self.value
+
+    def refresh(self, session: Session) -> Optional[datetime]:
+        """Read the watermark from the db even if the cached one hasn't expired"""
+        self.invalidate()
+        return self.get(session)
+
+    def advance(self, timestamp_utc: datetime):
+        """Polls up to timestamp_utc were committed"""
+        if timestamp_utc.tzinfo is not None:
+            timestamp_utc = timestamp_utc.astimezone(timezone.utc).replace(tzinfo=None)
+        with self.lock:
+            if self.value is None or timestamp_utc > self.value:
+                self.value = timestamp_utc
+
+    def invalidate(self):
+        with self.lock:
+            self.loaded_at = None
+
+
+store_status_watermark = Watermark(settings.WATERMARK_TTL_SECONDS)
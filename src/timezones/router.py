@@ -1,6 +1,9 @@
 from fastapi import APIRouter, Depends, status, HTTPException
 from src.timezones.models import Timezone
 from src.db import get_session
+from src.report.version import bump_metadata_version
+from src.rollup.utils import mark_store_dirty
+from src.store.cache import store_metadata_cache
 from sqlmodel import Session
 
 from sqlalchemy.exc import IntegrityError
@@ -15,7 +18,10 @@ def create_timezone(*, session: Session = Depends(get_session), timezone: Timezo
     db_timezone = Timezone.from_orm(timezone)
     try:
         session.add(db_timezone)
+        mark_store_dirty(session, db_timezone.store_id)
+        bump_metadata_version(session)
         session.commit()
+        store_metadata_cache.invalidate(db_timezone.store_id)
         session.refresh(db_timezone)
         return db_timezone
     except IntegrityError as e:
@@ -0,0 +1,37 @@
+from __future__ import annotations
+
+from sqlmodel import Session
+
+from src.db import dialect_insert
+from src.lazy import lazy_import
+from src.report.version import bump_metadata_version
+from src.rollup.utils import mark_stores_dirty
+from src.store.cache import store_metadata_cache
+from src.store.utils import INSERT_BATCH_SIZE, insert_missing_stores
+from src.timezones.models import Timezone
+
+pd = lazy_import("pandas")
+
+
+def bulk_insert_timezones(session: Session, df: pd.DataFrame) -> int:
+    """Insert (store_id, timezone_str) rows, stores that already have a timezone are skipped.
+
+    Returns the number of rows inserted.
+    """
+    if df.empty:
+        return 0
+    df = df.assign(store_id=df["store_id"].astype(str).str.strip(),
+                   timezone_str=df["timezone_str"].astype(str).str.strip())
+    store_ids = sorted(df["store_id"].unique().tolist())
+    insert_missing_stores(session, store_ids)
+
+    statement = dialect_insert(Timezone.__table__).on_conflict_do_nothing(index_elements=["store_id"])
+    rows = df[["store_id", "timezone_str"]].to_dict(orient="records")
+    inserted = 0
+    for i in range(0, len(rows), INSERT_BATCH_SIZE):
+        inserted += session.execute(statement, rows[i:i + INSERT_BATCH_SIZE]).rowcount
+    mark_stores_dirty(session, store_ids)
+    bump_metadata_version(session)
+    session.commit()
+    store_metadata_cache.invalidate_many(store_ids)
+    return inserted
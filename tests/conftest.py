@@ -0,0 +1,57 @@
+"""Every test runs against the same sqlite database in a temporary directory, emptied before each test."""
+import os
+import tempfile
+
+DATA_DIR = tempfile.mkdtemp(prefix="store-monitor-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(DATA_DIR, 'store-monitor.db')}"
+os.environ["REPORT_DIR"] = os.path.join(DATA_DIR, "reports")
+os.environ.setdefault("PORT", "8000")
+
+import json  # noqa: E402
+from datetime import datetime, timedelta  # noqa: E402
+from typing import List  # noqa: E402
+
+import pytest  # noqa: E402
+from sqlmodel import Session, SQLModel  # noqa: E402
+
+from src.db import engine, init_db  # noqa: E402
+from src.migrations.models import SchemaMigration  # noqa: E402
+from src.report.models import DataVersion  # noqa: E402
+from src.store.cache import store_metadata_cache  # noqa: E402
+from src.store_status.utils import ingest_store_statuses  # noqa: E402
+from src.store_status.watermark import store_status_watermark  # noqa: E402
+
+# most recent poll of the polls added by the tests.
+END_UTC = datetime(2023, 1, 25, 18)
+# tables left alone between tests: the applied migrations and the single data version row.
+KEPT_TABLES = {SchemaMigration.__tablename__, DataVersion.__tablename__}
+
+
+@pytest.fixture(scope="session")
+def database():
+    init_db()
+
+
+@pytest.fixture
+def session(database):
+    with engine.begin() as connection:
+        for table in reversed(SQLModel.metadata.sorted_tables):
+            if table.name not in KEPT_TABLES:
+                connection.execute(table.delete())
+    store_metadata_cache.clear()
+    store_status_watermark.value = None
+    store_status_watermark.invalidate()
+    with Session(engine) as session:
+        yield session
+
+
+def hourly_polls(store_id: str, days: int = 9, end_utc: datetime = END_UTC) -> List[dict]:
+    """A poll every hour up to end_utc, inactive for the first half of them and one hour in five after"""
+    hours = days * 24
+    return [{"store_id": store_id, "status": "inactive" if hour < hours // 2 or hour % 5 == 0 else "active",
+             "timestamp_utc": (end_utc - timedelta(hours=hours - 1 - hour)).isoformat()} for hour in range(hours)]
+
+
+def add_polls(session: Session, polls: List[dict]) -> dict:
+    """Ingest polls like POST /store-status/bulk"""
+    return ingest_store_statuses(session, json.dumps(polls).encode(), "application/json")
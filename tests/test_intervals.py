@@ -0,0 +1,87 @@
+from datetime import timedelta
+
+from sqlmodel import select
+
+import src.store_status.utils
+from src.db import engine
+from src.store_status.intervals import Run, rebuild_intervals, run_lengths
+from src.store_status.live import LiveStatus, to_microseconds
+from src.store_status.models import StoreStatus, StoreStatusInterval
+from tests.conftest import END_UTC, add_polls
+
+T = [END_UTC - timedelta(hours=10 - i) for i in range(11)]
+
+
+def ingest(session, *polls):
+    """Ingest (status, timestamp_utc) polls of store-1"""
+    return add_polls(session, [{"store_id": "store-1", "status": status, "timestamp_utc": timestamp_utc.isoformat()}
+                               for status, timestamp_utc in polls])
+
+
+def intervals(session):
+    statement = select(StoreStatusInterval.start_utc, StoreStatusInterval.end_utc, StoreStatusInterval.status,
+                       StoreStatusInterval.poll_count).order_by(StoreStatusInterval.store_id,
+                                                                StoreStatusInterval.start_utc)
+    return [tuple(row) for row in session.exec(statement)]
+
+
+def test_run_lengths():
+    assert run_lengths([]) == []
+    assert run_lengths([(T[0], "active"), (T[1], "active"), (T[2], "inactive"), (T[3], "active")]) == [
+        Run(T[0], T[1], "active", 2), Run(T[2], T[2], "inactive", 1), Run(T[3], T[3], "active", 1)]
+
+
+def test_new_polls_extend_the_last_interval(session):
+    ingest(session, ("active", T[0]), ("active", T[1]), ("inactive", T[2]))
+    assert intervals(session) == [(T[0], T[1], "active", 2), (T[2], T[2], "inactive", 1)]
+    ingest(session, ("inactive", T[3]), ("active", T[4]))
+    assert intervals(session) == [(T[0], T[1], "active", 2), (T[2], T[3], "inactive", 2), (T[4], T[4], "active", 1)]
+    # polls that were already stored change nothing.
+    assert ingest(session, ("active", T[3]), ("active", T[4]))["inserted"] == 0
+    assert intervals(session)[-2:] == [(T[2], T[3], "inactive", 2), (T[4], T[4], "active", 1)]
+
+
+def test_late_polls(session):
+    ingest(session, ("active", T[0]), ("active", T[2]), ("active", T[4]), ("inactive", T[6]))
+    # splits an interval.
+    ingest(session, ("inactive", T[1]))
+    assert intervals(session) == [(T[0], T[0], "active", 1), (T[1], T[1], "inactive", 1),
+                                  (T[2], T[4], "active", 2), (T[6], T[6], "inactive", 1)]
+    # joins the interval after it.
+    ingest(session, ("inactive", T[5]))
+    assert intervals(session) == [(T[0], T[0], "active", 1), (T[1], T[1], "inactive", 1),
+                                  (T[2], T[4], "active", 2), (T[5], T[6], "inactive", 2)]
+    # joins the intervals around it.
+    ingest(session, ("active", T[1] - timedelta(minutes=30)), ("inactive", T[1] + timedelta(minutes=30)))
+    assert intervals(session)[:3] == [(T[0], T[1] - timedelta(minutes=30), "active", 2),
+                                      (T[1], T[1] + timedelta(minutes=30), "inactive", 2), (T[2], T[4], "active", 2)]
+
+
+def test_rebuilt_intervals_match_the_maintained_ones(session):
+    statuses = ["active", "active", "inactive", "active", "inactive", "inactive", "active", "active", "inactive"]
+    for i in [0, 2, 4, 6, 8, 1, 7, 3, 5]:
+        ingest(session, (statuses[i], T[i]))
+    add_polls(session, [{"store_id": "store-2", "status": "active", "timestamp_utc": T[0].isoformat()}])
+    maintained = intervals(session)
+    assert maintained[:5] == [(T[0], T[1], "active", 2), (T[2], T[2], "inactive", 1), (T[3], T[3], "active", 1),
+                              (T[4], T[5], "inactive", 2), (T[6], T[7], "active", 2)]
+    session.commit()
+    with engine.begin() as connection:
+        assert rebuild_intervals(connection) == len(maintained)
+    assert intervals(session) == maintained
+
+
+def test_polls_at_the_same_time(session, monkeypatch):
+    """Of two polls of a store at the same time, the intervals and the live status follow the one stored"""
+    buffer = LiveStatus(4)
+    buffer.loaded = True
+    monkeypatch.setattr(src.store_status.utils, "live_status", buffer)
+    polls = [{"store_id": "store-1", "status": status, "timestamp_utc": END_UTC.isoformat()}
+             for status in ["inactive", "active"]]
+    assert add_polls(session, polls) == {"received": 2, "inserted": 1, "skipped": 1}
+
+    assert session.exec(select(StoreStatus.status)).all() == ["inactive"]
+    intervals = session.exec(select(StoreStatusInterval.start_utc, StoreStatusInterval.end_utc,
+                                    StoreStatusInterval.status, StoreStatusInterval.poll_count)).all()
+    assert intervals == [(END_UTC, END_UTC, "inactive", 1)]
+    assert buffer.polls(buffer.rows["store-1"]) == ([to_microseconds(END_UTC)], [False])
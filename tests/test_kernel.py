@@ -0,0 +1,89 @@
+from datetime import date, datetime, time, timezone
+
+import numpy as np
+import pytest
+
+from src.business_hours.models import BusinessHours
+from src.report.batch import StoreReportData
+from src.report.engine import compute_uptime, local_day_window
+from src.report.kernel import uptime_downtime
+from src.store.cache import build_metadata
+from src.store_status.models import StoreStatus
+
+NEW_YORK = "America/New_York"
+# 2023-03-12 has 23 hours in New York, 2023-11-05 has 25.
+SPRING_FORWARD = date(2023, 3, 12)
+FALL_BACK = date(2023, 11, 5)
+
+
+def kernel(polls, intervals, windows):
+    """uptime_downtime of stores given as lists of (time, active) polls, (start, end) intervals and windows"""
+    def csr(rows):
+        return np.cumsum([0] + [len(store_rows) for store_rows in rows])
+
+    flat_polls = [poll for store_polls in polls for poll in store_polls]
+    flat_intervals = [interval for store_intervals in intervals for interval in store_intervals]
+    uptime, downtime = uptime_downtime(
+        [t for t, _ in flat_polls], [active for _, active in flat_polls], csr(polls),
+        [start for start, _ in flat_intervals], [end for _, end in flat_intervals], csr(intervals), windows)
+    return uptime.tolist(), downtime.tolist()
+
+
+@pytest.mark.parametrize("polls, intervals, windows, expected", [
+    # a poll's status holds until the next poll.
+    ([(0, True), (600, False), (1200, True)], [(0, 1800)], [(0, 1800)], ([20], [10])),
+    # inactive before the first poll, and without any poll.
+    ([(900, True)], [(0, 1800)], [(0, 1800)], ([15], [15])),
+    ([], [(0, 1800)], [(0, 1800)], ([0], [30])),
+    # a poll before the window carries its status in.
+    ([(-600, True), (300, False)], [(0, 600)], [(0, 600)], ([5], [5])),
+    # only business hours count, windows clip them.
+    ([(0, True)], [(0, 600), (1200, 1800)], [(0, 1800)], ([20], [0])),
+    ([(0, True), (1800, False)], [(0, 3600)], [(0, 1800), (1800, 3600), (900, 2700)], ([30, 0, 15], [0, 30, 15])),
+    ([(0, True)], [(0, 600)], [(600, 1200)], ([0], [0])),
+])
+def test_single_store(polls, intervals, windows, expected):
+    uptime, downtime = kernel([polls], [intervals], [windows])
+    assert (uptime[0], downtime[0]) == expected
+
+
+def test_stores_polled_at_the_same_times_stay_apart():
+    uptime, downtime = kernel([[(0, True)], [(0, False), (300, True)], []],
+                              [[(0, 600)], [(0, 600)], [(0, 600)]], [[(0, 600)]] * 3)
+    assert uptime == [[10], [5], [0]]
+    assert downtime == [[0], [5], [10]]
+
+
+def business_hours(*rows):
+    return [BusinessHours(day_of_week=day, start_time_local=time(start), end_time_local=time(end))
+            for day, start, end in rows]
+
+
+def day_uptime(days, hours=(), polls=((datetime(2023, 1, 1), "active"),)):
+    """Uptime and downtime minutes of a New York store in each of the local days"""
+    metadata = build_metadata("store-1", NEW_YORK, hours)
+    events = [StoreStatus(store_id="store-1", timestamp_utc=timestamp_utc, status=status)
+              for timestamp_utc, status in polls]
+    windows = [local_day_window(day, metadata.zone) for day in days]
+    uptime, downtime = compute_uptime([StoreReportData("store-1", metadata, events)], [windows])
+    return uptime[0].tolist(), downtime[0].tolist()
+
+
+def test_days_around_daylight_saving_changes():
+    assert day_uptime([SPRING_FORWARD, FALL_BACK]) == ([23 * 60, 25 * 60], [0, 0])
+    # Sunday 01:00 to 04:00 local time is 2 hours long on the day the clocks go forward.
+    assert day_uptime([SPRING_FORWARD], business_hours((6, 1, 4))) == ([120], [0])
+    assert day_uptime([FALL_BACK], business_hours((6, 1, 4))) == ([240], [0])
+
+
+def test_overnight_business_hours():
+    """Saturday 22:00 to 02:00 counts 2 hours on each day"""
+    saturday = date(2023, 3, 11)
+    polls = [(datetime(2023, 3, 12, 4, tzinfo=timezone.utc), "active"),
+             (datetime(2023, 3, 12, 6, tzinfo=timezone.utc), "inactive")]
+    # active from Saturday 23:00 to Sunday 01:00 local time.
+    assert day_uptime([saturday, SPRING_FORWARD], business_hours((5, 22, 2)), polls) == ([60, 60], [60, 60])
+
+
+def test_store_without_polls():
+    assert day_uptime([SPRING_FORWARD], business_hours((6, 9, 17)), polls=[]) == ([0], [480])
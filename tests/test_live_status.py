@@ -0,0 +1,34 @@
+import json
+
+from sqlalchemy import event
+from sqlmodel import Session
+
+import src.store_status.router
+from src.db import engine
+from src.store.cache import store_metadata_cache
+from src.store_status.live import LiveStatus
+from src.store_status.router import get_live_statuses
+from tests.conftest import add_polls, hourly_polls
+
+
+def test_warm_live_status_skips_the_database(session, monkeypatch):
+    add_polls(session, hourly_polls("store-1") + hourly_polls("store-2"))
+    buffer = LiveStatus(4)
+    buffer.rebuild(session)
+    monkeypatch.setattr(src.store_status.router, "live_status", buffer)
+    store_metadata_cache.warm_up(session)
+
+    statements = []
+
+    def listener(connection, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        with Session(engine) as request_session:
+            response = get_live_statuses(session=request_session, store_id=None, at=None, summary=False)
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+
+    assert statements == []
+    assert [row["store_id"] for row in json.loads(response.body)["store_statuses"]] == ["store-1", "store-2"]
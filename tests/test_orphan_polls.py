@@ -0,0 +1,49 @@
+import asyncio
+from datetime import timedelta
+
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from src.config import settings
+from src.db import dispose_async_engine, get_async_engine
+from src.report.batch import get_max_timestamp
+from src.report.utils import iter_report_rows
+from src.store.models import Store
+from src.store_status.models import StoreStatus
+from src.store_status.router import create_store
+from src.store_status.utils import on_polls_inserted
+from tests.conftest import END_UTC, add_polls, hourly_polls
+
+ORPHAN_STORE_ID = "store-0"
+
+
+def test_poll_of_a_missing_store(session, monkeypatch):
+    """A poll whose store doesn't exist is left out, instead of hiding the events of every store after it"""
+    add_polls(session, hourly_polls("store-1") + hourly_polls("store-2"))
+    max_timestamp_utc = get_max_timestamp(session)
+    for use_rollup in [False, True]:
+        monkeypatch.setattr(settings, "REPORT_USE_ROLLUP", use_rollup)
+        expected = list(iter_report_rows(session, max_timestamp_utc))
+        session.commit()
+
+        timestamp_utc = END_UTC - timedelta(minutes=30 + use_rollup)
+        session.add(StoreStatus(store_id=ORPHAN_STORE_ID, status="active", timestamp_utc=timestamp_utc))
+        on_polls_inserted(session, [(ORPHAN_STORE_ID, timestamp_utc, "active")])
+        session.commit()
+
+        assert list(iter_report_rows(session, max_timestamp_utc)) == expected
+        assert expected[0]["uptime_last_hour"] > 0
+
+
+async def post_store_status(store_status: StoreStatus):
+    """POST /store-status/, closing the async engine's connections once done"""
+    try:
+        async with AsyncSession(get_async_engine(), expire_on_commit=False) as session:
+            return await create_store(session=session, store_status=store_status)
+    finally:
+        await dispose_async_engine()
+
+
+def test_single_poll_creates_its_store(session):
+    asyncio.run(post_store_status(StoreStatus(store_id="store-3", status="active", timestamp_utc=END_UTC)))
+    assert session.exec(select(Store.store_id)).all() == ["store-3"]
@@ -0,0 +1,29 @@
+from src.config import settings
+from src.report.batch import get_max_timestamp
+from src.report.parallel import shard_store_ranges
+from src.report.utils import iter_fleet_reports, iter_report_rows
+from src.store.models import Store
+from tests.conftest import add_polls, hourly_polls
+
+
+def test_shard_store_ranges():
+    assert shard_store_ranges(["a", "b", "c", "d", "e"], 2) == [("a", "b"), ("c", "d"), ("e", "e")]
+    assert shard_store_ranges(["a", "b"], 2) == [("a", "b")]
+    assert shard_store_ranges([], 2) == []
+
+
+def test_parallel_report_matches_the_serial_one(session, monkeypatch):
+    add_polls(session, [poll for i in range(5) for poll in hourly_polls(f"store-{i}")])
+    session.add(Store(store_id="store-9"))
+    session.commit()
+    max_timestamp_utc = get_max_timestamp(session)
+    serial = list(iter_report_rows(session, max_timestamp_utc))
+    session.commit()
+
+    monkeypatch.setattr(settings, "REPORT_WORKERS", 2)
+    monkeypatch.setattr(settings, "REPORT_SHARD_SIZE", 2)
+    assert list(iter_fleet_reports("parallel-check", session, max_timestamp_utc, None, None)) == serial
+    assert [row["store_id"] for row in serial] == [f"store-{i}" for i in range(5)] + ["store-9"]
+    # a store without polls is down whenever it's open, all week by default.
+    assert serial[-1] == {"store_id": "store-9", "uptime_last_hour": 0, "uptime_last_day": 0, "uptime_last_week": 0,
+                          "downtime_last_hour": 60, "downtime_last_day": 24, "downtime_last_week": 168}
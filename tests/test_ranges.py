@@ -0,0 +1,61 @@
+from datetime import datetime
+
+import pytest
+
+from src.config import settings
+from src.report.models import Granularity
+from src.report.ranges import ReportRange, iter_range_report
+from src.report.version import get_data_version
+from src.store.models import Store
+from src.timezones.models import Timezone
+from src.timezones.router import create_timezone
+from tests.conftest import add_polls
+
+START_UTC = datetime(2023, 3, 11, 5)
+END_UTC = datetime(2023, 3, 14, 4)
+
+
+@pytest.fixture
+def polls(session, tmp_path, monkeypatch):
+    """A store in New York, where the clocks go forward at 02:00 on Sunday 2023-03-12, and a store without polls"""
+    monkeypatch.setattr(settings, "PREFIX_SUM_DIR", str(tmp_path))
+    add_polls(session, [{"store_id": "store-1", "status": status, "timestamp_utc": timestamp_utc.isoformat()}
+                        for status, timestamp_utc in [("active", START_UTC), ("inactive", datetime(2023, 3, 12, 12)),
+                                                      ("active", datetime(2023, 3, 13, 4)), ("active", END_UTC)]])
+    session.add(Store(store_id="store-2"))
+    session.commit()
+    create_timezone(session=session, timezone=Timezone(store_id="store-1", timezone_str="America/New_York"))
+    return session
+
+
+def range_report(session, start_utc: datetime, end_utc: datetime, granularity: Granularity) -> dict:
+    """store_id -> [(period_start, period_end, uptime, downtime)]"""
+    rows = {}
+    for store_rows in iter_range_report(session, ReportRange(start_utc, end_utc, granularity),
+                                        get_data_version(session)):
+        for row in store_rows:
+            rows.setdefault(row["store_id"], []).append(
+                (row["period_start"], row["period_end"], row["uptime"], row["downtime"]))
+    return rows
+
+
+def test_days(polls):
+    rows = range_report(polls, START_UTC, END_UTC, Granularity.day)
+    assert rows["store-1"] == [
+        ("2023-03-11T00:00:00-05:00", "2023-03-12T00:00:00-05:00", 24, 0),
+        # active until 08:00, a 23-hour day.
+        ("2023-03-12T00:00:00-05:00", "2023-03-13T00:00:00-04:00", 7, 16),
+        ("2023-03-13T00:00:00-04:00", "2023-03-14T00:00:00-04:00", 24, 0),
+    ]
+    # down whenever it's open, all week by default.
+    assert sum(uptime for _, _, uptime, _ in rows["store-2"]) == 0
+    assert sum(downtime for _, _, _, downtime in rows["store-2"]) == 71
+
+
+def test_hours_and_total(polls):
+    rows = range_report(polls, datetime(2023, 3, 12, 6), datetime(2023, 3, 12, 14), Granularity.hour)
+    assert [(start[11:], uptime, downtime) for start, _, uptime, downtime in rows["store-1"]] == [
+        ("01:00:00-05:00", 60, 0), ("03:00:00-04:00", 60, 0), ("04:00:00-04:00", 60, 0), ("05:00:00-04:00", 60, 0),
+        ("06:00:00-04:00", 60, 0), ("07:00:00-04:00", 60, 0), ("08:00:00-04:00", 0, 60), ("09:00:00-04:00", 0, 60)]
+    rows = range_report(polls, START_UTC, END_UTC, Granularity.total)
+    assert rows["store-1"] == [("2023-03-11T00:00:00-05:00", "2023-03-14T00:00:00-04:00", 55, 16)]
@@ -0,0 +1,57 @@
+import os
+
+import pytest
+
+from src.config import settings
+from src.report.storage import (ColumnarReport, ReportCache, get_columnar_dirname, iter_stored_rows,
+                                load_columnar_report, report_cache, store_report_to_disk)
+from src.store.models import STORE_ID_MAX_LENGTH
+from tests.conftest import add_polls, hourly_polls
+
+
+def report_rows(count: int):
+    return [{"store_id": f"store-{i}", "uptime_last_hour": 60.0, "uptime_last_day": 20.0, "uptime_last_week": 140.0,
+             "downtime_last_hour": 0.0, "downtime_last_day": 4.0, "downtime_last_week": float(i)}
+            for i in range(count)]
+
+
+def test_reports_are_written_to_the_report_dir(session):
+    rows = report_rows(1)
+    assert store_report_to_disk("report-dir-check", rows) == 1
+    assert os.path.isdir(os.path.join(settings.REPORT_DIR, "report-report-dir-check"))
+    assert not os.path.exists("report-report-dir-check")
+    assert list(iter_stored_rows("report-dir-check")) == rows
+
+
+def test_store_ids_too_long_for_reports_are_rejected(session):
+    with pytest.raises(ValueError):
+        add_polls(session, hourly_polls("s" * (STORE_ID_MAX_LENGTH + 1), days=1))
+    session.rollback()
+    assert add_polls(session, hourly_polls("s" * STORE_ID_MAX_LENGTH, days=1))["inserted"] == 24
+
+
+def test_cached_reports_are_paged_from_their_columns(session):
+    rows = report_rows(5)
+    store_report_to_disk("cache-check", rows)
+    assert load_columnar_report("cache-check", 1, 2) == rows[1:3]
+    cached = report_cache.get("cache-check")
+    assert isinstance(cached, ColumnarReport)
+    assert load_columnar_report("cache-check", 3) == rows[3:]
+    assert load_columnar_report("cache-check", 10, 2) == []
+
+
+def test_report_cache_bounds(session):
+    reports = {}
+    for report_id in ["bound-1", "bound-2", "bound-3"]:
+        store_report_to_disk(report_id, report_rows(2))
+        reports[report_id] = ColumnarReport(get_columnar_dirname(report_id))
+    cache = ReportCache(max_bytes=2 * reports["bound-1"].nbytes, max_reports=2)
+    for report_id, report in reports.items():
+        cache.put(report_id, report)
+    assert list(cache.entries) == ["bound-2", "bound-3"]
+    assert cache.size == 2 * reports["bound-1"].nbytes
+
+    cache = ReportCache(max_bytes=reports["bound-1"].nbytes, max_reports=2)
+    cache.put("bound-1", reports["bound-1"])
+    cache.put("bound-2", reports["bound-2"])
+    assert list(cache.entries) == ["bound-2"]
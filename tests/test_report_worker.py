@@ -0,0 +1,25 @@
+import fcntl
+import threading
+
+from src.report.storage import make_report_dir, report_path
+from src.report.worker import WORKER_LOCK_NAME, wait_for_lock
+
+
+def test_one_worker_process_runs_reports():
+    """The worker processes of a multi-process server wait for the one holding the lock"""
+    make_report_dir()
+    with open(report_path(WORKER_LOCK_NAME), "a") as running, open(report_path(WORKER_LOCK_NAME), "a") as waiting:
+        stop = threading.Event()
+        assert wait_for_lock(running, stop, 0.01)
+        stop.set()
+        assert not wait_for_lock(waiting, stop, 0.01)
+
+        stop.clear()
+        taken = []
+        thread = threading.Thread(target=lambda: taken.append(wait_for_lock(waiting, stop, 0.01)))
+        thread.start()
+        thread.join(0.1)
+        assert thread.is_alive()
+        fcntl.flock(running, fcntl.LOCK_UN)
+        thread.join(1)
+        assert taken == [True]
@@ -0,0 +1,70 @@
+from datetime import date, datetime
+
+from sqlmodel import select
+
+from src.config import settings
+from src.report.batch import get_max_timestamp
+from src.report.utils import iter_report_rows
+from src.rollup.models import DailyUptime
+from src.rollup.utils import refresh_report_days
+from src.timezones.models import Timezone
+from src.timezones.router import create_timezone
+from tests.conftest import add_polls
+
+
+def poll(status: str, timestamp_utc: datetime) -> dict:
+    return {"store_id": "store-1", "status": status, "timestamp_utc": timestamp_utc.isoformat()}
+
+
+def rollup_days(session) -> dict:
+    """local_date -> (uptime_minutes, downtime_minutes, dirty) of store-1"""
+    statement = select(DailyUptime.local_date, DailyUptime.uptime_minutes, DailyUptime.downtime_minutes,
+                       DailyUptime.dirty).where(DailyUptime.store_id == "store-1")
+    return {row.local_date: (row.uptime_minutes, row.downtime_minutes, row.dirty) for row in session.exec(statement)}
+
+
+def test_days_are_recomputed_after_late_polls(session):
+    # America/Chicago by default: 06:00 utc is midnight.
+    add_polls(session, [poll("active", datetime(2023, 1, 23, 6)), poll("inactive", datetime(2023, 1, 23, 18)),
+                        poll("active", datetime(2023, 1, 25, 18))])
+    max_timestamp_utc = get_max_timestamp(session)
+    refresh_report_days(session, max_timestamp_utc)
+    days = rollup_days(session)
+    assert days[date(2023, 1, 23)] == (720, 720, False)
+    assert days[date(2023, 1, 24)] == (0, 1440, False)
+    # before the first poll.
+    assert days[date(2023, 1, 22)] == (0, 1440, False)
+
+    # a late poll at the start of the 24th only dirties the days its status holds over.
+    add_polls(session, [poll("active", datetime(2023, 1, 24, 6))])
+    days = rollup_days(session)
+    assert days[date(2023, 1, 24)][2] and days[date(2023, 1, 25)][2]
+    assert not days[date(2023, 1, 23)][2]
+    refresh_report_days(session, max_timestamp_utc)
+    assert rollup_days(session)[date(2023, 1, 24)] == (1440, 0, False)
+
+
+def test_timezone_change_recomputes_every_day(session):
+    add_polls(session, [poll("active", datetime(2023, 3, 10, 12)), poll("active", datetime(2023, 3, 14, 12))])
+    max_timestamp_utc = get_max_timestamp(session)
+    refresh_report_days(session, max_timestamp_utc)
+    session.commit()
+    create_timezone(session=session, timezone=Timezone(store_id="store-1", timezone_str="America/New_York"))
+    assert all(dirty for _, _, dirty in rollup_days(session).values())
+
+    refresh_report_days(session, max_timestamp_utc)
+    days = rollup_days(session)
+    # the clocks went forward on the 12th in New York.
+    assert days[date(2023, 3, 11)] == (1440, 0, False)
+    assert days[date(2023, 3, 12)] == (1380, 0, False)
+    assert days[date(2023, 3, 13)] == (1440, 0, False)
+
+
+def test_report_from_the_rollup_matches_the_report_from_polls(session, monkeypatch):
+    add_polls(session, [poll(status, datetime(2023, 3, day, hour)) for day in range(5, 15) for hour, status in
+                        [(3, "active"), (9, "inactive"), (17, "active"), (22, "inactive")]])
+    create_timezone(session=session, timezone=Timezone(store_id="store-1", timezone_str="America/New_York"))
+    max_timestamp_utc = get_max_timestamp(session)
+    from_rollup = list(iter_report_rows(session, max_timestamp_utc))
+    monkeypatch.setattr(settings, "REPORT_USE_ROLLUP", False)
+    assert list(iter_report_rows(session, max_timestamp_utc)) == from_rollup
@@ -0,0 +1,60 @@
+from datetime import date, datetime, time, timezone
+from zoneinfo import ZoneInfo
+
+from src.business_hours.models import BusinessHours
+from src.business_hours.schedule import SECONDS_IN_DAY, SECONDS_IN_WEEK, WeeklySchedule
+from src.report.engine import business_intervals_utc
+
+HOUR = 3600
+
+
+def schedule(*rows) -> WeeklySchedule:
+    return WeeklySchedule.from_business_hours(
+        BusinessHours(day_of_week=day, start_time_local=time(*start), end_time_local=time(*end))
+        for day, start, end in rows)
+
+
+def test_compiled_intervals():
+    # several intervals a day, overlapping ones merged.
+    assert schedule((0, (9,), (12,)), (0, (13,), (17,)), (0, (11,), (14,))).intervals == [(9 * HOUR, 17 * HOUR)]
+    # overnight: Tuesday 22:00 to Wednesday 02:00.
+    assert schedule((1, (22,), (2,))).intervals == [(SECONDS_IN_DAY + 22 * HOUR, 2 * SECONDS_IN_DAY + 2 * HOUR)]
+    # Sunday night wraps around to Monday morning.
+    assert schedule((6, (22,), (2,))).intervals == [(0, 2 * HOUR), (6 * SECONDS_IN_DAY + 22 * HOUR, SECONDS_IN_WEEK)]
+    # the same start and end time is open around the clock.
+    assert schedule((2, (9,), (9,))).intervals == [(2 * SECONDS_IN_DAY + 9 * HOUR, 3 * SECONDS_IN_DAY + 9 * HOUR)]
+    assert schedule((0, (0,), (23, 59, 59))).open_seconds_per_week == SECONDS_IN_DAY - 1
+    # no business hours: open all week.
+    assert schedule().intervals == [(0, SECONDS_IN_WEEK)]
+
+
+def test_open_seconds():
+    sunday_night = schedule((6, (22,), (2,)), (0, (9,), (17,)))
+    assert sunday_night.open_seconds_per_week == 12 * HOUR
+    assert sunday_night.is_open(HOUR) and sunday_night.is_open(SECONDS_IN_WEEK - 1)
+    assert not sunday_night.is_open(2 * HOUR) and not sunday_night.is_open(SECONDS_IN_DAY + HOUR)
+    assert sunday_night.is_open(SECONDS_IN_WEEK + 10 * HOUR)
+    assert sunday_night.open_seconds(0, 10 * HOUR) == 3 * HOUR
+    assert sunday_night.open_seconds(6 * SECONDS_IN_DAY, SECONDS_IN_WEEK + 12 * HOUR) == 7 * HOUR
+    # over several weeks.
+    assert sunday_night.open_seconds(HOUR, 3 * SECONDS_IN_WEEK + HOUR) == 36 * HOUR
+    assert sunday_night.open_seconds(5 * HOUR, 5 * HOUR) == 0
+
+
+def utc_intervals(schedule_, timezone_str, first_day, last_day):
+    return [(datetime.fromtimestamp(start, timezone.utc).replace(tzinfo=None),
+             datetime.fromtimestamp(end, timezone.utc).replace(tzinfo=None))
+            for start, end in business_intervals_utc(schedule_, ZoneInfo(timezone_str), first_day, last_day)]
+
+
+def test_overnight_hours_across_daylight_saving_changes():
+    # Saturday 22:00 to Sunday 03:00 in New York, the clocks go forward at 02:00 on Sunday 2023-03-12.
+    overnight = schedule((5, (22,), (3,)))
+    assert utc_intervals(overnight, "America/New_York", date(2023, 3, 11), date(2023, 3, 12)) == [
+        (datetime(2023, 3, 12, 3), datetime(2023, 3, 12, 7))]
+    # and back at 02:00 on Sunday 2023-11-05.
+    assert utc_intervals(overnight, "America/New_York", date(2023, 11, 4), date(2023, 11, 5)) == [
+        (datetime(2023, 11, 5, 2), datetime(2023, 11, 5, 8))]
+    # a range starting on Sunday only gets the part of Saturday's hours after midnight.
+    assert utc_intervals(overnight, "America/New_York", date(2023, 3, 12), date(2023, 3, 12)) == [
+        (datetime(2023, 3, 12, 5), datetime(2023, 3, 12, 7))]
@@ -0,0 +1,62 @@
+from datetime import timedelta
+
+from sqlalchemy import update
+
+from src.config import settings
+from src.db import utcnow
+from src.report.batch import get_max_timestamp
+from src.report.models import ReportShard, ReportState
+from src.report.shards import claim_shards, complete_shard, create_shards, list_shards, release_shards
+from src.report.utils import iter_fleet_reports, iter_report_rows
+from src.store.models import Store
+from tests.conftest import END_UTC, add_polls, hourly_polls
+
+RANGES = [("store-0", "store-1"), ("store-2", "store-3"), ("store-4", "store-4")]
+
+
+def test_shards_are_leased_once(session):
+    assert create_shards(session, "report-1", RANGES, END_UTC, None) == 3
+    first = claim_shards(session, "worker-a", 2)
+    assert [(lease.shard, lease.store_range, lease.attempt) for lease in first] == [
+        (0, RANGES[0], 1), (1, RANGES[1], 1)]
+    assert [lease.shard for lease in claim_shards(session, "worker-b", 2)] == [2]
+    assert claim_shards(session, "worker-b", 2) == []
+
+    # worker-a stopped renewing shard 0: worker-b takes it over, and worker-a can't complete it anymore.
+    session.execute(update(ReportShard).where(ReportShard.shard == 0).values(
+        lease_expires_at=utcnow() - timedelta(seconds=1)))
+    session.commit()
+    [taken_over] = claim_shards(session, "worker-b", 2)
+    assert (taken_over.shard, taken_over.attempt) == (0, 2)
+    assert not complete_shard(first[0], "worker-a", 2)
+    assert complete_shard(taken_over, "worker-b", 2)
+    assert complete_shard(first[1], "worker-a", 2)
+
+    # shards of a stopping worker are queued again.
+    release_shards(session, "worker-b")
+    states = {shard.shard: shard.state for shard in list_shards(session, "report-1")}
+    assert states == {0: ReportState.complete.value, 1: ReportState.complete.value, 2: ReportState.queued.value}
+
+
+def test_shards_of_the_same_poll_are_kept(session):
+    create_shards(session, "report-1", RANGES, END_UTC, None)
+    claim_shards(session, "worker-a", 1)
+    # queued again after its coordinator stopped, as of the same poll: the claimed shard stays claimed.
+    assert create_shards(session, "report-1", RANGES[:2], END_UTC, None) == 3
+    assert [shard.worker_id for shard in list_shards(session, "report-1")] == ["worker-a", None, None]
+    assert create_shards(session, "report-1", RANGES[:2], END_UTC + timedelta(hours=1), None) == 2
+    assert [shard.worker_id for shard in list_shards(session, "report-1")] == [None, None]
+
+
+def test_distributed_report_matches_the_serial_one(session, monkeypatch):
+    add_polls(session, [poll for i in range(4) for poll in hourly_polls(f"store-{i}")])
+    session.add(Store(store_id="store-4"))
+    session.commit()
+    max_timestamp_utc = get_max_timestamp(session)
+    serial = list(iter_report_rows(session, max_timestamp_utc))
+    session.commit()
+
+    monkeypatch.setattr(settings, "REPORT_SHARD_MODE", "distributed")
+    monkeypatch.setattr(settings, "REPORT_SHARD_SIZE", 2)
+    assert list(iter_fleet_reports("report-1", session, max_timestamp_utc, None, None)) == serial
+    assert list_shards(session, "report-1") == []
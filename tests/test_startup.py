@@ -0,0 +1,13 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_import_main_leaves_numpy_and_pandas_unloaded():
+    """Servers and worker processes only pay for numpy and pandas once a report or an upload needs them"""
+    code = "import sys, main; print(sorted(m for m in ('numpy', 'pandas') if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=os.environ, capture_output=True, text=True,
+                            check=True)
+    assert result.stdout.strip() == "[]"
@@ -0,0 +1,43 @@
+import multiprocessing
+
+from sqlmodel import Session
+
+from src.config import settings
+from src.db import engine
+from src.report.batch import get_max_timestamp
+from src.report.utils import iter_report_rows
+from src.store.cache import store_metadata_cache
+from src.store.utils import DEFAULT_TIMEZONE
+from src.timezones.models import Timezone
+from src.timezones.router import create_timezone
+from tests.conftest import add_polls, hourly_polls
+
+STORE_ID = "store-1"
+TIMEZONE = "Pacific/Kiritimati"
+
+
+def post_timezone(store_id: str, timezone_str: str):
+    """POST /timezone handled by another process, like a server while the test process is its report worker"""
+    with Session(engine) as session:
+        create_timezone(session=session, timezone=Timezone(store_id=store_id, timezone_str=timezone_str))
+
+
+def test_metadata_written_by_another_process(session, monkeypatch):
+    add_polls(session, hourly_polls(STORE_ID) + hourly_polls("store-2"))
+    max_timestamp_utc = get_max_timestamp(session)
+    before = list(iter_report_rows(session, max_timestamp_utc))
+    session.commit()
+    assert store_metadata_cache.get(session, STORE_ID).timezone_str == DEFAULT_TIMEZONE
+
+    process = multiprocessing.get_context("spawn").Process(target=post_timezone, args=(STORE_ID, TIMEZONE))
+    process.start()
+    process.join()
+    assert process.exitcode == 0
+
+    assert store_metadata_cache.get(session, STORE_ID).timezone_str == TIMEZONE
+    from_rollup = list(iter_report_rows(session, max_timestamp_utc))
+    monkeypatch.setattr(settings, "REPORT_USE_ROLLUP", False)
+    from_polls = list(iter_report_rows(session, max_timestamp_utc))
+    assert from_rollup == from_polls
+    assert from_rollup[0] != before[0]
+    assert from_rollup[1] == before[1]
@@ -0,0 +1,30 @@
+from datetime import timedelta
+
+from sqlalchemy.dialects import postgresql
+
+import src.db
+from src.report.batch import get_max_timestamp, load_store_ids, store_events_statement
+from src.report.parallel import shard_store_ranges
+from src.report.utils import iter_report_rows
+from tests.conftest import END_UTC, add_polls, hourly_polls
+
+# ordered differently by code point and by en_US: 'A1' < 'B' < 'a-2' < 'a1' against 'a1' < 'A1' < 'a-2' < 'B'.
+STORE_IDS = ["a1", "A1", "a-2", "B"]
+
+
+def test_merged_queries_order_by_code_point(monkeypatch):
+    monkeypatch.setattr(src.db.engine.dialect, "name", "postgresql")
+    statement = store_events_statement(END_UTC - timedelta(hours=1), END_UTC, ("A1", "a1"))
+    sql = str(statement.compile(dialect=postgresql.dialect()))
+    assert sql.endswith('ORDER BY anon_1.store_id COLLATE "C", anon_1.timestamp_utc')
+    assert '(store.store_id COLLATE "C") >=' in sql
+
+
+def test_every_store_of_every_shard_is_reported(session):
+    add_polls(session, [poll for store_id in STORE_IDS for poll in hourly_polls(store_id)])
+    assert load_store_ids(session) == sorted(STORE_IDS)
+    max_timestamp_utc = get_max_timestamp(session)
+    rows = [row for store_range in shard_store_ranges(load_store_ids(session), 1)
+            for row in iter_report_rows(session, max_timestamp_utc, store_range)]
+    assert [row["store_id"] for row in rows] == sorted(STORE_IDS)
+    assert all(row["uptime_last_week"] > 0 for row in rows)
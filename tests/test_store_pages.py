@@ -0,0 +1,24 @@
+from fastapi import Response
+
+from src.store.models import Store
+from src.store.router import get_stores
+
+
+def get_pages(session, limit: int):
+    """Follow the X-Next-Cursor of GET /store/all from the first page"""
+    pages, after = [], None
+    while True:
+        response = Response()
+        pages.append([store.store_id for store in get_stores(response=response, after=after, skip=0, limit=limit,
+                                                             session=session)])
+        after = response.headers.get("X-Next-Cursor")
+        if after is None:
+            return pages
+
+
+def test_last_page_has_no_cursor(session):
+    session.add_all(Store(store_id=f"store-{i}") for i in range(4))
+    session.commit()
+    assert get_pages(session, 2) == [["store-0", "store-1"], ["store-2", "store-3"]]
+    assert get_pages(session, 3) == [["store-0", "store-1", "store-2"], ["store-3"]]
+    assert get_pages(session, 4) == [["store-0", "store-1", "store-2", "store-3"]]